@@ -0,0 +1,32 @@
+# Generated by Django 5.0.14 on 2026-10-18 18:52
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def keep_latest_default(apps, schema_editor):
+    # Concurrent saves could leave a user with several defaults; keep the
+    # newest so the constraint can be added
+    Address = apps.get_model("accounts", "Address")
+    defaults = Address.objects.filter(is_default=True)
+    latest = defaults.values("user").annotate(latest=Max("id")).values("latest")
+    defaults.exclude(id__in=latest).update(is_default=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.RunPython(keep_latest_default, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="address",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("is_default", True)),
+                fields=("user",),
+                name="one_default_address_per_user",
+            ),
+        ),
+    ]
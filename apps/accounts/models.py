@@ -1,6 +1,6 @@
 # apps/accounts/models.py
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import models, transaction
 from django.utils.translation import gettext_lazy as _
 
 class User(AbstractUser):
@@ -61,9 +61,18 @@ class Address(models.Model):
     
     class Meta:
         verbose_name_plural = 'Addresses'
-        
+        constraints = [
+            # Also the index behind the default address lookup
+            models.UniqueConstraint(
+                fields=['user'], condition=models.Q(is_default=True),
+                name='one_default_address_per_user',
+            ),
+        ]
+
+    @transaction.atomic
     def save(self, *args, **kwargs):
         if self.is_default:
             # I want this to set all other addresses of user to non-default
-            Address.objects.filter(user=self.user).update(is_default=False)
-        super().save(*args, **kwargs)
\ No newline at end of file
+            Address.objects.filter(user=self.user, is_default=True).exclude(
+                pk=self.pk).update(is_default=False)
+        super().save(*args, **kwargs)
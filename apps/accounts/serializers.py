@@ -1,16 +1,22 @@
 from rest_framework import serializers
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from core.authentication import is_revoked, revoke
+from core.serializers import DynamicFieldsMixin
 from django.contrib.auth import get_user_model
 from .models import Address
 
 User = get_user_model()
 
-class AddressSerializer(serializers.ModelSerializer):
+class AddressSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Address
         fields = ['id', 'street_address', 'city', 'state', 'is_default', 'phone_number']
         read_only_fields = ['user']
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     addresses = AddressSerializer(many=True, read_only=True)
     password = serializers.CharField(write_only=True)
 
@@ -19,10 +25,24 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ['id', 'email', 'username', 'password', 'phone_number', 
                  'is_verified', 'first_name', 'last_name', 'addresses']
         read_only_fields = ['is_verified']
+        expandable_fields = ['addresses']
 
     def create(self, validated_data):
         password = validated_data.pop('password')
         user = User(**validated_data)
         user.set_password(password)
         user.save()
-        return user
\ No newline at end of file
+        return user
+
+
+class RevocableTokenRefreshSerializer(TokenRefreshSerializer):
+    """Refuses revoked refresh tokens, and revokes each one once it has been rotated."""
+
+    def validate(self, attrs):
+        refresh = RefreshToken(attrs['refresh'])
+        if is_revoked(refresh):
+            raise InvalidToken('Token has been revoked')
+        data = super().validate(attrs)
+        if jwt_settings.ROTATE_REFRESH_TOKENS:
+            revoke(refresh)
+        return data
@@ -0,0 +1,13 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from core.authentication import mark_user_changed_on_commit
+
+from .models import User
+
+
+# Requests authenticated by token read the user from the cache
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    mark_user_changed_on_commit(instance.pk)
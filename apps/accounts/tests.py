@@ -1,3 +1,163 @@
-from django.test import TestCase
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
 
-# Create your tests here.
+from core import throttling
+from core.tests.utils import QueryPlanMixin, analyze, requires_query_plans
+
+from .models import Address, User
+
+
+class UserFieldsTests(TestCase):
+    url = '/api/accounts/users/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(email=f'user{i}@example.com', username=f'user{i}', password='secret')
+            for i in range(3)
+        ]
+        for user in cls.users:
+            Address.objects.create(
+                user=user, street_address='1 Marina', city='Lagos', state='LA',
+                phone_number='08000000000'
+            )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+
+    def test_list_leaves_addresses_out_unless_expanded(self):
+        with self.assertNumQueries(1):
+            results = self.client.get(self.url).data['results']
+        self.assertNotIn('addresses', results[0])
+
+        with self.assertNumQueries(2):
+            results = self.client.get(self.url, {'expand': 'addresses'}).data['results']
+        self.assertEqual(len(results[0]['addresses']), 1)
+
+    def test_sparse_fields(self):
+        results = self.client.get(self.url, {'fields': 'id,email,addresses.city'}).data['results']
+        self.assertEqual(results[0], {
+            'id': self.users[0].pk, 'email': 'user0@example.com', 'addresses': [{'city': 'Lagos'}],
+        })
+
+    def test_detail_includes_addresses(self):
+        response = self.client.get(self.url + 'me/')
+        self.assertEqual(len(response.data['addresses']), 1)
+
+
+class SignupThrottleTests(TestCase):
+    url = '/api/accounts/users/'
+
+    def setUp(self):
+        throttling.get_limiter.cache_clear()
+
+    def sign_up(self, index):
+        return APIClient().post(self.url, {
+            'email': f'new{index}@example.com', 'username': f'new{index}', 'password': 'secret-password',
+        }, format='json')
+
+    def test_sign_ups_are_limited_per_client(self):
+        rates = {**settings.REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'], 'login': '2/hour'}
+        with override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': rates}):
+            self.assertEqual([self.sign_up(index).status_code for index in range(3)], [201, 201, 429])
+        self.assertEqual(User.objects.filter(username__startswith='new').count(), 2)
+
+
+class TokenAuthTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='buyer@example.com', username='buyer', password='secret')
+
+    def setUp(self):
+        cache.clear()
+        throttling.get_limiter.cache_clear()
+        self.client = APIClient()
+        tokens = self.client.post('/api/auth/login/', {'email': 'buyer@example.com', 'password': 'secret'}).data
+        self.access, self.refresh = tokens['access'], tokens['refresh']
+
+    def me(self, access=None):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer %s' % (access or self.access))
+        return self.client.get('/api/accounts/users/me/')
+
+    def test_user_is_cached_by_token(self):
+        # The user, then its addresses
+        with self.assertNumQueries(2):
+            self.assertEqual(self.me().data['email'], 'buyer@example.com')
+        # Only the addresses now; the user comes from the cache
+        with self.assertNumQueries(1):
+            self.assertEqual(self.me().status_code, 200)
+        self.assertEqual(APIClient().get('/api/accounts/users/me/').status_code, 401)
+
+    def test_changed_user_is_read_again(self):
+        self.me()
+        User.objects.filter(pk=self.user.pk).update(first_name='Ada')
+        self.assertEqual(self.me().data['first_name'], '')
+
+        user = User.objects.get(pk=self.user.pk)
+        user.is_active = False
+        user.save()
+        self.assertEqual(self.me().status_code, 401)
+
+    def test_logout_revokes_both_tokens(self):
+        self.assertEqual(self.me().status_code, 200)
+        response = self.client.post('/api/auth/logout/', {'refresh': self.refresh})
+        self.assertEqual(response.status_code, 204)
+
+        response = self.me()
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data['code'], 'token_not_valid')
+        self.client.credentials()
+        self.assertEqual(self.client.post('/api/auth/refresh/', {'refresh': self.refresh}).status_code, 401)
+
+    def test_refresh_rotates_the_refresh_token(self):
+        response = self.client.post('/api/auth/refresh/', {'refresh': self.refresh})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.me(response.data['access']).status_code, 200)
+        self.client.credentials()
+
+        self.assertEqual(self.client.post('/api/auth/refresh/', {'refresh': response.data['refresh']}).status_code, 200)
+        self.assertEqual(self.client.post('/api/auth/refresh/', {'refresh': self.refresh}).status_code, 401)
+
+    def test_cannot_revoke_another_users_refresh_token(self):
+        other = User.objects.create_user(email='other@example.com', username='other', password='secret')
+        refresh = APIClient().post('/api/auth/login/', {'email': other.email, 'password': 'secret'}).data['refresh']
+        self.me()
+        self.assertEqual(self.client.post('/api/auth/logout/', {'refresh': refresh}).status_code, 400)
+        self.client.credentials()
+        self.assertEqual(self.client.post('/api/auth/refresh/', {'refresh': refresh}).status_code, 200)
+
+
+@requires_query_plans
+class IndexUsageTests(QueryPlanMixin, TestCase):
+    """Address lookups use the indexes meant for them once the table has some volume."""
+
+    @classmethod
+    def setUpTestData(cls):
+        users = User.objects.bulk_create(
+            User(email='user%d@example.com' % i, username='user%d' % i) for i in range(50)
+        )
+        Address.objects.bulk_create(
+            Address(
+                user=user, street_address='%d Marina' % i, city='Lagos', state='LA',
+                phone_number='08000000000', is_default=i == 0,
+            )
+            for user in users for i in range(20)
+        )
+        analyze()
+        cls.user = users[0]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_default_address(self):
+        plan = self.plan_of('/api/accounts/addresses/default/', 'accounts_address')
+        self.assertIn('one_default_address_per_user', plan)
+
+    def test_one_default_address(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Address.objects.filter(user=self.user).update(is_default=True)
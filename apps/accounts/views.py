@@ -1,26 +1,46 @@
 from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.views import APIView
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from django.contrib.auth import get_user_model
+from core.authentication import revoke
+from core.pagination import StreamingListMixin
+from core.serializers import requested
+from core.throttling import LoginRateThrottle
 from .models import Address
-from .serializers import UserSerializer, AddressSerializer
+from .serializers import RevocableTokenRefreshSerializer, UserSerializer, AddressSerializer
 
 User = get_user_model()
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(StreamingListMixin, viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_ordering = ('id',)
 
     def get_permissions(self):
         if self.action == 'create':
             return [permissions.AllowAny()]
         return super().get_permissions()
 
+    def get_throttles(self):
+        # Sign-ups are open to anyone
+        if self.action == 'create':
+            return [LoginRateThrottle()]
+        return super().get_throttles()
+
     def get_queryset(self):
         if self.action in ['retrieve', 'update', 'partial_update']:
-            return User.objects.filter(id=self.request.user.id)
-        return super().get_queryset()
+            queryset = User.objects.filter(id=self.request.user.id)
+        else:
+            queryset = super().get_queryset()
+        if requested(self, 'addresses'):
+            queryset = queryset.prefetch_related('addresses')
+        return queryset
 
     @action(detail=False, methods=['get'])
     def me(self, request):
@@ -46,4 +66,34 @@ class AddressViewSet(viewsets.ModelViewSet):
         return Response(
             {"detail": "No default address found."}, 
             status=status.HTTP_404_NOT_FOUND
-        )
\ No newline at end of file
+        )
+
+
+class LoginView(TokenObtainPairView):
+    """Access and refresh tokens for an email and password."""
+    throttle_classes = [LoginRateThrottle]
+
+
+class RefreshView(TokenRefreshView):
+    """A new access token, and refresh token, for a refresh token."""
+    serializer_class = RevocableTokenRefreshSerializer
+
+
+class LogoutView(APIView):
+    """Revokes the access token of the request and the refresh token posted, if any."""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        if request.data.get('refresh'):
+            try:
+                refresh = RefreshToken(request.data['refresh'])
+            except TokenError as exc:
+                return Response({'refresh': [str(exc)]}, status=status.HTTP_400_BAD_REQUEST)
+            if refresh.get(jwt_settings.USER_ID_CLAIM) != request.user.pk:
+                return Response({'refresh': ['Token belongs to another user']}, status=status.HTTP_400_BAD_REQUEST)
+            revoke(refresh)
+        # None when signed in with a session
+        if request.auth is not None:
+            revoke(request.auth)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
@@ -0,0 +1,39 @@
+# apps/orders/events.py
+"""
+Follow-up work for placed and cancelled orders, queued through the
+outbox (see apps/outbox/outbox.py). Call these inside the transaction that changes
+the order.
+"""
+from django.conf import settings
+
+from apps.outbox import outbox
+
+
+def _recorded(event, order, **data):
+    # Everything the analytics task logs travels with it, so it need not
+    # read the order back
+    return outbox.message(
+        'apps.orders.tasks.record_order_event', event=event, order_id=order.pk,
+        order_number=order.order_number, user_id=order.user_id, total=str(order.total_amount),
+        item_count=order.item_count, payment_method=order.payment_method, **data
+    )
+
+
+def order_placed(order):
+    return outbox.enqueue([
+        outbox.message('apps.orders.tasks.send_order_email', order_id=order.pk, kind='placed'),
+        outbox.message('apps.orders.tasks.check_low_stock', order_id=order.pk),
+        _recorded('order_placed', order),
+        # Cancels the order if it is still unpaid when its stock is due back
+        outbox.message(
+            'apps.orders.tasks.expire_unpaid_order', countdown=settings.STOCK_RESERVATION_TTL,
+            order_id=order.pk,
+        ),
+    ])
+
+
+def order_cancelled(order, reason):
+    return outbox.enqueue([
+        outbox.message('apps.orders.tasks.send_order_email', order_id=order.pk, kind='cancelled'),
+        _recorded('order_cancelled', order, reason=reason),
+    ])
@@ -0,0 +1,175 @@
+# apps/orders/inventory.py
+"""
+Stock reservations for checkout.
+
+Placing an order takes its quantities off ``stock_quantity`` straight
+away (the variant's for variant lines, the product's otherwise) and
+records a StockReservation per line. Reservations of an unpaid order
+expire after ``STOCK_RESERVATION_TTL`` seconds, when the order's
+``expire_unpaid_order`` task (or the ``release_expired_reservations``
+sweep) puts the stock back and cancels the order. Payment commits them;
+cancelling the order releases them.
+
+Stock is only ever changed by conditional UPDATEs that do the arithmetic
+in SQL (``SET stock = stock - n WHERE stock >= n``), so two checkouts can
+never both sell the last unit. Rows are locked first, products before
+variants and each in SKU order, so checkouts sharing items wait on each
+other instead of deadlocking.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from apps.products.models import Product, ProductVariant
+from core.versioning import bump_version_on_commit
+
+from . import events
+from .models import Order, StockReservation
+
+# Version token of the stock levels shown in cached catalog responses
+STOCK_VERSION = 'product_stock'
+
+
+class InsufficientStock(Exception):
+    def __init__(self, products, variants):
+        # {pk: units available} for every product and variant that fell short
+        self.products = products
+        self.variants = variants
+        super().__init__('Insufficient stock')
+
+
+def _quantities(lines):
+    """Total quantity per product and per variant."""
+    products, variants = defaultdict(int), defaultdict(int)
+    for line in lines:
+        if line.variant_id:
+            variants[line.variant_id] += line.quantity
+        else:
+            products[line.product_id] += line.quantity
+    return products, variants
+
+
+def _lock(model, pks):
+    """Lock the rows in SKU order and return their current stock."""
+    ordering = ('sku',) if model is Product else ('product__sku', 'pk')
+    return dict(
+        model.objects.select_for_update(of=('self',)).filter(pk__in=pks)
+        .order_by(*ordering).values_list('pk', 'stock_quantity')
+    )
+
+
+def _per_row(quantities):
+    return Case(
+        *[When(pk=pk, then=Value(quantity)) for pk, quantity in quantities.items()],
+        output_field=IntegerField(),
+    )
+
+
+def _take(model, quantities):
+    """Subtract ``quantities`` from the rows; returns the shortfalls, if any."""
+    if not quantities:
+        return {}
+    stock = _lock(model, quantities)
+    shortages = {
+        pk: stock.get(pk, 0) for pk, quantity in quantities.items() if stock.get(pk, 0) < quantity
+    }
+    if shortages:
+        return shortages
+    needed = _per_row(quantities)
+    updated = model.objects.filter(pk__in=quantities, stock_quantity__gte=needed).update(
+        stock_quantity=F('stock_quantity') - needed
+    )
+    if updated != len(quantities):
+        # Only reachable without row locks; report what is left now
+        stock = dict(model.objects.filter(pk__in=quantities).values_list('pk', 'stock_quantity'))
+        return {pk: stock.get(pk, 0) for pk in quantities}
+    return {}
+
+
+def _give(model, quantities):
+    if not quantities:
+        return
+    _lock(model, quantities)
+    model.objects.filter(pk__in=quantities).update(
+        stock_quantity=F('stock_quantity') + _per_row(quantities)
+    )
+
+
+@transaction.atomic
+def reserve_stock(order, items):
+    """
+    Take stock for ``items`` (unsaved or saved OrderItems) and reserve it
+    for ``order``. Raises InsufficientStock, leaving stock untouched, if
+    any line cannot be filled.
+    """
+    products, variants = _quantities(items)
+    product_shortages = _take(Product, products)
+    variant_shortages = _take(ProductVariant, variants) if not product_shortages else {}
+    if product_shortages or variant_shortages:
+        raise InsufficientStock(product_shortages, variant_shortages)
+
+    expires_at = timezone.now() + timedelta(seconds=settings.STOCK_RESERVATION_TTL)
+    reservations = StockReservation.objects.bulk_create([
+        StockReservation(
+            order=order, product_id=item.product_id, variant_id=item.variant_id,
+            quantity=item.quantity, expires_at=expires_at,
+        )
+        for item in items
+    ])
+    bump_version_on_commit(STOCK_VERSION)
+    return reservations
+
+
+@transaction.atomic
+def release_reservations(order, statuses=(StockReservation.ACTIVE, StockReservation.COMMITTED)):
+    """Put the stock held by ``order`` back. Returns the number of reservations released."""
+    reservations = list(order.reservations.select_for_update().filter(status__in=statuses))
+    if not reservations:
+        return 0
+    products, variants = _quantities(reservations)
+    _give(Product, products)
+    _give(ProductVariant, variants)
+    StockReservation.objects.filter(pk__in=[r.pk for r in reservations]).update(
+        status=StockReservation.RELEASED
+    )
+    bump_version_on_commit(STOCK_VERSION)
+    return len(reservations)
+
+
+def commit_reservations(order):
+    """Keep the stock for good once ``order`` is paid."""
+    return order.reservations.filter(status=StockReservation.ACTIVE).update(
+        status=StockReservation.COMMITTED
+    )
+
+
+def expire_order(order_id, now=None):
+    """Cancel ``order_id`` if it is unpaid and its reservations expired. Returns whether it was."""
+    now = now or timezone.now()
+    with transaction.atomic():
+        # The order may have been paid or cancelled in the meantime
+        order = Order.objects.select_for_update().filter(pk=order_id, status='PENDING').first()
+        if order is None or not order.reservations.filter(
+            status=StockReservation.ACTIVE, expires_at__lte=now
+        ).exists():
+            return False
+        release_reservations(order, statuses=[StockReservation.ACTIVE])
+        order.status = 'CANCELLED'
+        order.save(update_fields=['status', 'updated_at'])
+        events.order_cancelled(order, 'expired')
+    return True
+
+
+def release_expired_reservations(now=None):
+    """Cancel unpaid orders whose reservations expired. Returns how many were cancelled."""
+    now = now or timezone.now()
+    order_ids = set(
+        StockReservation.objects.filter(
+            status=StockReservation.ACTIVE, expires_at__lte=now, order__status='PENDING'
+        ).values_list('order_id', flat=True)
+    )
+    return sum(expire_order(order_id, now) for order_id in sorted(order_ids))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from apps.orders.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Recompute stored order totals from their lines and fix any that drifted'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--item-summaries', action='store_true',
+            help='Also rebuild every order\'s stored line snapshot',
+        )
+
+    def handle(self, *args, **options):
+        fixed = Order.objects.reconcile_totals()
+        self.stdout.write('Corrected %d order(s)' % fixed)
+        if options['item_summaries']:
+            rebuilt = Order.objects.refresh_item_summaries()
+            self.stdout.write('Rebuilt the line snapshots of %d order(s)' % rebuilt)
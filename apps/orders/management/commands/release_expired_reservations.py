@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from apps.orders.inventory import release_expired_reservations
+
+
+class Command(BaseCommand):
+    help = 'Cancel unpaid orders whose stock reservations expired and put the stock back'
+
+    def handle(self, *args, **options):
+        cancelled = release_expired_reservations()
+        self.stdout.write('Cancelled %d expired order(s)' % cancelled)
@@ -0,0 +1,50 @@
+# Generated by Django 5.0.1 on 2026-10-18 18:01
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def populate_totals(apps, schema_editor):
+    Order = apps.get_model("orders", "Order")
+    OrderItem = apps.get_model("orders", "OrderItem")
+    money = models.DecimalField(max_digits=10, decimal_places=2)
+    lines = OrderItem.objects.filter(order=OuterRef("pk")).order_by().values("order")
+    subtotal = Coalesce(
+        Subquery(
+            lines.annotate(
+                total=Sum(F("quantity") * F("price"), output_field=money)
+            ).values("total")
+        ),
+        Value(0),
+        output_field=money,
+    )
+    units = Coalesce(
+        Subquery(lines.annotate(total=Sum("quantity")).values("total")), Value(0)
+    )
+    Order.objects.update(
+        subtotal=subtotal, item_count=units, total_amount=subtotal + F("shipping_cost")
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orders", "0004_stock_reservation"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="order",
+            name="item_count",
+            field=models.PositiveIntegerField(
+                default=0, help_text="Units across all lines"
+            ),
+        ),
+        migrations.AddField(
+            model_name="order",
+            name="subtotal",
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.RunPython(populate_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.0.14 on 2026-10-18 20:28
+
+import django.core.serializers.json
+from collections import defaultdict
+
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def populate_item_summaries(apps, schema_editor):
+    Order = apps.get_model("orders", "Order")
+    OrderItem = apps.get_model("orders", "OrderItem")
+    pks = list(Order.objects.order_by("pk").values_list("pk", flat=True))
+    for start in range(0, len(pks), BATCH_SIZE):
+        batch = pks[start : start + BATCH_SIZE]
+        summaries = defaultdict(list)
+        lines = (
+            OrderItem.objects.filter(order_id__in=batch)
+            .select_related("product", "variant")
+            .order_by("id")
+        )
+        for item in lines:
+            summaries[item.order_id].append(
+                {
+                    "product_id": item.product_id,
+                    "variant_id": item.variant_id,
+                    "sku": item.product.sku,
+                    "name": item.product.name,
+                    "variant": "%s: %s" % (item.variant.name, item.variant.value)
+                    if item.variant_id
+                    else None,
+                    "quantity": item.quantity,
+                    "price": item.price,
+                    "total": item.quantity * item.price,
+                }
+            )
+        Order.objects.bulk_update(
+            [Order(pk=pk, item_summary=summaries[pk]) for pk in batch],
+            ["item_summary"],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orders", "0007_outbox"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="order",
+            name="item_summary",
+            field=models.JSONField(
+                default=list,
+                editable=False,
+                encoder=django.core.serializers.json.DjangoJSONEncoder,
+            ),
+        ),
+        migrations.RunPython(populate_item_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.0.14 on 2026-10-18 20:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orders", "0008_order_item_summary"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OrderNumberNode",
+            fields=[
+                (
+                    "node_id",
+                    models.PositiveSmallIntegerField(primary_key=True, serialize=False),
+                ),
+                ("holder", models.CharField(blank=True, max_length=64)),
+                ("expires_at", models.DateTimeField()),
+            ],
+        ),
+    ]
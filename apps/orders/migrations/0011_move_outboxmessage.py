@@ -0,0 +1,25 @@
+# Generated by Django 5.0.14 on 2026-10-18 20:54
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """OutboxMessage moves to the outbox app; its table and rows are kept."""
+
+    dependencies = [
+        ("orders", "0010_outbox_attempts"),
+    ]
+
+    operations = [
+        migrations.AlterModelTable(
+            name="outboxmessage",
+            table="outbox_outboxmessage",
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.DeleteModel(
+                    name="OutboxMessage",
+                ),
+            ],
+        ),
+    ]
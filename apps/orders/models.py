@@ -1,8 +1,61 @@
 # apps/orders/models.py
 
-from django.db import models
+from collections import defaultdict
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
+from django.db.models import F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
 from django.conf import settings
 from apps.products.models import Product, ProductVariant
+from .numbering import generate_order_number
+
+def item_totals(order_ref):
+    """Aggregates of an order's lines as subqueries: (subtotal, units)."""
+    money = models.DecimalField(max_digits=10, decimal_places=2)
+    lines = OrderItem.objects.filter(order=order_ref).order_by().values('order')
+    subtotal = lines.annotate(total=Sum(F('quantity') * F('price'), output_field=money)).values('total')
+    units = lines.annotate(total=Sum('quantity')).values('total')
+    return (
+        Coalesce(Subquery(subtotal), Value(0), output_field=money),
+        Coalesce(Subquery(units), Value(0)),
+    )
+
+
+class OrderQuerySet(models.QuerySet):
+    def reconcile_totals(self):
+        """
+        Recompute the denormalized totals from the order lines in SQL and
+        fix any that drifted, e.g. after bulk edits of OrderItem rows.
+        Returns the number of orders corrected.
+        """
+        subtotal, units = item_totals(OuterRef('pk'))
+        return self.annotate(actual_subtotal=subtotal, actual_count=units).filter(
+            ~Q(subtotal=F('actual_subtotal'))
+            | ~Q(item_count=F('actual_count'))
+            | ~Q(total_amount=F('actual_subtotal') + F('shipping_cost'))
+        ).update(
+            subtotal=subtotal, item_count=units, total_amount=subtotal + F('shipping_cost'),
+        )
+
+    def refresh_item_summaries(self, batch_size=1000):
+        """
+        Rebuild the stored line snapshots of these orders from their lines,
+        e.g. after bulk edits of OrderItem rows. Names are the products'
+        current ones. Returns the number of orders rewritten.
+        """
+        pks = list(self.values_list('pk', flat=True))
+        for start in range(0, len(pks), batch_size):
+            batch = pks[start:start + batch_size]
+            summaries = defaultdict(list)
+            lines = OrderItem.objects.filter(order_id__in=batch).select_related('product', 'variant').order_by('id')
+            for item in lines:
+                summaries[item.order_id].append(item.summary())
+            Order.objects.bulk_update(
+                [Order(pk=pk, item_summary=summaries[pk]) for pk in batch], ['item_summary'],
+            )
+        return len(pks)
+
 
 class Order(models.Model):
     STATUS_CHOICES = [
@@ -23,14 +76,40 @@ class Order(models.Model):
     order_number = models.CharField(max_length=20, unique=True, editable=False)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
     shipping_address = models.ForeignKey('accounts.Address', on_delete=models.PROTECT)
+    # Kept up to date by OrderItem.save/delete, so reading an order's
+    # totals never touches its lines
+    subtotal = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    item_count = models.PositiveIntegerField(default=0, help_text="Units across all lines")
     shipping_cost = models.DecimalField(max_digits=10, decimal_places=2)
     total_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    # The lines as they were bought (OrderItem.summary), so order lists
+    # render them without joining the lines, products or variants. Written
+    # at checkout and by OrderItem.save/delete
+    item_summary = models.JSONField(default=list, encoder=DjangoJSONEncoder, editable=False)
     payment_method = models.CharField(max_length=10, choices=PAYMENT_METHOD_CHOICES, default='FIAT')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Keyset pagination order of a user's order history
+            models.Index(fields=['user', 'created_at', 'id'], name='order_user_created_id_idx'),
+            # The same, for a user's orders in one status
+            models.Index(fields=['user', 'status', 'created_at', 'id'], name='order_user_status_created_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self.order_number:
+            self.order_number = generate_order_number()
+        self.total_amount = self.subtotal + self.shipping_cost
+        super().save(*args, **kwargs)
+
     def calculate_total(self):
-        return sum(item.get_total() for item in self.items.all()) + self.shipping_cost
+        """Total recomputed from the lines in the database, for reconciliation."""
+        subtotal = self.items.aggregate(total=Sum(F('quantity') * F('price')))['total']
+        return (subtotal or 0) + self.shipping_cost
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, related_name='items', on_delete=models.CASCADE)
@@ -39,5 +118,110 @@ class OrderItem(models.Model):
     quantity = models.PositiveIntegerField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if not instance.get_deferred_fields() & {'order_id', 'quantity', 'price'}:
+            instance._saved_line = instance.line()
+        return instance
+
+    def line(self):
+        """(order id, units, amount) this line adds to its order's totals."""
+        return (self.order_id, self.quantity, self.get_total())
+
+    def summary(self):
+        """This line's entry in Order.item_summary."""
+        return {
+            'product_id': self.product_id,
+            'variant_id': self.variant_id,
+            'sku': self.product.sku,
+            'name': self.product.name,
+            'variant': '%s: %s' % (self.variant.name, self.variant.value) if self.variant_id else None,
+            'quantity': self.quantity,
+            'price': self.price,
+            'total': self.get_total(),
+        }
+
+    def save(self, *args, **kwargs):
+        previous = getattr(self, '_saved_line', None)
+        if previous is None and self.pk is not None:
+            # Loaded without the fields needed, or built by hand
+            previous = OrderItem.objects.get(pk=self.pk).line()
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            changes = {self.order_id: (self.quantity, self.get_total())}
+            if previous:
+                order_id, units, amount = previous
+                new_units, new_amount = changes.get(order_id, (0, 0))
+                changes[order_id] = (new_units - units, new_amount - amount)
+            for order_id, (units, amount) in changes.items():
+                if units or amount:
+                    self.adjust_totals(order_id, units, amount)
+            self.refresh_summaries(changes)
+        self._saved_line = self.line()
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            self.adjust_totals(self.order_id, -self.quantity, -self.get_total())
+            self.refresh_summaries([self.order_id])
+        return result
+
+    def refresh_summaries(self, order_ids):
+        Order.objects.filter(pk__in=order_ids).refresh_item_summaries()
+        # As in adjust_totals, so saving a loaded order keeps the new lines
+        if OrderItem.order.is_cached(self) and self.order.pk in order_ids:
+            self.order.refresh_from_db(fields=['item_summary'])
+
+    def adjust_totals(self, order_id, units, amount):
+        """Apply a change in lines to the stored totals without reading them."""
+        Order.objects.filter(pk=order_id).update(
+            subtotal=F('subtotal') + amount,
+            item_count=F('item_count') + units,
+            total_amount=F('total_amount') + amount,
+        )
+        # Keep a loaded order in step so a later save() of it does not
+        # write back the old totals
+        if OrderItem.order.is_cached(self) and self.order.pk == order_id:
+            self.order.subtotal += amount
+            self.order.item_count += units
+            self.order.total_amount += amount
+
     def get_total(self):
         return self.quantity * self.price
+
+class OrderNumberSequence(models.Model):
+    """Counter used by the order number generators on databases without native sequences."""
+    name = models.CharField(max_length=63, primary_key=True)
+    last_value = models.BigIntegerField(default=0)
+
+class OrderNumberNode(models.Model):
+    """A node id leased by a SnowflakeGenerator process, see numbering.py."""
+    node_id = models.PositiveSmallIntegerField(primary_key=True)
+    holder = models.CharField(max_length=64, blank=True)
+    expires_at = models.DateTimeField()
+
+class StockReservation(models.Model):
+    """Stock held for an order, see inventory.py."""
+    ACTIVE = 'ACTIVE'
+    COMMITTED = 'COMMITTED'
+    RELEASED = 'RELEASED'
+    STATUS_CHOICES = [
+        (ACTIVE, 'Active'),
+        (COMMITTED, 'Committed'),
+        (RELEASED, 'Released'),
+    ]
+
+    order = models.ForeignKey(Order, related_name='reservations', on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, on_delete=models.PROTECT)
+    variant = models.ForeignKey(ProductVariant, on_delete=models.PROTECT, null=True, blank=True)
+    quantity = models.PositiveIntegerField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=ACTIVE)
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Sweep for expired reservations
+            models.Index(fields=['status', 'expires_at'], name='reservation_status_expiry_idx'),
+        ]
@@ -0,0 +1,335 @@
+# apps/orders/numbering.py
+"""
+Order number generators.
+
+Every backend hands out numbers that are unique by construction, so an
+order can be saved without first checking whether its number is taken.
+The active backend is configured through ``ORDER_NUMBER_GENERATOR``:
+
+    ORDER_NUMBER_GENERATOR = {
+        'BACKEND': 'apps.orders.numbering.SnowflakeGenerator',
+        'OPTIONS': {'node_id': 3},
+    }
+"""
+import datetime
+import math
+import os
+import threading
+import time
+import uuid
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.db import connection, transaction
+from django.db.models import F
+from django.db.models.functions import Now
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+DEFAULT_BACKEND = 'apps.orders.numbering.SnowflakeGenerator'
+DEFAULT_SEQUENCE = 'orders_order_number_seq'
+
+# Crockford's base32 drops I, L, O and U so numbers can be read out over the phone
+ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+
+def encode_base32(value, length):
+    chars = []
+    for _ in range(length):
+        value, remainder = divmod(value, 32)
+        chars.append(ALPHABET[remainder])
+    if value:
+        raise ValueError('Value does not fit in %d characters.' % length)
+    return ''.join(reversed(chars))
+
+
+def reserve_numbers(sequence, count):
+    """
+    Reserve ``count`` values from the named database sequence.
+
+    PostgreSQL uses a native sequence, which is never rolled back. Other
+    databases fall back to a counter row in ``OrderNumberSequence``, which
+    is incremented in place by a single UPDATE and therefore shares the
+    fate of the surrounding transaction.
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT nextval(%s) FROM generate_series(1, %s)', [sequence, count]
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    from .models import OrderNumberSequence
+
+    with transaction.atomic():
+        counter = OrderNumberSequence.objects.filter(name=sequence)
+        if not counter.update(last_value=F('last_value') + count):
+            OrderNumberSequence.objects.get_or_create(name=sequence)
+            counter.update(last_value=F('last_value') + count)
+        last_value = counter.values_list('last_value', flat=True).get()
+    return range(last_value - count + 1, last_value + 1)
+
+
+class BaseOrderNumberGenerator:
+    def __init__(self, prefix=''):
+        self.prefix = prefix
+
+    def generate(self):
+        raise NotImplementedError('subclasses of BaseOrderNumberGenerator must provide a generate() method')
+
+
+class SnowflakeGenerator(BaseOrderNumberGenerator):
+    """
+    Time-ordered ids that need no database round trip per order.
+
+    Each id packs 41 bits of milliseconds since ``EPOCH``, a 10 bit node id
+    and a 12 bit per-millisecond counter, and is rendered as 13 base32
+    characters so numbers sort in creation order. Ids are unique as long as
+    no two processes use the same node id at once.
+
+    Set ``node_id`` (or the ``ORDER_NUMBER_NODE_ID`` environment variable)
+    to give each worker a fixed one. Without one, each process leases a
+    free node id from the OrderNumberNode table for ``lease_seconds`` and
+    renews the lease while it runs. A lease taken inside a transaction is
+    only relied on by other threads once the transaction commits, as with
+    BlockGenerator's blocks. A process stops using its node id
+    ``LEASE_MARGIN`` seconds before the lease runs out in the database, and
+    the next holder starts its clock no earlier than that expiry, so ids
+    stay unique while the hosts' clocks agree to within the margin.
+
+    Every ``next_id()`` checks the lease under ``self._lock``: the pid,
+    any pending lease's on_commit callback and the renewal deadline. These
+    are in-memory checks, but once ``lease_seconds / 2`` have passed the
+    call that finds the lease due renews it with a synchronous query,
+    inside the caller's transaction and while holding the lock, so other
+    threads of the process wait for that round trip.
+    """
+    EPOCH = 1704067200000  # 2024-01-01T00:00:00Z
+    NODE_BITS = 10
+    SEQUENCE_BITS = 12
+    MAX_NODE_ID = (1 << NODE_BITS) - 1
+    MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+    LEASE_MARGIN = 30
+    # expires_at of node ids never leased
+    NEVER = datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc)
+
+    def __init__(self, node_id=None, prefix='', lease_seconds=600):
+        super().__init__(prefix)
+        if node_id is None and os.environ.get('ORDER_NUMBER_NODE_ID'):
+            node_id = int(os.environ['ORDER_NUMBER_NODE_ID'])
+        if node_id is not None and not 0 <= node_id <= self.MAX_NODE_ID:
+            raise ValueError('node_id must be between 0 and %d.' % self.MAX_NODE_ID)
+        if lease_seconds <= 2 * self.LEASE_MARGIN:
+            raise ValueError('lease_seconds must be over %d.' % (2 * self.LEASE_MARGIN))
+        self.node_id = node_id
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        self._last_timestamp = -1
+        self._sequence = 0
+        # (node id, renew at, stop at) of the committed lease, monotonic
+        self._leased = None
+        # (node id, on_commit callback) of a lease taken in a transaction
+        self._pending = None
+        self._pid = None
+        self._holder = None
+
+    def _current_node_id(self):
+        if self.node_id is not None:
+            return self.node_id
+        if self._pid != os.getpid():
+            # Forked workers must not share the parent's node id
+            self._pid, self._holder = os.getpid(), uuid.uuid4().hex
+            self._leased = self._pending = None
+        if self._pending is not None and any(entry[1] is self._pending[1] for entry in connection.run_on_commit):
+            return self._pending[0]
+        now = time.monotonic()
+        if self._leased is not None and now < self._leased[2]:
+            node_id, renew_at, _ = self._leased
+            if now < renew_at or self._renew(node_id):
+                return node_id
+        return self._lease()
+
+    def _lease(self):
+        """Take over a free node id; the last holder's ids all fall before its lease expired."""
+        from .models import OrderNumberNode
+
+        self._leased = None
+        started = time.monotonic()
+        created = False
+        while True:
+            with transaction.atomic():
+                # Rows other threads are leasing are skipped rather than
+                # waited on: such a thread may be waiting for this lock
+                free = OrderNumberNode.objects.select_for_update(skip_locked=True).filter(
+                    expires_at__lt=Now(),
+                ).order_by('expires_at').first()
+                # Checked again by the UPDATE where rows cannot be locked
+                taken = free is not None and OrderNumberNode.objects.filter(
+                    node_id=free.node_id, expires_at__lt=Now(),
+                ).update(holder=self._holder, expires_at=self.lease_end())
+            if taken:
+                floor = math.ceil(free.expires_at.timestamp() * 1000) - self.EPOCH
+                self._last_timestamp = max(self._last_timestamp, floor)
+                self._confirm(free.node_id, started, pending=True)
+                return free.node_id
+            if free is None:
+                if created:
+                    raise ImproperlyConfigured(
+                        'Every order number node id is leased; set ORDER_NUMBER_NODE_ID per worker instead.'
+                    )
+                # Rows for every node id, the first time, or after a flush
+                OrderNumberNode.objects.bulk_create(
+                    [OrderNumberNode(node_id=node_id, expires_at=self.NEVER)
+                     for node_id in range(self.MAX_NODE_ID + 1)],
+                    ignore_conflicts=True,
+                )
+                created = True
+
+    def _renew(self, node_id):
+        """Extend the lease on ``node_id``; False if it ran out and was taken over."""
+        from .models import OrderNumberNode
+
+        started = time.monotonic()
+        mine = OrderNumberNode.objects.filter(node_id=node_id, holder=self._holder)
+        with transaction.atomic():
+            locked = list(mine.select_for_update(skip_locked=True).values_list('node_id', flat=True))
+            if locked:
+                mine.update(expires_at=self.lease_end())
+        if locked:
+            self._confirm(node_id, started)
+            return True
+        # Another thread's renewal, not yet committed, may hold the row
+        return mine.exists()
+
+    def lease_end(self):
+        # The database's clock, which every process shares
+        return Now() + datetime.timedelta(seconds=self.lease_seconds)
+
+    def _confirm(self, node_id, started, pending=False):
+        """Rely on a lease written at ``started`` from now on, or once its transaction commits."""
+        lease = (node_id, started + self.lease_seconds / 2, started + self.lease_seconds - self.LEASE_MARGIN)
+        if not connection.in_atomic_block:
+            self._leased = lease
+            return
+
+        def confirm():
+            with self._lock:
+                if self._pending is not None and self._pending[1] is confirm:
+                    self._pending = None
+                self._leased = lease
+        if pending:
+            self._pending = (node_id, confirm)
+        transaction.on_commit(confirm)
+
+    def next_id(self):
+        with self._lock:
+            # First, as taking a node id over can move the clock forward
+            node_id = self._current_node_id()
+            timestamp = int(time.time() * 1000) - self.EPOCH
+            if timestamp < self._last_timestamp:
+                # The clock stepped backwards; keep issuing ids from the last
+                # timestamp we used rather than risk repeating one
+                timestamp = self._last_timestamp
+            if timestamp == self._last_timestamp:
+                self._sequence = (self._sequence + 1) & self.MAX_SEQUENCE
+                if self._sequence == 0:
+                    # Counter exhausted for this millisecond, wait for the next
+                    while timestamp <= self._last_timestamp:
+                        timestamp = int(time.time() * 1000) - self.EPOCH
+            else:
+                self._sequence = 0
+            self._last_timestamp = timestamp
+
+            return (
+                (timestamp << (self.NODE_BITS + self.SEQUENCE_BITS))
+                | (node_id << self.SEQUENCE_BITS)
+                | self._sequence
+            )
+
+    def generate(self):
+        return self.prefix + encode_base32(self.next_id(), 13)
+
+
+class SequenceGenerator(BaseOrderNumberGenerator):
+    """Consecutive numbers drawn from a database sequence, one query per order."""
+
+    def __init__(self, sequence=DEFAULT_SEQUENCE, width=10, prefix=''):
+        super().__init__(prefix)
+        self.sequence = sequence
+        self.width = width
+
+    def format(self, value):
+        return '%s%0*d' % (self.prefix, self.width, value)
+
+    def generate(self):
+        return self.format(reserve_numbers(self.sequence, 1)[0])
+
+
+class BlockGenerator(SequenceGenerator):
+    """
+    Reserves ``block_size`` numbers from the database sequence at a time
+    and hands them out from memory, so a worker only touches the database
+    once per block.
+
+    Blocks reserved through the counter table inside a transaction are
+    only reused after that transaction commits; a rollback would release
+    the range to other workers.
+    """
+
+    def __init__(self, block_size=100, **kwargs):
+        super().__init__(**kwargs)
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._block = iter(())
+        self._pending = None
+        self._pid = os.getpid()
+
+    def _usable(self):
+        if self._pid != os.getpid():
+            # Forked workers must not share the parent's block
+            return False
+        if self._pending is None:
+            return True
+        # Django drops on_commit callbacks when their transaction rolls back,
+        # so the block is still safe only while its callback is queued on
+        # this thread's connection
+        return any(entry[1] is self._pending for entry in connection.run_on_commit)
+
+    def _refill(self):
+        self._pid = os.getpid()
+        self._pending = None
+        self._block = iter(reserve_numbers(self.sequence, self.block_size))
+        if connection.vendor != 'postgresql' and connection.in_atomic_block:
+            def confirm():
+                with self._lock:
+                    if self._pending is confirm:
+                        self._pending = None
+            self._pending = confirm
+            transaction.on_commit(confirm)
+
+    def generate(self):
+        with self._lock:
+            value = next(self._block, None) if self._usable() else None
+            if value is None:
+                self._refill()
+                value = next(self._block)
+        return self.format(value)
+
+
+@lru_cache(maxsize=None)
+def get_order_number_generator():
+    config = getattr(settings, 'ORDER_NUMBER_GENERATOR', {})
+    backend = import_string(config.get('BACKEND', DEFAULT_BACKEND))
+    return backend(**config.get('OPTIONS', {}))
+
+
+@receiver(setting_changed)
+def reset_order_number_generator(setting, **kwargs):
+    if setting == 'ORDER_NUMBER_GENERATOR':
+        get_order_number_generator.cache_clear()
+
+
+def generate_order_number():
+    """Return a new unique order number from the configured backend."""
+    return get_order_number_generator().generate()
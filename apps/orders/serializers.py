@@ -1,18 +1,56 @@
+from django.db import transaction
 from rest_framework import serializers
+from core.serializers import DynamicFieldsMixin
+from .inventory import InsufficientStock, reserve_stock
 from .models import Order, OrderItem
 from apps.accounts.serializers import AddressSerializer
 from apps.products.serializers import ProductSerializer, ProductVariantSerializer
 from apps.products.models import Product, ProductVariant 
 from apps.accounts.models import Address  
-class OrderItemSerializer(serializers.ModelSerializer):
+from apps.shipping.rates import UnknownState, basket_weight, quote
+
+class OrderItemListSerializer(serializers.ListSerializer):
+    does_not_exist = serializers.PrimaryKeyRelatedField.default_error_messages['does_not_exist']
+
+    def to_internal_value(self, data):
+        items = super().to_internal_value(data)
+
+        # Resolve every product and variant in the basket up front instead of
+        # one lookup per line item
+        product_ids = {item['product_id'] for item in items}
+        variant_ids = {item['variant_id'] for item in items if item.get('variant_id')}
+        products = Product.objects.in_bulk(product_ids)
+        variants = (
+            ProductVariant.objects.select_related('product').in_bulk(variant_ids)
+            if variant_ids else {}
+        )
+
+        errors = []
+        for item in items:
+            item_errors = {}
+            if item['product_id'] not in products:
+                item_errors['product_id'] = [
+                    self.does_not_exist.format(pk_value=item['product_id'])
+                ]
+            if item.get('variant_id') and item['variant_id'] not in variants:
+                item_errors['variant_id'] = [
+                    self.does_not_exist.format(pk_value=item['variant_id'])
+                ]
+            errors.append(item_errors)
+        if any(errors):
+            raise serializers.ValidationError(errors)
+
+        for item in items:
+            item['product'] = products[item.pop('product_id')]
+            item['variant'] = variants.get(item.pop('variant_id', None))
+        return items
+
+class OrderItemSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
-    product_id = serializers.PrimaryKeyRelatedField(
-        source='product', write_only=True, queryset=Product.objects.all()
-    )
+    product_id = serializers.IntegerField(write_only=True)
     variant = ProductVariantSerializer(read_only=True)
-    variant_id = serializers.PrimaryKeyRelatedField(
-        source='variant', write_only=True, queryset=ProductVariant.objects.all(),
-        required=False, allow_null=True
+    variant_id = serializers.IntegerField(
+        write_only=True, required=False, allow_null=True
     )
     total = serializers.DecimalField(
         source='get_total', read_only=True, max_digits=10, decimal_places=2
@@ -23,50 +61,107 @@ class OrderItemSerializer(serializers.ModelSerializer):
         fields = ['id', 'product', 'product_id', 'variant', 'variant_id', 
                  'quantity', 'price', 'total']
         read_only_fields = ['price']
+        list_serializer_class = OrderItemListSerializer
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     items = OrderItemSerializer(many=True)
     shipping_address = AddressSerializer(read_only=True)
     shipping_address_id = serializers.PrimaryKeyRelatedField(
         write_only=True, queryset=Address.objects.all(), source='shipping_address'
     )
     total = serializers.DecimalField(
-        source='calculate_total', read_only=True, max_digits=10, decimal_places=2
+        source='total_amount', read_only=True, max_digits=10, decimal_places=2
     )
 
     class Meta:
         model = Order
         fields = ['id', 'order_number', 'status', 'shipping_address', 
-                 'shipping_address_id', 'shipping_cost', 'total_amount', 
-                 'payment_method', 'items', 'total', 'created_at', 'updated_at']
-        read_only_fields = ['order_number', 'total_amount', 'created_at', 'updated_at']
+                 'shipping_address_id', 'subtotal', 'item_count', 'shipping_cost',
+                 'total_amount', 'payment_method', 'items', 'total', 'created_at',
+                 'updated_at']
+        read_only_fields = ['order_number', 'subtotal', 'item_count', 'shipping_cost',
+                            'total_amount', 'created_at', 'updated_at']
+        # Totals are stored on the order, so lists only need the lines
+        # when asked for them
+        expandable_fields = ['items']
 
+    @transaction.atomic
     def create(self, validated_data):
         items_data = validated_data.pop('items')
-        order = Order.objects.create(**validated_data)
-        
+        items = []
         for item_data in items_data:
             # Set price from current product/variant price
             product = item_data['product']
             variant = item_data.get('variant')
             price = variant.price if variant else product.price
-            
-            OrderItem.objects.create(
-                order=order,
-                price=price,
-                **item_data
-            )
-        
-        # Calculate and update total amount
-        order.total_amount = order.calculate_total()
-        order.save()
-        
+            items.append(OrderItem(price=price, **item_data))
+
+        # Totals are known before the order is written, so it is saved
+        # once; bulk_create below does not go through OrderItem.save
+        order = Order.objects.create(
+            subtotal=sum(item.get_total() for item in items),
+            item_count=sum(item.quantity for item in items),
+            item_summary=[item.summary() for item in items],
+            **validated_data
+        )
+
+        for item in items:
+            item.order = order
+        OrderItem.objects.bulk_create(items)
+
+        try:
+            reserve_stock(order, items)
+        except InsufficientStock as exc:
+            raise serializers.ValidationError({'items': [
+                self.stock_error(item, exc) for item in items
+            ]})
+
         return order
 
+    def stock_error(self, item, exc):
+        if item.variant_id:
+            available = exc.variants.get(item.variant_id)
+        else:
+            available = exc.products.get(item.product_id)
+        if available is None:
+            return {}
+        return {'quantity': ['Only %d left in stock.' % available]}
+
     def validate(self, data):
         # Validate that shipping address belongs to user
-        if self.context['request'].user != data['shipping_address'].user:
+        if self.context['request'].user.pk != data['shipping_address'].user_id:
             raise serializers.ValidationError(
                 {"shipping_address": "Invalid shipping address."}
             )
+        # Priced here rather than trusted from the client, again when an
+        # order is sent somewhere else
+        if 'items' in data:
+            items = data['items']
+        else:
+            items = [
+                {'product': item.product, 'quantity': item.quantity}
+                for item in self.instance.items.select_related('product')
+            ]
+        try:
+            data['shipping_cost'] = quote(basket_weight(items), data['shipping_address'].state)
+        except UnknownState as exc:
+            raise serializers.ValidationError({"shipping_address": str(exc)})
         return data
+
+class OrderLineSummarySerializer(DynamicFieldsMixin, serializers.Serializer):
+    """A line of Order.item_summary, as it was bought."""
+    product_id = serializers.IntegerField()
+    variant_id = serializers.IntegerField(allow_null=True)
+    sku = serializers.CharField()
+    name = serializers.CharField()
+    variant = serializers.CharField(allow_null=True)
+    quantity = serializers.IntegerField()
+    price = serializers.DecimalField(max_digits=10, decimal_places=2)
+    total = serializers.DecimalField(max_digits=10, decimal_places=2)
+
+    class Meta:
+        expandable_fields = []
+
+class OrderSummarySerializer(OrderSerializer):
+    """Orders in lists, with their lines from the snapshot stored on the order."""
+    items = OrderLineSummarySerializer(source='item_summary', many=True, read_only=True)
@@ -0,0 +1,92 @@
+# apps/orders/tasks.py
+"""
+Work that follows checkout and cancellation, queued by events.py through
+the outbox. CELERY_TASK_ROUTES sends each to its queue. Tasks may run
+more than once.
+"""
+import json
+import logging
+from collections import defaultdict
+from smtplib import SMTPException
+
+from celery import shared_task
+from django.conf import settings
+from django.core.mail import send_mail
+from django.db import OperationalError
+
+from apps.products.models import Product, ProductVariant
+from .inventory import expire_order
+from .models import Order, StockReservation
+
+analytics = logging.getLogger('analytics')
+
+EMAILS = {
+    'placed': (
+        'Order %(order_number)s received',
+        'Thank you for your order %(order_number)s of %(item_count)d item(s), '
+        'totalling %(total)s %(currency)s.',
+    ),
+    'cancelled': (
+        'Order %(order_number)s cancelled',
+        'Your order %(order_number)s has been cancelled.',
+    ),
+}
+
+
+@shared_task(autoretry_for=(SMTPException, OSError), retry_backoff=True, max_retries=5)
+def send_order_email(order_id, kind):
+    order = Order.objects.select_related('user').filter(pk=order_id).first()
+    if order is None or not order.user.email:
+        return
+    subject, body = EMAILS[kind]
+    context = {
+        'order_number': order.order_number, 'item_count': order.item_count,
+        'total': order.total_amount, 'currency': settings.PAYMENT_CURRENCY,
+    }
+    send_mail(subject % context, body % context, None, [order.user.email])
+
+
+@shared_task
+def record_order_event(event, **data):
+    # One JSON object per line, for the log shipper to pick up
+    analytics.info(json.dumps({'event': event, **data}))
+
+
+@shared_task(autoretry_for=(OperationalError,), retry_backoff=True, max_retries=5)
+def check_low_stock(order_id):
+    """Alert STOCK_ALERT_EMAILS to the products and variants this order took to LOW_STOCK_THRESHOLD."""
+    if not settings.STOCK_ALERT_EMAILS:
+        return
+    # Stock comes off the variant for variant lines, off the product otherwise
+    taken = {Product: defaultdict(int), ProductVariant: defaultdict(int)}
+    for product_id, variant_id, quantity in StockReservation.objects.filter(
+        order_id=order_id
+    ).values_list('product_id', 'variant_id', 'quantity'):
+        if variant_id:
+            taken[ProductVariant][variant_id] += quantity
+        else:
+            taken[Product][product_id] += quantity
+
+    threshold = settings.LOW_STOCK_THRESHOLD
+    low = [
+        (product.name, product, taken[Product])
+        for product in Product.objects.filter(pk__in=taken[Product], stock_quantity__lte=threshold)
+    ] + [
+        ('%s (%s %s)' % (variant.product.name, variant.name, variant.value), variant, taken[ProductVariant])
+        for variant in ProductVariant.objects.select_related('product').filter(
+            pk__in=taken[ProductVariant], stock_quantity__lte=threshold
+        )
+    ]
+    # Only the order that took the stock below the threshold sends an alert
+    lines = [
+        '%s: %d left' % (label, item.stock_quantity)
+        for label, item, quantities in low
+        if item.stock_quantity + quantities[item.pk] > threshold
+    ]
+    if lines:
+        send_mail('Low stock', '\n'.join(sorted(lines)), None, settings.STOCK_ALERT_EMAILS)
+
+
+@shared_task(autoretry_for=(OperationalError,), retry_backoff=True, max_retries=5)
+def expire_unpaid_order(order_id):
+    return expire_order(order_id)
@@ -1,3 +1,775 @@
-from django.test import TestCase
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock, skipIf, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, connections, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from kombu.exceptions import OperationalError as BrokerError
+from rest_framework.test import APIClient, APIRequestFactory
+
+from apps.accounts.models import Address, User
+from apps.products.models import Category, Product, ProductVariant
+from config.celery import app as celery_app
+from core import throttling
+from core.tests.utils import QueryPlanMixin, analyze, requires_query_plans
+from apps.outbox import outbox
+from apps.outbox.models import OutboxMessage
+from .inventory import (InsufficientStock, commit_reservations, release_expired_reservations,
+                        reserve_stock)
+from .models import Order, OrderItem, OrderNumberNode, StockReservation
+from .numbering import (BlockGenerator, SequenceGenerator, SnowflakeGenerator,
+                        generate_order_number)
+from .serializers import OrderSerializer
+from .tasks import expire_unpaid_order
+
+
+def generate_many(generator, count):
+    try:
+        return [generator.generate() for _ in range(count)]
+    finally:
+        connections.close_all()
+
+
+def checkout_one(product):
+    try:
+        with transaction.atomic():
+            order = Order.objects.create(
+                user=User.objects.get(), shipping_address=Address.objects.get(),
+                shipping_cost=Decimal('0.00'), total_amount=product.price,
+            )
+            reserve_stock(order, [OrderItem(product=product, quantity=1, price=product.price)])
+        return True
+    except InsufficientStock:
+        return False
+    finally:
+        connections.close_all()
+
+
+def snowflake_worker(count):
+    # Each process leases its own node id from the shared database
+    generator = SnowflakeGenerator()
+    try:
+        return [generator.next_id() for _ in range(count)]
+    finally:
+        connections.close_all()
+
+
+class OrderCreateTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='buyer@example.com', username='buyer', password='secret'
+        )
+        cls.address = Address.objects.create(
+            user=cls.user, street_address='1 Marina', city='Lagos',
+            state='LA', phone_number='08000000000'
+        )
+        category = Category.objects.create(name='Hardware')
+        cls.products = [
+            Product.objects.create(
+                name=f'Part {i}', category=category, description='A part',
+                price=Decimal('10.00') + i, stock_quantity=100, weight=Decimal('1.00')
+            )
+            for i in range(50)
+        ]
+        cls.variant = ProductVariant.objects.create(
+            product=cls.products[0], name='Size', value='XL',
+            price_adjustment=Decimal('2.50'), stock_quantity=10
+        )
+
+    def create_order(self, items):
+        request = APIRequestFactory().post('/api/orders/orders/')
+        request.user = self.user
+        serializer = OrderSerializer(
+            data={
+                'shipping_address_id': self.address.pk,
+                'items': items,
+            },
+            context={'request': request},
+        )
+        serializer.is_valid(raise_exception=True)
+        return serializer.save(user=self.user)
+
+    def count_queries(self, items):
+        with CaptureQueriesContext(connection) as ctx:
+            self.create_order(items)
+        return len(ctx.captured_queries)
+
+    def test_query_count_does_not_grow_with_basket_size(self):
+        small = [{'product_id': self.products[0].pk, 'quantity': 1}]
+        large = [{'product_id': product.pk, 'quantity': 2} for product in self.products]
+        large.append({'product_id': self.products[0].pk, 'variant_id': self.variant.pk, 'quantity': 1})
+        small.append({'product_id': self.products[0].pk, 'variant_id': self.variant.pk, 'quantity': 1})
+
+        self.assertEqual(self.count_queries(small), self.count_queries(large))
+
+    def test_response_query_count_does_not_grow_with_basket_size(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        def count(products):
+            items = [{'product_id': product.pk, 'quantity': 1} for product in products]
+            with CaptureQueriesContext(connection) as ctx:
+                response = client.post(
+                    '/api/orders/orders/', {'shipping_address_id': self.address.pk, 'items': items}, format='json'
+                )
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(len(response.data['items']), len(products))
+            return len(ctx.captured_queries)
+
+        # The first order also loads the category tree
+        count(self.products[:1])
+        self.assertEqual(count(self.products[:1]), count(self.products[1:20]))
+
+    def test_totals_are_computed_from_current_prices(self):
+        order = self.create_order([
+            {'product_id': self.products[1].pk, 'quantity': 3},
+            {'product_id': self.products[0].pk, 'variant_id': self.variant.pk, 'quantity': 2},
+        ])
+
+        prices = sorted(order.items.values_list('price', flat=True))
+        self.assertEqual(prices, [Decimal('11.00'), Decimal('12.50')])
+        # 3 * 11.00 + 2 * 12.50 + 2000.00 for 5 kg within Lagos
+        self.assertEqual(order.total_amount, Decimal('2058.00'))
+        self.assertEqual((order.subtotal, order.item_count), (Decimal('58.00'), 5))
+        order.refresh_from_db()
+        self.assertEqual(order.total_amount, order.calculate_total())
+
+    def test_unknown_product_is_reported_per_item(self):
+        request = APIRequestFactory().post('/api/orders/orders/')
+        request.user = self.user
+        serializer = OrderSerializer(
+            data={
+                'shipping_address_id': self.address.pk,
+                'items': [
+                    {'product_id': self.products[0].pk, 'quantity': 1},
+                    {'product_id': 999999, 'quantity': 1},
+                ],
+            },
+            context={'request': request},
+        )
+
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors['items'][0], {})
+        self.assertIn('product_id', serializer.errors['items'][1])
+        self.assertFalse(Order.objects.exists())
+
+    def test_checkouts_are_throttled_per_user(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        rates = {**settings.REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'], 'checkout': '2/min'}
+        with override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': rates}):
+            statuses = [
+                client.post('/api/orders/orders/', {
+                    'shipping_address_id': self.address.pk,
+                    'items': [{'product_id': self.products[0].pk, 'quantity': 1}],
+                }, format='json').status_code
+                for _ in range(3)
+            ]
+            # Reading the order history is not limited
+            self.assertEqual(client.get('/api/orders/orders/').status_code, 200)
+        self.assertEqual(statuses, [201, 201, 429])
+        self.assertEqual(Order.objects.count(), 2)
+
+
+class OrderTotalsTests(TestCase):
+    url = '/api/orders/orders/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='buyer@example.com', username='buyer', password='secret'
+        )
+        cls.address = Address.objects.create(
+            user=cls.user, street_address='1 Marina', city='Lagos',
+            state='LA', phone_number='08000000000'
+        )
+        category = Category.objects.create(name='Kitchen')
+        cls.products = [
+            Product.objects.create(
+                name=f'Pan {i}', category=category, description='Cast iron',
+                price=Decimal('15.00'), stock_quantity=100, weight=Decimal('2.00')
+            )
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        # Checkouts are throttled per user id, which the next test reuses
+        throttling.get_limiter.cache_clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def place_order(self, lines=2):
+        return Order.objects.get(pk=self.client.post(self.url, {
+            'shipping_address_id': self.address.pk,
+            'items': [{'product_id': p.pk, 'quantity': 2} for p in self.products[:lines]],
+        }, format='json').data['id'])
+
+    def assert_totals(self, order, subtotal, item_count):
+        order.refresh_from_db()
+        self.assertEqual(
+            (order.subtotal, order.item_count, order.total_amount),
+            (Decimal(subtotal), item_count, Decimal(subtotal) + order.shipping_cost)
+        )
+
+    def test_item_changes_update_totals_incrementally(self):
+        order = self.place_order()
+        self.assert_totals(order, '60.00', 4)
+
+        item = OrderItem.objects.create(order=order, product=self.products[2], quantity=1, price=Decimal('9.50'))
+        self.assert_totals(order, '69.50', 5)
+
+        item = OrderItem.objects.get(pk=item.pk)
+        item.quantity = 3
+        item.save()
+        self.assert_totals(order, '88.50', 7)
+
+        other = self.place_order(lines=1)
+        item.order = other
+        item.save()
+        self.assert_totals(order, '60.00', 4)
+        self.assert_totals(other, '58.50', 5)
+
+        item.delete()
+        self.assert_totals(other, '30.00', 2)
+
+    def test_saving_a_loaded_order_keeps_item_changes(self):
+        order = self.place_order()
+        item = order.items.first()
+        item.quantity += 1
+        item.save()
+        item.order.status = 'PAID'
+        item.order.save()
+        self.assert_totals(order, '75.00', 5)
+
+    def test_reconcile_fixes_drifted_totals(self):
+        order, untouched = self.place_order(), self.place_order()
+        OrderItem.objects.filter(order=order).update(quantity=1)
+
+        self.assertEqual(Order.objects.reconcile_totals(), 1)
+        self.assert_totals(order, '30.00', 2)
+        self.assert_totals(untouched, '60.00', 4)
+        self.assertEqual(order.calculate_total(), order.total_amount)
+
+    def test_order_list_does_not_read_items(self):
+        for _ in range(3):
+            self.place_order()
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url)
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertNotIn('orderitem', ctx.captured_queries[0]['sql'])
+        # 60.00 + 3000.00 for 8 kg within Lagos
+        self.assertEqual(response.data['results'][0]['total'], '3060.00')
+        self.assertNotIn('items', response.data['results'][0])
+
+        self.place_order(lines=3)
+        # Orders + addresses; the lines are stored on the order
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url, {'expand': 'items'})
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertNotIn('products_product', ctx.captured_queries[0]['sql'])
+        item = response.data['results'][0]['items'][0]
+        self.assertEqual(len(response.data['results'][0]['items']), 3)
+        self.assertEqual(item['name'], 'Pan 0')
+        self.assertEqual(item['sku'], self.products[0].sku)
+        self.assertEqual((item['quantity'], item['price'], item['total']), (2, '15.00', '30.00'))
+
+        pending = self.client.get(self.url + 'pending/', {'expand': 'items'}).data['results']
+        self.assertEqual(len(pending), 4)
+        self.assertEqual(pending[0]['items'], response.data['results'][0]['items'])
+
+    def test_order_list_shows_lines_as_bought(self):
+        order = self.place_order(lines=1)
+        Product.objects.filter(pk=self.products[0].pk).update(name='Renamed', price=Decimal('99.00'))
+
+        item = self.client.get(self.url, {'expand': 'items'}).data['results'][0]['items'][0]
+        self.assertEqual((item['name'], item['price']), ('Pan 0', '15.00'))
+        # The detail reads the lines themselves
+        detail = self.client.get('%s%d/' % (self.url, order.pk)).data
+        self.assertEqual(detail['items'][0]['product']['name'], 'Renamed')
+
+    def test_item_changes_update_summary(self):
+        order = self.place_order()
+        item = OrderItem.objects.create(order=order, product=self.products[2], quantity=1, price=Decimal('9.50'))
+        order.refresh_from_db()
+        self.assertEqual([line['name'] for line in order.item_summary], ['Pan 0', 'Pan 1', 'Pan 2'])
+        self.assertEqual(order.item_summary[2]['total'], '9.50')
+
+        item.order.status = 'PAID'
+        item.delete()
+        item.order.save()
+        order.refresh_from_db()
+        self.assertEqual([line['name'] for line in order.item_summary], ['Pan 0', 'Pan 1'])
+
+        Order.objects.filter(pk=order.pk).update(item_summary=[])
+        self.assertEqual(Order.objects.refresh_item_summaries(), 1)
+        order.refresh_from_db()
+        self.assertEqual(len(order.item_summary), 2)
+
+    async def test_async_order_list(self):
+        order = await sync_to_async(self.place_order)()
+        await self.async_client.aforce_login(self.user)
+
+        response = await self.async_client.get(self.url, {'expand': 'items'})
+        self.assertEqual(response.status_code, 200)
+        result = response.json()['results'][0]
+        self.assertEqual(result['order_number'], order.order_number)
+        self.assertEqual(result['items'][0]['name'], 'Pan 0')
+
+        await self.async_client.alogout()
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, 401)
+
+    def test_sparse_order_lines(self):
+        self.place_order(lines=3)
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, {'fields': 'order_number,items.quantity,items.name'})
+        order = response.data['results'][0]
+        self.assertEqual(set(order), {'order_number', 'items'})
+        self.assertEqual(order['items'][0], {'quantity': 2, 'name': 'Pan 0'})
+
+
+class OrderNumberGeneratorTests(TransactionTestCase):
+    THREADS = 8
+    PER_THREAD = 500
+
+    def run_threads(self, generators):
+        with ThreadPoolExecutor(max_workers=len(generators)) as pool:
+            batches = pool.map(generate_many, generators, [self.PER_THREAD] * len(generators))
+            return [number for batch in batches for number in batch]
+
+    def assert_unique(self, numbers, expected):
+        self.assertEqual(len(numbers), expected)
+        self.assertEqual(len(set(numbers)), expected)
+
+    def test_snowflake_is_unique_across_threads(self):
+        generator = SnowflakeGenerator(node_id=1)
+        numbers = self.run_threads([generator] * self.THREADS)
+        self.assert_unique(numbers, self.THREADS * self.PER_THREAD)
+
+    @skipUnless('fork' in multiprocessing.get_all_start_methods(), 'requires fork')
+    @skipIf(connection.vendor == 'sqlite', "SQLite's in-memory test database is not shared with other processes")
+    def test_snowflake_is_unique_across_processes(self):
+        # Children must open their own connections rather than share this one
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers=4, mp_context=context) as pool:
+            batches = list(pool.map(snowflake_worker, [20000] * 4))
+        # One node id per process, each leased in the database and none shared
+        nodes = [{self.node_of_id(number) for number in batch} for batch in batches]
+        self.assertEqual([len(batch_nodes) for batch_nodes in nodes], [1] * 4)
+        nodes = set.union(*nodes)
+        self.assertEqual(len(nodes), 4)
+        self.assertEqual(OrderNumberNode.objects.filter(node_id__in=nodes, expires_at__gt=timezone.now()).count(), 4)
+        numbers = [number for batch in batches for number in batch]
+        self.assert_unique(numbers, 4 * 20000)
+
+    def test_snowflake_numbers_sort_in_creation_order(self):
+        generator = SnowflakeGenerator(node_id=7)
+        numbers = [generator.generate() for _ in range(10000)]
+        self.assertEqual(numbers, sorted(numbers))
+        self.assertTrue(all(len(number) == 13 for number in numbers))
+
+    def test_snowflake_survives_clock_going_backwards(self):
+        generator = SnowflakeGenerator(node_id=1)
+        with mock.patch('apps.orders.numbering.time.time', return_value=1800000000.0):
+            first = [generator.generate() for _ in range(10)]
+        with mock.patch('apps.orders.numbering.time.time', return_value=1700000000.0):
+            later = [generator.generate() for _ in range(10)]
+        self.assert_unique(first + later, 20)
+
+    def node_of_id(self, value):
+        return value >> SnowflakeGenerator.SEQUENCE_BITS & SnowflakeGenerator.MAX_NODE_ID
+
+    def node_of(self, generator):
+        return self.node_of_id(generator.next_id())
+
+    def lease_all_but(self, *node_ids):
+        OrderNumberNode.objects.exclude(node_id__in=node_ids).update(
+            holder='elsewhere', expires_at=timezone.now() + timedelta(hours=1),
+        )
+
+    def test_snowflake_leases_a_node_id_per_process(self):
+        # Each generator stands in for a worker process
+        workers = [SnowflakeGenerator(), SnowflakeGenerator()]
+        nodes = {self.node_of(worker) for worker in workers}
+        self.assertEqual(len(nodes), 2)
+        self.assertEqual(OrderNumberNode.objects.filter(expires_at__gt=timezone.now()).count(), 2)
+        numbers = [worker.generate() for _ in range(1000) for worker in workers]
+        self.assert_unique(numbers, 2000)
+
+    def test_snowflake_takes_over_expired_lease_after_it_ran_out(self):
+        first = SnowflakeGenerator()
+        node = self.node_of(first)
+        spare = (node + 1) % (SnowflakeGenerator.MAX_NODE_ID + 1)
+        self.lease_all_but(node, spare)
+        expired = timezone.now() - timedelta(seconds=2)
+        OrderNumberNode.objects.filter(node_id=node).update(expires_at=expired)
+        # Longest expired is taken first
+        OrderNumberNode.objects.filter(node_id=spare).update(expires_at=expired + timedelta(seconds=1))
+
+        second = SnowflakeGenerator()
+        # A host clock a minute behind still issues ids after the old lease
+        with mock.patch('apps.orders.numbering.time.time', return_value=expired.timestamp() - 60):
+            taken_over = second.next_id()
+        shift = SnowflakeGenerator.NODE_BITS + SnowflakeGenerator.SEQUENCE_BITS
+        self.assertEqual(taken_over >> SnowflakeGenerator.SEQUENCE_BITS & SnowflakeGenerator.MAX_NODE_ID, node)
+        self.assertGreaterEqual((taken_over >> shift) + SnowflakeGenerator.EPOCH, expired.timestamp() * 1000)
+
+        # The first process finds its lease gone when it renews
+        later = time.monotonic() + first.lease_seconds * 0.6
+        with mock.patch('apps.orders.numbering.time.monotonic', return_value=later):
+            self.assertEqual(self.node_of(first), spare)
+
+    def test_snowflake_refuses_when_every_node_id_is_leased(self):
+        SnowflakeGenerator().generate()
+        self.lease_all_but()
+        with self.assertRaises(ImproperlyConfigured):
+            SnowflakeGenerator().generate()
+        self.assertTrue(SnowflakeGenerator(node_id=3).generate())
+
+    def test_snowflake_lease_taken_in_rolled_back_transaction_is_discarded(self):
+        generator = SnowflakeGenerator()
+        try:
+            with transaction.atomic():
+                node = self.node_of(generator)
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertFalse(OrderNumberNode.objects.filter(holder=generator._holder).exists())
+        self.assertEqual(self.node_of(generator), node)
+        self.assertTrue(OrderNumberNode.objects.filter(node_id=node, holder=generator._holder).exists())
+
+    @skipIf(connection.vendor == 'sqlite', "SQLite's shared in-memory test database rejects concurrent writers")
+    def test_sequence_is_unique_across_threads(self):
+        generator = SequenceGenerator()
+        numbers = self.run_threads([generator] * self.THREADS)
+        self.assert_unique(numbers, self.THREADS * self.PER_THREAD)
+
+    @skipIf(connection.vendor == 'sqlite', "SQLite's shared in-memory test database rejects concurrent writers")
+    def test_block_is_unique_across_threads(self):
+        # Each generator stands in for a worker process
+        workers = [BlockGenerator(block_size=37), BlockGenerator(block_size=50)]
+        numbers = self.run_threads(workers * (self.THREADS // 2))
+        self.assert_unique(numbers, self.THREADS * self.PER_THREAD)
+
+    def test_blocks_do_not_overlap_between_workers(self):
+        workers = [BlockGenerator(block_size=7), BlockGenerator(block_size=10), SequenceGenerator()]
+        numbers = [worker.generate() for _ in range(200) for worker in workers]
+        self.assert_unique(numbers, 600)
+
+    def test_block_reserved_in_rolled_back_transaction_is_discarded(self):
+        generator = BlockGenerator(block_size=10)
+        try:
+            with transaction.atomic():
+                generator.generate()
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        # The rollback released the range, so another worker now owns it
+        other = BlockGenerator(block_size=10).generate()
+        self.assertNotEqual(generator.generate(), other)
+
+    @override_settings(ORDER_NUMBER_GENERATOR={
+        'BACKEND': 'apps.orders.numbering.BlockGenerator',
+        'OPTIONS': {'block_size': 5, 'prefix': 'ORD'},
+    })
+    def test_backend_is_configurable(self):
+        self.assertRegex(generate_order_number(), r'^ORD\d{10}$')
+
+
+class StockReservationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='buyer@example.com', username='buyer', password='secret'
+        )
+        cls.address = Address.objects.create(
+            user=cls.user, street_address='1 Marina', city='Lagos',
+            state='LA', phone_number='08000000000'
+        )
+        category = Category.objects.create(name='Shoes')
+        cls.product = Product.objects.create(
+            name='Trainer', category=category, description='Runs',
+            price=Decimal('50.00'), stock_quantity=5, weight=Decimal('1.00')
+        )
+        cls.variant = ProductVariant.objects.create(
+            product=cls.product, name='Size', value='44', stock_quantity=2
+        )
+
+    def setUp(self):
+        # Checkouts are throttled per user id, which the next test reuses
+        throttling.get_limiter.cache_clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def checkout(self, items):
+        return self.client.post('/api/orders/orders/', {
+            'shipping_address_id': self.address.pk,
+            'items': items,
+        }, format='json')
+
+    def assert_stock(self, product, variant):
+        self.product.refresh_from_db()
+        self.variant.refresh_from_db()
+        self.assertEqual((self.product.stock_quantity, self.variant.stock_quantity), (product, variant))
+
+    def test_checkout_takes_and_reserves_stock(self):
+        response = self.checkout([
+            {'product_id': self.product.pk, 'quantity': 2},
+            {'product_id': self.product.pk, 'quantity': 1},
+            {'product_id': self.product.pk, 'variant_id': self.variant.pk, 'quantity': 2},
+        ])
+        self.assertEqual(response.status_code, 201)
+        self.assert_stock(2, 0)
+
+        reservations = StockReservation.objects.filter(order_id=response.data['id'])
+        self.assertEqual(reservations.count(), 3)
+        self.assertTrue(all(r.status == StockReservation.ACTIVE for r in reservations))
+
+    def test_short_lines_are_reported_and_nothing_is_taken(self):
+        response = self.checkout([
+            {'product_id': self.product.pk, 'quantity': 1},
+            {'product_id': self.product.pk, 'variant_id': self.variant.pk, 'quantity': 3},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['items'][0], {})
+        self.assertEqual(response.data['items'][1]['quantity'], ['Only 2 left in stock.'])
+        self.assert_stock(5, 2)
+        self.assertFalse(Order.objects.exists())
+
+    def test_cancel_puts_stock_back_once(self):
+        order_id = self.checkout([{'product_id': self.product.pk, 'quantity': 4}]).data['id']
+        self.assert_stock(1, 2)
+
+        url = f'/api/orders/orders/{order_id}/cancel/'
+        self.assertEqual(self.client.post(url).status_code, 200)
+        self.assert_stock(5, 2)
+        self.assertEqual(self.client.post(url).status_code, 400)
+        self.assert_stock(5, 2)
+
+    def test_expired_reservations_cancel_unpaid_orders(self):
+        unpaid = self.checkout([{'product_id': self.product.pk, 'quantity': 2}]).data['id']
+        paid = self.checkout([{'product_id': self.product.pk, 'quantity': 1}]).data['id']
+        paid_order = Order.objects.get(pk=paid)
+        paid_order.status = 'PAID'
+        paid_order.save()
+        commit_reservations(paid_order)
+
+        later = timezone.now() + timedelta(seconds=settings.STOCK_RESERVATION_TTL + 1)
+        self.assertEqual(release_expired_reservations(now=timezone.now()), 0)
+        self.assertEqual(release_expired_reservations(now=later), 1)
+
+        self.assertEqual(Order.objects.get(pk=unpaid).status, 'CANCELLED')
+        self.assertEqual(Order.objects.get(pk=paid).status, 'PAID')
+        self.assert_stock(4, 2)
+        self.assertEqual(release_expired_reservations(now=later), 0)
+
+
+class BackgroundTaskTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='buyer@example.com', username='buyer', password='secret'
+        )
+        cls.address = Address.objects.create(
+            user=cls.user, street_address='1 Marina', city='Lagos',
+            state='LA', phone_number='08000000000'
+        )
+        cls.product = Product.objects.create(
+            name='Trainer', category=Category.objects.create(name='Shoes'), description='Runs',
+            price=Decimal('50.00'), stock_quantity=5, weight=Decimal('1.00')
+        )
+
+    def setUp(self):
+        # Checkouts are throttled per user id, which the next test reuses
+        throttling.get_limiter.cache_clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def checkout(self, quantity=1):
+        response = self.client.post('/api/orders/orders/', {
+            'shipping_address_id': self.address.pk,
+            'items': [{'product_id': self.product.pk, 'quantity': quantity}],
+        }, format='json')
+        return response
+
+    def test_checkout_queues_follow_up_tasks_with_the_order(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            order_id = self.checkout().data['id']
+        self.assertEqual(sorted(OutboxMessage.objects.values_list('task', 'sent_at')), [
+            ('apps.orders.tasks.check_low_stock', None),
+            ('apps.orders.tasks.expire_unpaid_order', None),
+            ('apps.orders.tasks.record_order_event', None),
+            ('apps.orders.tasks.send_order_email', None),
+        ])
+        self.assertEqual(mail.outbox, [])
+
+        # Tasks run eagerly once the order commits
+        with self.assertLogs('analytics', 'INFO') as logs:
+            for callback in callbacks:
+                callback()
+        order = Order.objects.get(pk=order_id)
+        self.assertEqual([message.subject for message in mail.outbox], ['Order %s received' % order.order_number])
+        self.assertEqual(mail.outbox[0].to, ['buyer@example.com'])
+        self.assertIn('"event": "order_placed"', logs.output[0])
+        self.assertFalse(OutboxMessage.objects.filter(sent_at=None).exists())
+        self.assertEqual(order.status, 'PENDING')
+
+    def test_failed_checkout_queues_nothing(self):
+        self.assertEqual(self.checkout(quantity=6).status_code, 400)
+        self.assertFalse(OutboxMessage.objects.exists())
+
+    def test_messages_the_broker_refused_are_relayed(self):
+        with mock.patch('celery.app.task.Task.apply_async', side_effect=BrokerError('down')), \
+                self.assertLogs('apps.outbox.outbox', 'ERROR'), \
+                self.captureOnCommitCallbacks(execute=True):
+            self.checkout()
+        self.assertEqual(OutboxMessage.objects.filter(sent_at=None).count(), 4)
+
+        # Left alone while the transaction that wrote them may still send them
+        self.assertEqual(outbox.relay(), 0)
+        with self.assertLogs('analytics', 'INFO'):
+            self.assertEqual(outbox.relay(now=timezone.now() + outbox.RELAY_AFTER), 4)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertFalse(OutboxMessage.objects.filter(sent_at=None).exists())
+
+        OutboxMessage.objects.update(sent_at=timezone.now() - outbox.RETENTION - timedelta(seconds=1))
+        outbox.relay()
+        self.assertFalse(OutboxMessage.objects.exists())
+
+    def test_unknown_task_does_not_hold_up_the_relay(self):
+        with self.captureOnCommitCallbacks():
+            self.checkout()
+        poison = outbox.message('apps.orders.tasks.no_such_task', order_id=1)
+        poison.save()
+        OutboxMessage.objects.filter(pk=poison.pk).update(created_at=timezone.now() - timedelta(hours=1))
+
+        later = timezone.now() + outbox.RELAY_AFTER
+        with self.assertLogs('apps.outbox.outbox', 'ERROR'), self.assertLogs('analytics', 'INFO'):
+            self.assertEqual(outbox.relay(batch_size=2, now=later), 4)
+        self.assertEqual(OutboxMessage.objects.filter(sent_at=None).get().pk, poison.pk)
+
+        for _ in range(outbox.MAX_ATTEMPTS - 1):
+            with self.assertLogs('apps.outbox.outbox', 'ERROR'):
+                self.assertEqual(outbox.relay(now=later), 0)
+        poison.refresh_from_db()
+        self.assertEqual(poison.attempts, outbox.MAX_ATTEMPTS)
+        self.assertIsNotNone(poison.failed_at)
+        # Given up on: no longer tried
+        with self.assertNoLogs('apps.outbox.outbox', 'ERROR'):
+            outbox.relay(now=later)
+
+    def test_cancelling_sends_a_cancellation(self):
+        order_id = self.checkout().data['id']
+        with self.assertLogs('analytics', 'INFO') as logs, self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/orders/orders/{order_id}/cancel/')
+        self.assertEqual(mail.outbox[-1].subject, 'Order %s cancelled' % Order.objects.get(pk=order_id).order_number)
+        self.assertIn('"reason": "customer"', logs.output[0])
+
+    def test_unpaid_order_expires_from_its_task(self):
+        order_id = self.checkout(quantity=2).data['id']
+        self.assertFalse(expire_unpaid_order.delay(order_id).get())
+
+        StockReservation.objects.update(expires_at=timezone.now())
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertTrue(expire_unpaid_order.delay(order_id).get())
+        self.assertEqual(Order.objects.get(pk=order_id).status, 'CANCELLED')
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 5)
+        self.assertEqual(len(callbacks), 2)
+        self.assertTrue(OutboxMessage.objects.filter(kwargs__reason='expired').exists())
+
+        # A paid order is left alone
+        paid = Order.objects.get(pk=self.checkout().data['id'])
+        paid.status = 'PAID'
+        paid.save()
+        StockReservation.objects.filter(order=paid).update(expires_at=timezone.now())
+        self.assertFalse(expire_unpaid_order.delay(paid.pk).get())
+
+    @override_settings(STOCK_ALERT_EMAILS=['stock@example.com'], LOW_STOCK_THRESHOLD=2)
+    def test_low_stock_is_reported_once(self):
+        for quantity in [2, 1, 1]:
+            with self.assertLogs('analytics', 'INFO'), self.captureOnCommitCallbacks(execute=True):
+                self.checkout(quantity)
+
+        alerts = [message for message in mail.outbox if message.to == ['stock@example.com']]
+        self.assertEqual([message.body for message in alerts], ['Trainer: 2 left'])
+
+    def test_tasks_are_routed_to_their_queues(self):
+        router = celery_app.amqp.router
+        self.assertEqual(
+            [router.route({}, name)['queue'].name for name in [
+                'apps.orders.tasks.send_order_email', 'apps.orders.tasks.record_order_event',
+                'apps.orders.tasks.expire_unpaid_order', 'apps.payments.tasks.process_webhook',
+                'apps.orders.tasks.check_low_stock',
+            ]],
+            ['email', 'analytics', 'payments', 'payments', 'default'],
+        )
+
+
+class StockContentionTests(TransactionTestCase):
+    @skipIf(connection.vendor == 'sqlite', "SQLite's shared in-memory test database rejects concurrent writers")
+    def test_concurrent_checkouts_never_oversell(self):
+        user = User.objects.create_user(email='buyer@example.com', username='buyer', password='secret')
+        Address.objects.create(
+            user=user, street_address='1 Marina', city='Lagos', state='LA', phone_number='08000000000'
+        )
+        product = Product.objects.create(
+            name='Limited', category=Category.objects.create(name='Drops'), description='Few',
+            price=Decimal('99.00'), stock_quantity=10, weight=Decimal('1.00')
+        )
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(checkout_one, [product] * 40))
+
+        self.assertEqual(results.count(True), 10)
+        product.refresh_from_db()
+        self.assertEqual(product.stock_quantity, 0)
+        self.assertEqual(StockReservation.objects.count(), 10)
+
+
+@requires_query_plans
+class IndexUsageTests(QueryPlanMixin, TestCase):
+    """The order queries use the indexes meant for them once the table has some volume."""
+
+    @classmethod
+    def setUpTestData(cls):
+        users = User.objects.bulk_create(
+            User(email='user%d@example.com' % i, username='user%d' % i) for i in range(50)
+        )
+        addresses = Address.objects.bulk_create(
+            Address(user=user, street_address='1 Marina', city='Lagos', state='LA', phone_number='08000000000')
+            for user in users
+        )
+        Order.objects.bulk_create(
+            Order(
+                user=users[i % 50], shipping_address=addresses[i % 50],
+                order_number='IDX%07d' % i, status='PENDING' if i % 20 == 0 else 'DELIVERED',
+                subtotal=Decimal('10.00'), shipping_cost=Decimal('5.00'), total_amount=Decimal('15.00'),
+            )
+            for i in range(10000)
+        )
+        analyze()
+        cls.user = users[0]
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_pending_orders(self):
+        self.client.force_authenticate(self.user)
+        self.assertIn('order_user_status_created_idx', self.plan_of('/api/orders/orders/pending/', 'orders_order'))
+        # The full history keeps using its own index
+        self.assertIn('order_user_created_id_idx', self.plan_of('/api/orders/orders/', 'orders_order'))
@@ -1,185 +1,105 @@
-from rest_framework import serializers
-from .models import Order, OrderItem
-from apps.accounts.serializers import AddressSerializer
-from apps.products.serializers import ProductSerializer, ProductVariantSerializer
-from apps.products.models import Product, ProductVariant
-from apps.accounts.models import Address
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
 from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from django.utils.crypto import get_random_string
-from .models import Order
-from .serializers import OrderSerializer
+from core.async_views import AsyncReadMixin
+from core.db.replicas import ReplicaReadMixin
+from core.pagination import StreamingListMixin
+from core.serializers import requested
+from core.throttling import CheckoutRateThrottle
+from . import events
+from .inventory import release_reservations
+from apps.products.models import ProductImage, ProductVariant
+from apps.products.category_tree import CategoryTreeMixin
+from .models import Order, OrderItem
+from .serializers import OrderSerializer, OrderSummarySerializer
 
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderViewSet(CategoryTreeMixin, ReplicaReadMixin, AsyncReadMixin, StreamingListMixin,
+                   viewsets.ModelViewSet):
     serializer_class = OrderSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_ordering = ('-created_at', '-id')
+
+    # Actions returning many orders; they leave the line items out unless
+    # asked for with ?expand=items, since totals are stored on Order, and
+    # render them from Order.item_summary when asked
+    collection_actions = ('list', 'pending')
+    # A client that just placed or cancelled an order is pinned to the
+    # primary, see core/db/replicas.py
+    replica_actions = ('list', 'pending')
+
+    def get_throttles(self):
+        if self.action == 'create':
+            return [CheckoutRateThrottle()]
+        return super().get_throttles()
+
+    def get_serializer_class(self):
+        if self.action in self.collection_actions:
+            return OrderSummarySerializer
+        return super().get_serializer_class()
+
+    def needs_category_tree(self):
+        # The snapshots in lists have no categories
+        return self.action not in self.collection_actions and requested(self, 'items.product.category')
 
     def get_queryset(self):
-        return Order.objects.filter(user=self.request.user)
-
+        queryset = Order.objects.filter(user=self.request.user)
+        if requested(self, 'shipping_address'):
+            queryset = queryset.select_related('shipping_address')
+        if self.action in self.collection_actions:
+            if not requested(self, 'items'):
+                queryset = queryset.defer('item_summary')
+        elif requested(self, 'items'):
+            queryset = queryset.prefetch_related(*self.item_prefetches())
+        return queryset
+
+    def item_prefetches(self):
+        """Prefetches for the parts of the order lines that will be rendered."""
+        related = []
+        if requested(self, 'items.product'):
+            related.append('product__category' if requested(self, 'items.product.category') else 'product')
+        if requested(self, 'items.variant'):
+            related.append('variant__product')
+        prefetches = [Prefetch('items', queryset=OrderItem.objects.select_related(*related).order_by('id'))]
+        if requested(self, 'items.product.images') or requested(self, 'items.product.primary_image'):
+            prefetches.append(Prefetch('items__product__images', queryset=ProductImage.objects.order_by('id')))
+        if requested(self, 'items.product.variants'):
+            prefetches.append(Prefetch('items__product__variants', queryset=ProductVariant.objects.order_by('id')))
+        return prefetches
+
+    @transaction.atomic
     def perform_create(self, serializer):
-        # Generate unique order number
-        while True:
-            order_number = get_random_string(10).upper()
-            if not Order.objects.filter(order_number=order_number).exists():
-                break
-                
-        serializer.save(
-            user=self.request.user,
-            order_number=order_number
-        )
+        # Order.save assigns the order number, no uniqueness check needed
+        order = serializer.save(user=self.request.user)
+        # The response renders every line's product; load them together
+        # rather than one product, category, image list and variant list
+        # per line
+        prefetch_related_objects([order], *self.item_prefetches())
+        # Emails and the rest go to the workers once the order commits
+        events.order_placed(order)
 
     @action(detail=True, methods=['post'])
+    @transaction.atomic
     def cancel(self, request, pk=None):
-        order = self.get_object()
+        # Lock the order so a concurrent cancel or the expiry sweep cannot
+        # put its stock back twice
+        order = Order.objects.select_for_update().get(pk=self.get_object().pk)
         if order.status not in ['PENDING', 'PAID']:
             return Response(
                 {"detail": "Order cannot be cancelled in current status."},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
+        release_reservations(order)
         order.status = 'CANCELLED'
         order.save()
+        events.order_cancelled(order, 'customer')
         return Response({"status": "Order cancelled successfully"})
 
     @action(detail=False, methods=['get'])
     def pending(self, request):
         pending_orders = self.get_queryset().filter(status='PENDING')
-        serializer = self.get_serializer(pending_orders, many=True)
-        return Response(serializer.data)
-
-class OrderItemSerializer(serializers.ModelSerializer):
-    product = ProductSerializer(read_only=True)
-    product_id = serializers.PrimaryKeyRelatedField(
-        source='product', write_only=True, queryset=Product.objects.all()
-    )
-    variant = ProductVariantSerializer(read_only=True)
-    variant_id = serializers.PrimaryKeyRelatedField(
-        source='variant', write_only=True, queryset=ProductVariant.objects.all(),
-        required=False, allow_null=True
-    )
-    total = serializers.DecimalField(
-        source='get_total', read_only=True, max_digits=10, decimal_places=2
-    )
-
-    class Meta:
-        model = OrderItem
-        fields = ['id', 'product', 'product_id', 'variant', 'variant_id', 
-                 'quantity', 'price', 'total']
-        read_only_fields = ['price']
-
-class OrderSerializer(serializers.ModelSerializer):
-    items = OrderItemSerializer(many=True)
-    shipping_address = AddressSerializer(read_only=True)
-    shipping_address_id = serializers.PrimaryKeyRelatedField(
-        write_only=True, queryset=Address.objects.all(), source='shipping_address'
-    )
-    total = serializers.DecimalField(
-        source='calculate_total', read_only=True, max_digits=10, decimal_places=2
-    )
-
-    class Meta:
-        model = Order
-        fields = ['id', 'order_number', 'status', 'shipping_address', 
-                 'shipping_address_id', 'shipping_cost', 'total_amount', 
-                 'payment_method', 'items', 'total', 'created_at', 'updated_at']
-        read_only_fields = ['order_number', 'total_amount', 'created_at', 'updated_at']
-
-    def create(self, validated_data):
-        items_data = validated_data.pop('items')
-        order = Order.objects.create(**validated_data)
-        
-        for item_data in items_data:
-            # Set price from current product/variant price
-            product = item_data['product']
-            variant = item_data.get('variant')
-            price = variant.price if variant else product.price
-            
-            OrderItem.objects.create(
-                order=order,
-                price=price,
-                **item_data
-            )
-        
-        # Calculate and update total amount
-        order.total_amount = order.calculate_total()
-        order.save()
-        
-        return order
-
-    def validate(self, data):
-        # Validate that shipping address belongs to user
-        if self.context['request'].user != data['shipping_address'].user:
-            raise serializers.ValidationError(
-                {"shipping_address": "Invalid shipping address."}
-            )
-        return data
-
-
-class OrderItemSerializer(serializers.ModelSerializer):
-    product = ProductSerializer(read_only=True)
-    product_id = serializers.PrimaryKeyRelatedField(
-        source='product', write_only=True, queryset=Product.objects.all()
-    )
-    variant = ProductVariantSerializer(read_only=True)
-    variant_id = serializers.PrimaryKeyRelatedField(
-        source='variant', write_only=True, queryset=ProductVariant.objects.all(),
-        required=False, allow_null=True
-    )
-    total = serializers.DecimalField(
-        source='get_total', read_only=True, max_digits=10, decimal_places=2
-    )
-
-    class Meta:
-        model = OrderItem
-        fields = ['id', 'product', 'product_id', 'variant', 'variant_id', 
-                 'quantity', 'price', 'total']
-        read_only_fields = ['price']
-
-class OrderSerializer(serializers.ModelSerializer):
-    items = OrderItemSerializer(many=True)
-    shipping_address = AddressSerializer(read_only=True)
-    shipping_address_id = serializers.PrimaryKeyRelatedField(
-        write_only=True, queryset=Address.objects.all(), source='shipping_address'
-    )
-    total = serializers.DecimalField(
-        source='calculate_total', read_only=True, max_digits=10, decimal_places=2
-    )
-
-    class Meta:
-        model = Order
-        fields = ['id', 'order_number', 'status', 'shipping_address', 
-                 'shipping_address_id', 'shipping_cost', 'total_amount', 
-                 'payment_method', 'items', 'total', 'created_at', 'updated_at']
-        read_only_fields = ['order_number', 'total_amount', 'created_at', 'updated_at']
-
-    def create(self, validated_data):
-        items_data = validated_data.pop('items')
-        order = Order.objects.create(**validated_data)
-        
-        for item_data in items_data:
-            # Set price from current product/variant price
-            product = item_data['product']
-            variant = item_data.get('variant')
-            price = variant.price if variant else product.price
-            
-            OrderItem.objects.create(
-                order=order,
-                price=price,
-                **item_data
-            )
-        
-        # Calculate and update total amount
-        order.total_amount = order.calculate_total()
-        order.save()
-        
-        return order
-
-    def validate(self, data):
-        # Validate that shipping address belongs to user
-        if self.context['request'].user != data['shipping_address'].user:
-            raise serializers.ValidationError(
-                {"shipping_address": "Invalid shipping address."}
-            )
-        return data
+        page = self.paginate_queryset(pending_orders)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
@@ -0,0 +1,5 @@
+# apps/outbox/admin.py
+from django.contrib import admin
+from .models import OutboxMessage
+
+admin.site.register(OutboxMessage)
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from apps.outbox.outbox import relay
+
+
+class Command(BaseCommand):
+    help = 'Publish background tasks whose outbox messages were not sent when their transaction committed'
+
+    def handle(self, *args, **options):
+        published = relay()
+        self.stdout.write('Published %d outbox message(s)' % published)
@@ -0,0 +1,64 @@
+# Generated by Django 5.0.14 on 2026-10-18 20:54
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        # The table is created by orders and renamed there, see
+        # orders.0011_move_outboxmessage
+        ("orders", "0011_move_outboxmessage"),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name="OutboxMessage",
+                    fields=[
+                        (
+                            "id",
+                            models.BigAutoField(
+                                auto_created=True,
+                                primary_key=True,
+                                serialize=False,
+                                verbose_name="ID",
+                            ),
+                        ),
+                        ("task", models.CharField(max_length=200)),
+                        (
+                            "kwargs",
+                            models.JSONField(
+                                default=dict,
+                                encoder=django.core.serializers.json.DjangoJSONEncoder,
+                            ),
+                        ),
+                        (
+                            "countdown",
+                            models.PositiveIntegerField(blank=True, null=True),
+                        ),
+                        ("created_at", models.DateTimeField(auto_now_add=True)),
+                        ("sent_at", models.DateTimeField(blank=True, null=True)),
+                        ("attempts", models.PositiveIntegerField(default=0)),
+                        ("failed_at", models.DateTimeField(blank=True, null=True)),
+                    ],
+                    options={
+                        "indexes": [
+                            models.Index(
+                                condition=models.Q(
+                                    ("failed_at__isnull", True),
+                                    ("sent_at__isnull", True),
+                                ),
+                                fields=["created_at"],
+                                name="outbox_unsent_idx",
+                            )
+                        ],
+                    },
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,30 @@
+# apps/outbox/models.py
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from django.db.models import Q
+
+
+class OutboxMessage(models.Model):
+    """A task call recorded with the transaction that caused it, see outbox.py."""
+    task = models.CharField(max_length=200)
+    kwargs = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    # Seconds the task waits once sent
+    countdown = models.PositiveIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    # Publishing failures other than the broker being down, e.g. a task
+    # that no longer exists; the relay gives up on the message at
+    # outbox.MAX_ATTEMPTS and sets failed_at
+    attempts = models.PositiveIntegerField(default=0)
+    failed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # The relay's sweep for messages still to send
+            models.Index(fields=['created_at'], condition=Q(sent_at__isnull=True, failed_at__isnull=True),
+                         name='outbox_unsent_idx'),
+        ]
+
+    def __str__(self):
+        return '%s %s' % (self.task, self.kwargs)
@@ -0,0 +1,120 @@
+# apps/outbox/outbox.py
+"""
+Transactional outbox for background tasks.
+
+A task call that must follow a database change is stored as an
+OutboxMessage in the same transaction, so it is queued if and only if
+the change commits. Once the transaction commits, its messages are
+published to the broker and marked sent. Messages the broker did not
+take (it was down, or the process died in between) are published by
+``manage.py relay_outbox``, run from cron.
+
+Delivery is at least once: a message published just before its UPDATE
+failed is published again by the relay. A message that fails for any
+other reason than the broker, such as a task name nobody registers, is
+logged and skipped so it does not hold up the rest; after MAX_ATTEMPTS
+such failures it is marked failed and left for someone to look at.
+
+    outbox.enqueue([
+        outbox.message('apps.orders.tasks.send_order_email', order_id=order.pk, kind='placed'),
+    ])
+
+Tasks are named rather than imported, so modules the tasks depend on
+can enqueue them.
+"""
+import logging
+from datetime import timedelta
+from importlib import import_module
+
+from celery import current_app
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from kombu.exceptions import OperationalError as BrokerError
+
+from .models import OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+# Messages younger than this are left to the transaction that wrote them
+RELAY_AFTER = timedelta(seconds=30)
+# Sent messages are kept this long
+RETENTION = timedelta(days=7)
+# Failures, other than the broker's, before a message is given up on
+MAX_ATTEMPTS = 5
+
+
+def message(task, countdown=None, **kwargs):
+    """An unsaved message calling the task named ``task`` with ``kwargs``."""
+    return OutboxMessage(task=task, kwargs=kwargs, countdown=countdown)
+
+
+def get_task(name):
+    # Only workers autodiscover tasks; elsewhere a task's module is
+    # imported when first needed
+    if name not in current_app.tasks:
+        import_module(name.rpartition('.')[0])
+    return current_app.tasks[name]
+
+
+def enqueue(messages):
+    """Store ``messages`` in the current transaction and publish them once it commits."""
+    messages = OutboxMessage.objects.bulk_create(messages)
+    transaction.on_commit(lambda: publish(messages))
+    return messages
+
+
+def publish(messages):
+    """Send ``messages`` to the broker and mark those it took. Returns how many it took."""
+    return len(_publish(messages)[0])
+
+
+def _publish(messages):
+    """(ids sent, ids that failed) of ``messages``; stops at the first broker error."""
+    sent, failed = [], []
+    for message in messages:
+        try:
+            # apply_async rather than send_task, which ignores eager mode
+            get_task(message.task).apply_async(
+                kwargs=message.kwargs, countdown=message.countdown,
+            )
+        except BrokerError:
+            logger.exception('Could not publish outbox message %s', message.pk)
+            break
+        except Exception:
+            logger.exception('Skipping outbox message %s for %s', message.pk, message.task)
+            failed.append(message.pk)
+            continue
+        sent.append(message.pk)
+    now = timezone.now()
+    if sent:
+        OutboxMessage.objects.filter(pk__in=sent).update(sent_at=now)
+    if failed:
+        OutboxMessage.objects.filter(pk__in=failed).update(attempts=F('attempts') + 1)
+        OutboxMessage.objects.filter(pk__in=failed, attempts__gte=MAX_ATTEMPTS).update(failed_at=now)
+    return sent, failed
+
+
+def relay(batch_size=500, now=None):
+    """
+    Publish the messages their own transaction did not, oldest first, and
+    delete sent ones older than RETENTION. Returns how many were published.
+    Messages that fail are tried once per run.
+    """
+    now = now or timezone.now()
+    published = 0
+    skipped = []
+    while True:
+        # Locked while being published, so concurrent relays skip them
+        with transaction.atomic():
+            batch = list(OutboxMessage.objects.select_for_update(skip_locked=True).filter(
+                sent_at=None, failed_at=None, created_at__lte=now - RELAY_AFTER,
+            ).exclude(pk__in=skipped).order_by('created_at')[:batch_size])
+            sent, failed = _publish(batch)
+        published += len(sent)
+        skipped.extend(failed)
+        # Done, or the broker is down
+        if len(batch) < batch_size or len(sent) + len(failed) < len(batch):
+            break
+    OutboxMessage.objects.filter(sent_at__lt=now - RETENTION).delete()
+    return published
@@ -1,3 +1,9 @@
 from django.contrib import admin
+from .models import ChainCursor, DepositAddress, IdempotencyKey, Payment, Transaction, WebhookEvent
 
-# Register your models here.
+admin.site.register(Payment)
+admin.site.register(Transaction)
+admin.site.register(WebhookEvent)
+admin.site.register(IdempotencyKey)
+admin.site.register(DepositAddress)
+admin.site.register(ChainCursor)
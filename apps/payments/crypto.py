@@ -0,0 +1,287 @@
+# apps/payments/crypto.py
+"""
+On-chain payments.
+
+CryptoProvider gives every CRYPTO payment a deposit address of its own,
+from a pool loaded with ``add_deposit_addresses``, and quotes the amount
+due in wei. ``manage.py watch_payments`` runs a Watcher, which follows
+the chain CONFIRMATIONS blocks behind its head, so what it reads is final
+and needs no reorg handling:
+
+* the pending deposits are kept in memory by address (DepositIndex), so
+  a block is matched with one dict lookup per transaction instead of a
+  balance query per pending payment;
+* blocks are read BATCH_BLOCKS at a time and their matches settled
+  together: a handful of bulk UPDATEs move the payments to SUCCEEDED and
+  their orders PENDING -> PAID, in the same transaction that advances
+  the watcher's ChainCursor, so a restarted watcher resumes where the
+  last one committed.
+
+A deposit counts once a single transfer of at least the quoted amount
+reaches its address. Smaller transfers are logged and left for manual
+handling.
+
+Blocks come from a JSON-RPC node (RpcChain, e.g. a local dev chain) or
+from a file recorded with ``watch_payments --record`` (RecordedChain).
+Settings, in ``CRYPTO_PAYMENTS``:
+
+    CRYPTO_PAYMENTS = {
+        'RPC_URL': 'http://127.0.0.1:8545',
+        'CONFIRMATIONS': 12,
+        'BATCH_BLOCKS': 50,
+        'POLL_INTERVAL': 5,
+    }
+"""
+import json
+import logging
+import time
+from collections import namedtuple
+from datetime import timedelta
+from decimal import ROUND_CEILING, Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from web3 import HTTPProvider, Web3
+
+from apps.orders.models import Order, StockReservation
+from .models import ChainCursor, DepositAddress, Payment, Transaction
+from .providers import Charge, PaymentProvider, ProviderError
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'RPC_URL': 'http://127.0.0.1:8545',
+    'CONFIRMATIONS': 12,
+    'BATCH_BLOCKS': 50,
+    'POLL_INTERVAL': 5,
+}
+
+WEI_PER_ETHER = Decimal(10) ** 18
+
+# A transfer to a pending deposit
+Match = namedtuple('Match', 'payment_id tx_hash value block')
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'CRYPTO_PAYMENTS', {})}
+
+
+class CryptoProvider(PaymentProvider):
+    """
+    ``rate`` is the price of one ether in the shop's currency. Override
+    ``quote()`` to use a price feed instead.
+    """
+
+    def __init__(self, name, rate=None):
+        super().__init__(name)
+        self.rate = None if rate is None else Decimal(rate)
+
+    def quote(self, payment):
+        if self.rate is None:
+            raise ProviderError('No ether price configured')
+        return int((payment.amount / self.rate * WEI_PER_ETHER).to_integral_value(ROUND_CEILING))
+
+    def charge(self, payment):
+        wei = self.quote(payment)
+        with transaction.atomic():
+            deposit = DepositAddress.objects.select_for_update(skip_locked=True).filter(
+                payment=None
+            ).order_by('id').first()
+            if deposit is None:
+                raise ProviderError('No free deposit address')
+            deposit.payment = payment
+            deposit.expected_wei = wei
+            deposit.assigned_at = timezone.now()
+            deposit.save(update_fields=['payment', 'expected_wei', 'assigned_at'])
+        return Charge(deposit.address, Payment.PENDING, {
+            'pay_to': deposit.address,
+            'amount_wei': str(wei),
+            'confirmations': get_config()['CONFIRMATIONS'],
+        })
+
+    def verify(self, body, headers):
+        # Confirmed by the watcher; there are no webhooks
+        return False
+
+
+class DepositIndex:
+    """Expected deposits of the pending payments, by lowercased address."""
+    # Assignments committing out of order are caught by re-reading this
+    # far back
+    OVERLAP = timedelta(minutes=1)
+    FULL_RELOAD = timedelta(minutes=10)
+
+    def __init__(self):
+        self.deposits = {}
+        self.loaded_at = self.reloaded_at = None
+
+    def __len__(self):
+        return len(self.deposits)
+
+    def refresh(self):
+        """Pick up deposits assigned since the last call; drop settled ones now and then."""
+        now = timezone.now()
+        pending = DepositAddress.objects.filter(payment__status=Payment.PENDING)
+        if self.reloaded_at is None or now - self.reloaded_at > self.FULL_RELOAD:
+            self.deposits = {}
+            self.reloaded_at = now
+        else:
+            pending = pending.filter(assigned_at__gte=self.loaded_at - self.OVERLAP)
+        for address, payment_id, wei in pending.values_list('address', 'payment_id', 'expected_wei'):
+            self.deposits[address.lower()] = (payment_id, int(wei))
+        self.loaded_at = now
+
+    def match(self, block):
+        for tx in block['transactions']:
+            deposit = self.deposits.get((tx['to'] or '').lower())
+            if deposit is None:
+                continue
+            payment_id, expected = deposit
+            if int(tx['value']) >= expected:
+                yield Match(payment_id, tx['hash'], int(tx['value']), block['number'])
+            else:
+                logger.warning('Transfer %s of %s wei is short of the %s due for payment %s',
+                               tx['hash'], tx['value'], expected, payment_id)
+
+    def discard(self, payment_ids):
+        payment_ids = set(payment_ids)
+        self.deposits = {
+            address: deposit for address, deposit in self.deposits.items() if deposit[0] not in payment_ids
+        }
+
+
+def settle_deposits(provider, matches):
+    """
+    Mark the payments in ``matches`` succeeded and their orders paid, in
+    bulk. Returns the ids of the payments settled.
+    """
+    first = {}
+    for match in matches:
+        first.setdefault(match.payment_id, match)
+    payments = {
+        pk: (order_id, amount, currency)
+        for pk, order_id, amount, currency in Payment.objects.select_for_update().filter(
+            pk__in=first, status=Payment.PENDING
+        ).values_list('pk', 'order_id', 'amount', 'currency')
+    }
+    if not payments:
+        return []
+
+    now = timezone.now()
+    Transaction.objects.bulk_create([
+        Transaction(
+            payment_id=pk, provider=provider, provider_reference=first[pk].tx_hash,
+            status=Payment.SUCCEEDED, amount=amount, currency=currency,
+        )
+        for pk, (order_id, amount, currency) in payments.items()
+    ], ignore_conflicts=True)
+    Payment.objects.filter(pk__in=payments).update(status=Payment.SUCCEEDED, updated_at=now)
+
+    order_ids = {order_id for order_id, _, _ in payments.values()}
+    payable = set(Order.objects.select_for_update().filter(
+        pk__in=order_ids, status='PENDING'
+    ).values_list('pk', flat=True))
+    Order.objects.filter(pk__in=payable).update(status='PAID', updated_at=now)
+    StockReservation.objects.filter(order_id__in=payable, status=StockReservation.ACTIVE).update(
+        status=StockReservation.COMMITTED
+    )
+    for order_id in order_ids - payable:
+        logger.warning('Deposit received for order %s, which is no longer pending', order_id)
+    return list(payments)
+
+
+class RpcChain:
+    def __init__(self, url):
+        self.web3 = Web3(HTTPProvider(url))
+
+    def head(self):
+        return self.web3.eth.block_number
+
+    def block(self, number):
+        block = self.web3.eth.get_block(number, full_transactions=True)
+        return {
+            'number': number,
+            'transactions': [
+                {'hash': tx['hash'].hex(), 'to': tx['to'], 'value': tx['value']}
+                for tx in block['transactions']
+            ],
+        }
+
+
+class RecordedChain:
+    """Blocks stored one JSON object per line, as ``Recorder`` writes them."""
+
+    def __init__(self, path):
+        with open(path) as lines:
+            self.blocks = {block['number']: block for block in map(json.loads, lines)}
+
+    def head(self):
+        return max(self.blocks)
+
+    def block(self, number):
+        return self.blocks.get(number, {'number': number, 'transactions': []})
+
+
+class Recorder:
+    """Wraps a chain and appends every block read from it to ``path``."""
+
+    def __init__(self, chain, path):
+        self.chain = chain
+        self.file = open(path, 'a')
+
+    def head(self):
+        return self.chain.head()
+
+    def block(self, number):
+        block = self.chain.block(number)
+        self.file.write(json.dumps(block, default=str) + '\n')
+        self.file.flush()
+        return block
+
+
+class Watcher:
+    def __init__(self, chain, provider='crypto', cursor='ethereum', confirmations=None, batch_blocks=None):
+        config = get_config()
+        self.chain = chain
+        self.provider = provider
+        self.cursor = cursor
+        self.confirmations = config['CONFIRMATIONS'] if confirmations is None else confirmations
+        self.batch_blocks = batch_blocks or config['BATCH_BLOCKS']
+        self.index = DepositIndex()
+
+    def final_block(self):
+        return self.chain.head() - self.confirmations + 1
+
+    def step(self):
+        """Process the next batch of final blocks. Returns how many blocks were read."""
+        final = self.final_block()
+        # A new watcher starts from the current final block
+        start = ChainCursor.objects.get_or_create(name=self.cursor, defaults={'block': final})[0].block + 1
+        end = min(final, start + self.batch_blocks - 1)
+        if end < start:
+            return 0
+
+        self.index.refresh()
+        matches = []
+        if self.index:
+            for number in range(start, end + 1):
+                matches.extend(self.index.match(self.chain.block(number)))
+
+        with transaction.atomic():
+            # Another watcher may have got there first
+            if not ChainCursor.objects.filter(name=self.cursor, block=start - 1).update(block=end):
+                return 0
+            settled = settle_deposits(self.provider, matches)
+        self.index.discard(settled)
+        if settled:
+            logger.info('Blocks %d-%d settled %d payment(s)', start, end, len(settled))
+        return end - start + 1
+
+    def run(self, once=False):
+        while True:
+            read = self.step()
+            if once and not read:
+                return
+            if not read:
+                time.sleep(get_config()['POLL_INTERVAL'])
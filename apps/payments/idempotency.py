@@ -0,0 +1,90 @@
+# apps/payments/idempotency.py
+"""
+Idempotent POSTs.
+
+A client that times out cannot tell whether its request went through, so
+``create`` on a viewset using IdempotentCreateMixin requires an
+``Idempotency-Key`` header. The first request with a key runs and its
+response is stored; retries with the same key get that response back
+(with ``Idempotent-Replayed: true``) instead of running again. A key is
+scoped to its user, remembered for ``IDEMPOTENCY_KEY_TTL`` seconds and
+refused for a different request body. Server errors are not stored, so
+the client can retry them with the same key.
+"""
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+
+
+def request_hash(request):
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    return hashlib.sha256(('%s %s %s' % (request.method, request.path, body)).encode()).hexdigest()
+
+
+def claim(user, key, fingerprint):
+    """The stored record for ``key`` and whether this request just created it."""
+    cutoff = timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+    IdempotencyKey.objects.filter(user=user, key=key, created_at__lt=cutoff).delete()
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(user=user, key=key, request_hash=fingerprint), True
+    except IntegrityError:
+        return IdempotencyKey.objects.get(user=user, key=key), False
+
+
+def purge_idempotency_keys():
+    """Delete the keys past their TTL. Returns how many."""
+    cutoff = timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+    return IdempotencyKey.objects.filter(created_at__lt=cutoff).delete()[0]
+
+
+class IdempotentCreateMixin:
+    def create(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key or len(key) > 255:
+            return Response(
+                {'detail': 'An %s header of up to 255 characters is required.' % HEADER},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        fingerprint = request_hash(request)
+        record, created = claim(request.user, key, fingerprint)
+        if not created:
+            if record.request_hash != fingerprint:
+                return Response(
+                    {'detail': 'This %s was used for a different request.' % HEADER},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                )
+            if record.status_code is None:
+                return Response(
+                    {'detail': 'A request with this %s is still in progress.' % HEADER},
+                    status=status.HTTP_409_CONFLICT,
+                )
+            return Response(record.response, status=record.status_code, headers={'Idempotent-Replayed': 'true'})
+
+        try:
+            response = super().create(request, *args, **kwargs)
+        except APIException as exc:
+            # Stored like any other response, e.g. a validation error
+            response = self.handle_exception(exc)
+        except Exception:
+            record.delete()
+            raise
+        if response.status_code >= 500:
+            record.delete()
+        else:
+            record.status_code = response.status_code
+            record.response = response.data
+            record.save(update_fields=['status_code', 'response'])
+        return response
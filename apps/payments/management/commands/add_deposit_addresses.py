@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+from web3 import Web3
+
+from apps.payments.models import DepositAddress
+
+
+class Command(BaseCommand):
+    help = 'Add deposit addresses, one per line, to the pool handed out to crypto payments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file')
+
+    def handle(self, *args, **options):
+        with open(options['file']) as lines:
+            addresses = [line.strip() for line in lines if line.strip()]
+        invalid = [address for address in addresses if not Web3.is_address(address)]
+        if invalid:
+            raise CommandError('Not addresses: %s' % ', '.join(invalid[:5]))
+        before = DepositAddress.objects.count()
+        DepositAddress.objects.bulk_create(
+            [DepositAddress(address=Web3.to_checksum_address(address)) for address in addresses],
+            batch_size=1000, ignore_conflicts=True,
+        )
+        self.stdout.write('Added %d address(es)' % (DepositAddress.objects.count() - before))
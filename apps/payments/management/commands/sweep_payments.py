@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from apps.payments.idempotency import purge_idempotency_keys
+from apps.payments.webhooks import requeue_stale_events
+
+
+class Command(BaseCommand):
+    help = 'Queue again webhooks whose task was lost and delete expired idempotency keys'
+
+    def handle(self, *args, **options):
+        requeued = requeue_stale_events()
+        purged = purge_idempotency_keys()
+        self.stdout.write('Queued %d webhook(s) again, deleted %d idempotency key(s)' % (requeued, purged))
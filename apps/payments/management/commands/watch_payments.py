@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from apps.payments.crypto import Recorder, RecordedChain, RpcChain, Watcher, get_config
+from apps.payments.models import ChainCursor
+
+
+class Command(BaseCommand):
+    help = 'Follow the chain and mark crypto payments paid once their deposits are final'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rpc-url', default=None, help='JSON-RPC node, CRYPTO_PAYMENTS["RPC_URL"] by default')
+        parser.add_argument('--replay', metavar='FILE', help='Read blocks recorded with --record instead')
+        parser.add_argument('--record', metavar='FILE', help='Append every block read to FILE')
+        parser.add_argument('--from-block', type=int, help='Resume after this block')
+        parser.add_argument('--once', action='store_true', help='Stop once caught up with the chain')
+
+    def handle(self, *args, **options):
+        if options['replay']:
+            chain = RecordedChain(options['replay'])
+        else:
+            chain = RpcChain(options['rpc_url'] or get_config()['RPC_URL'])
+        if options['record']:
+            chain = Recorder(chain, options['record'])
+
+        watcher = Watcher(chain)
+        if options['from_block'] is not None:
+            ChainCursor.objects.update_or_create(name=watcher.cursor, defaults={'block': options['from_block']})
+        watcher.run(once=options['once'])
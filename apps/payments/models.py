@@ -1,3 +1,146 @@
+# apps/payments/models.py
+import uuid
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.utils import timezone
+
+
+def new_reference():
+    return uuid.uuid4().hex
+
+
+class Payment(models.Model):
+    """One attempt to collect an order's total through a provider."""
+    PENDING = 'PENDING'
+    SUCCEEDED = 'SUCCEEDED'
+    FAILED = 'FAILED'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+
+    order = models.ForeignKey('orders.Order', on_delete=models.PROTECT, related_name='payments')
+    provider = models.CharField(max_length=30)
+    # Ours, sent to the provider with the charge so its webhooks can be
+    # matched before the charge call has even returned
+    reference = models.CharField(max_length=32, unique=True, default=new_reference, editable=False)
+    provider_reference = models.CharField(max_length=100, blank=True)
+    method = models.CharField(max_length=10)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    currency = models.CharField(max_length=3)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    # What the client must do to complete the payment, e.g. a checkout URL
+    next_action = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            # An order is charged once: a second payment can only start
+            # after the first failed
+            models.UniqueConstraint(
+                fields=['order'], condition=models.Q(status__in=['PENDING', 'SUCCEEDED']),
+                name='one_open_payment_per_order',
+            ),
+        ]
+
+
+class WebhookEvent(models.Model):
+    """A provider notification, stored as received and processed by a worker."""
+    RECEIVED = 'RECEIVED'
+    PROCESSED = 'PROCESSED'
+    IGNORED = 'IGNORED'
+    STATUS_CHOICES = [
+        (RECEIVED, 'Received'),
+        (PROCESSED, 'Processed'),
+        (IGNORED, 'Ignored'),
+    ]
+
+    provider = models.CharField(max_length=30)
+    event_id = models.CharField(max_length=100)
+    payload = models.JSONField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=RECEIVED)
+    error = models.TextField(blank=True)
+    received_at = models.DateTimeField(default=timezone.now)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            # Providers redeliver until acknowledged
+            models.UniqueConstraint(fields=['provider', 'event_id'], name='unique_webhook_event'),
+        ]
+        indexes = [
+            # The sweep for events whose task never ran
+            models.Index(
+                fields=['received_at'], condition=models.Q(status='RECEIVED'),
+                name='webhook_received_idx',
+            ),
+        ]
+
+
+class Transaction(models.Model):
+    """Money movement reported by a provider against a payment."""
+    payment = models.ForeignKey(Payment, on_delete=models.PROTECT, related_name='transactions')
+    provider = models.CharField(max_length=30)
+    provider_reference = models.CharField(max_length=100)
+    status = models.CharField(max_length=10, choices=Payment.STATUS_CHOICES)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    currency = models.CharField(max_length=3)
+    event = models.ForeignKey(WebhookEvent, null=True, blank=True, on_delete=models.SET_NULL)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['provider', 'provider_reference'], name='unique_provider_transaction'
+            ),
+        ]
+
+
+class IdempotencyKey(models.Model):
+    """
+    The response to a client request sent with an ``Idempotency-Key``
+    header, replayed when the client retries with the same key.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    key = models.CharField(max_length=255)
+    # SHA-256 of the request, so a key reused for another request is refused
+    request_hash = models.CharField(max_length=64)
+    # Null while the first request is still running
+    status_code = models.PositiveSmallIntegerField(null=True)
+    response = models.JSONField(null=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key'),
+        ]
+
+
+class DepositAddress(models.Model):
+    """
+    An address for on-chain payments, generated offline from the wallet
+    and loaded with ``add_deposit_addresses``. Each is handed to one
+    payment only.
+    """
+    address = models.CharField(max_length=42, unique=True)
+    payment = models.OneToOneField(Payment, null=True, blank=True, on_delete=models.PROTECT,
+                                   related_name='deposit')
+    expected_wei = models.DecimalField(max_digits=40, decimal_places=0, null=True, blank=True)
+    assigned_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Free addresses, taken in order
+            models.Index(fields=['id'], condition=models.Q(payment=None), name='deposit_free_idx'),
+        ]
+
 
-# Create your models here.
+class ChainCursor(models.Model):
+    """The last block a payment watcher has processed."""
+    name = models.CharField(max_length=30, unique=True)
+    block = models.PositiveBigIntegerField()
+    updated_at = models.DateTimeField(auto_now=True)
@@ -0,0 +1,139 @@
+# apps/payments/providers.py
+"""
+Payment providers.
+
+A provider starts charges and interprets the webhooks it sends back.
+Providers are configured by name in ``PAYMENT_PROVIDERS``:
+
+    PAYMENT_PROVIDERS = {
+        'fake': {
+            'BACKEND': 'apps.payments.providers.FakeProvider',
+            'OPTIONS': {'webhook_secret': '...'},
+        },
+    }
+
+FakeProvider stands in for a real one in development, tests and
+benchmarks: charges stay pending until a webhook built with
+``FakeProvider.webhook()`` reports their outcome.
+"""
+import hashlib
+import hmac
+import json
+import uuid
+from collections import namedtuple
+from decimal import Decimal
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .models import Payment
+
+# What a charge call returned
+Charge = namedtuple('Charge', 'provider_reference status next_action')
+
+# What a webhook reported. ``status`` is a Payment status, or None for an
+# event that is not a charge's outcome; ``transaction`` is the provider's
+# id for the money movement
+ProviderEvent = namedtuple('ProviderEvent', 'id reference transaction status amount currency')
+
+
+class ProviderError(Exception):
+    """The provider could not be reached or did not answer the charge."""
+
+
+class PaymentProvider:
+    def __init__(self, name):
+        self.name = name
+
+    def charge(self, payment):
+        """
+        Start collecting ``payment``. Returns a Charge, whose status is
+        FAILED if the provider declined it. Raises ProviderError when the
+        outcome is unknown.
+        """
+        raise NotImplementedError
+
+    def verify(self, body, headers):
+        """Whether the webhook ``body`` (bytes) really comes from the provider."""
+        raise NotImplementedError
+
+    def parse(self, payload):
+        """
+        The ProviderEvent in a verified webhook's decoded JSON payload. Event
+        types the provider may send but that say nothing of a charge give
+        an event with only its id, so they can be acknowledged.
+        """
+        raise NotImplementedError
+
+
+class FakeProvider(PaymentProvider):
+    SIGNATURE_HEADER = 'X-Fake-Signature'
+    STATUSES = {'charge.succeeded': Payment.SUCCEEDED, 'charge.failed': Payment.FAILED}
+
+    def __init__(self, name, webhook_secret, decline_above=None):
+        super().__init__(name)
+        self.secret = webhook_secret.encode()
+        self.decline_above = None if decline_above is None else Decimal(decline_above)
+        # Every charge taken, for tests to count
+        self.charges = []
+
+    def charge(self, payment):
+        self.charges.append(payment.reference)
+        reference = 'fake_%s' % uuid.uuid4().hex
+        if self.decline_above is not None and payment.amount > self.decline_above:
+            return Charge(reference, Payment.FAILED, {})
+        return Charge(reference, Payment.PENDING, {'redirect_url': 'https://pay.example.com/%s' % reference})
+
+    def sign(self, body):
+        return hmac.new(self.secret, body, hashlib.sha256).hexdigest()
+
+    def verify(self, body, headers):
+        return hmac.compare_digest(self.sign(body), headers.get(self.SIGNATURE_HEADER, ''))
+
+    def parse(self, payload):
+        status = self.STATUSES.get(payload['type'])
+        if status is None:
+            return ProviderEvent(payload['id'], None, None, None, None, None)
+        data = payload['data']
+        return ProviderEvent(
+            payload['id'], data['reference'], data['transaction'], status,
+            Decimal(data['amount']), data['currency'],
+        )
+
+    def webhook(self, payment, succeeded=True, amount=None, event_id=None):
+        """A signed webhook for ``payment``, as ``(body, headers)``."""
+        body = json.dumps({
+            'id': event_id or 'evt_%s' % uuid.uuid4().hex,
+            'type': 'charge.succeeded' if succeeded else 'charge.failed',
+            'data': {
+                'reference': payment.reference,
+                'transaction': 'txn_%s' % uuid.uuid4().hex,
+                'amount': str(payment.amount if amount is None else amount),
+                'currency': payment.currency,
+            },
+        }).encode()
+        return body, {self.SIGNATURE_HEADER: self.sign(body)}
+
+
+@lru_cache(maxsize=None)
+def load_provider(name):
+    try:
+        config = settings.PAYMENT_PROVIDERS[name]
+    except KeyError:
+        raise ImproperlyConfigured('Unknown payment provider %r' % name)
+    return import_string(config['BACKEND'])(name, **config.get('OPTIONS', {}))
+
+
+def get_provider(name=None):
+    """The provider called ``name``, by default ``DEFAULT_PAYMENT_PROVIDER``."""
+    return load_provider(name or settings.DEFAULT_PAYMENT_PROVIDER)
+
+
+@receiver(setting_changed)
+def reset_providers(setting, **kwargs):
+    if setting == 'PAYMENT_PROVIDERS':
+        load_provider.cache_clear()
@@ -0,0 +1,73 @@
+# apps/payments/serializers.py
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from rest_framework import serializers, status
+from rest_framework.exceptions import APIException
+
+from apps.orders.models import Order
+from .models import Payment
+from .providers import ProviderError, get_provider
+from .webhooks import apply_status
+
+
+class PaymentInProgress(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'This order already has a payment in progress or completed.'
+    default_code = 'payment_in_progress'
+
+
+class ProviderUnavailable(APIException):
+    status_code = status.HTTP_502_BAD_GATEWAY
+    default_detail = 'The payment provider could not be reached. Try again later.'
+    default_code = 'provider_unavailable'
+
+
+class PaymentSerializer(serializers.ModelSerializer):
+    order_id = serializers.IntegerField()
+
+    class Meta:
+        model = Payment
+        fields = ['id', 'order_id', 'provider', 'reference', 'method', 'amount',
+                  'currency', 'status', 'next_action', 'created_at']
+        read_only_fields = ['provider', 'reference', 'method', 'amount', 'currency',
+                            'status', 'next_action', 'created_at']
+
+    def validate(self, attrs):
+        order = Order.objects.filter(pk=attrs['order_id'], user=self.context['request'].user).first()
+        if order is None:
+            raise serializers.ValidationError({'order_id': 'Order not found.'})
+        if order.status != 'PENDING':
+            raise serializers.ValidationError({'order_id': 'Only pending orders can be paid.'})
+        attrs['order'] = order
+        return attrs
+
+    def create(self, validated_data):
+        order = validated_data['order']
+        provider = get_provider(settings.PAYMENT_METHOD_PROVIDERS.get(order.payment_method))
+        # The amount is the order's, never the client's
+        try:
+            with transaction.atomic():
+                payment = Payment.objects.create(
+                    order=order, provider=provider.name, method=order.payment_method,
+                    amount=order.total_amount, currency=settings.PAYMENT_CURRENCY,
+                )
+        except IntegrityError:
+            raise PaymentInProgress()
+
+        # Outside any transaction: the provider call can take seconds
+        try:
+            charge = provider.charge(payment)
+        except ProviderError:
+            # Failed, so a retry can start a new payment
+            payment.status = Payment.FAILED
+            payment.save(update_fields=['status', 'updated_at'])
+            raise ProviderUnavailable()
+
+        with transaction.atomic():
+            payment = Payment.objects.select_for_update().get(pk=payment.pk)
+            payment.provider_reference = charge.provider_reference
+            payment.next_action = charge.next_action
+            payment.save(update_fields=['provider_reference', 'next_action', 'updated_at'])
+            # A webhook may already have settled it
+            apply_status(payment, charge.status)
+        return payment
@@ -0,0 +1,12 @@
+# apps/payments/tasks.py
+from celery import shared_task
+from django.db import OperationalError
+
+from .webhooks import process_event
+
+
+# Retried when the database is briefly unreachable; process_event is a
+# no-op for an event already applied
+@shared_task(autoretry_for=(OperationalError,), retry_backoff=True, max_retries=5)
+def process_webhook(event_id):
+    return process_event(event_id)
@@ -1,3 +1,290 @@
-from django.test import TestCase
+import json
+import tempfile
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from apps.accounts.models import Address, User
+from apps.orders.inventory import reserve_stock
+from apps.orders.models import Order, OrderItem, StockReservation
+from apps.products.models import Category, Product
+from .crypto import Match, RecordedChain, Watcher, settle_deposits
+from .models import ChainCursor, DepositAddress, IdempotencyKey, Payment, Transaction, WebhookEvent
+from .providers import ProviderError, get_provider
+from .webhooks import process_event, requeue_stale_events
+
+PROVIDERS = {
+    'fake': {
+        'BACKEND': 'apps.payments.providers.FakeProvider',
+        'OPTIONS': {'webhook_secret': 'test-secret', 'decline_above': '1000.00'},
+    },
+    # 1 ether = 1,000,000.00
+    'crypto': {'BACKEND': 'apps.payments.crypto.CryptoProvider', 'OPTIONS': {'rate': '1000000'}},
+}
+
+
+@override_settings(PAYMENT_PROVIDERS=PROVIDERS, DEFAULT_PAYMENT_PROVIDER='fake')
+class PaymentTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='buyer@example.com', username='buyer', password='secret'
+        )
+        cls.address = Address.objects.create(
+            user=cls.user, street_address='1 Marina', city='Lagos',
+            state='LA', phone_number='08000000000'
+        )
+        cls.product = Product.objects.create(
+            name='Kettle', category=Category.objects.create(name='Kitchen'), description='Boils',
+            price=Decimal('20.00'), stock_quantity=100, weight=Decimal('1.00')
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.provider = get_provider()
+        self.provider.charges.clear()
+        self.order = self.create_order(2)
+
+    def create_order(self, quantity, payment_method='FIAT'):
+        order = Order.objects.create(
+            user=self.user, shipping_address=self.address, shipping_cost=Decimal('5.00'),
+            payment_method=payment_method,
+        )
+        item = OrderItem.objects.create(order=order, product=self.product, quantity=quantity, price=self.product.price)
+        reserve_stock(order, [item])
+        order.refresh_from_db()
+        return order
+
+    def pay(self, order, key='key-1'):
+        return self.client.post(
+            '/api/payments/payments/', {'order_id': order.pk}, format='json',
+            HTTP_IDEMPOTENCY_KEY=key,
+        )
+
+    def send(self, body, headers):
+        return APIClient().post(
+            '/api/payments/webhooks/fake/', body, content_type='application/json',
+            headers=headers,
+        )
+
+
+class PaymentCreateTests(PaymentTestCase):
+    def test_charges_the_order_total(self):
+        response = self.pay(self.order)
+        self.assertEqual(response.status_code, 201)
+        payment = Payment.objects.get()
+        self.assertEqual((payment.amount, payment.currency, payment.status), (Decimal('45.00'), 'NGN', 'PENDING'))
+        self.assertEqual(response.data['next_action']['redirect_url'][:24], 'https://pay.example.com/')
+        self.assertEqual(self.provider.charges, [payment.reference])
+
+    def test_retry_with_the_same_key_replays_the_response(self):
+        first = self.pay(self.order)
+        second = self.pay(self.order)
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(len(self.provider.charges), 1)
+
+        # Keys are per user
+        other = User.objects.create_user(email='other@example.com', username='other', password='secret')
+        self.client.force_authenticate(other)
+        self.assertEqual(self.pay(self.order).status_code, 400)
+
+    def test_key_is_required_and_bound_to_its_request(self):
+        response = self.client.post('/api/payments/payments/', {'order_id': self.order.pk}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.pay(self.order)
+        self.assertEqual(self.pay(self.create_order(1)).status_code, 422)
+
+    def test_key_in_use_is_refused(self):
+        IdempotencyKey.objects.create(user=self.user, key='key-1', request_hash='')
+        with mock.patch('apps.payments.idempotency.request_hash', return_value=''):
+            self.assertEqual(self.pay(self.order).status_code, 409)
+
+    def test_order_is_not_charged_twice(self):
+        self.assertEqual(self.pay(self.order, 'key-1').status_code, 201)
+        response = self.pay(self.order, 'key-2')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(len(self.provider.charges), 1)
+
+    def test_provider_error_lets_the_client_retry(self):
+        with mock.patch.object(self.provider, 'charge', side_effect=ProviderError):
+            self.assertEqual(self.pay(self.order).status_code, 502)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(self.pay(self.order).status_code, 201)
+        self.assertEqual(
+            list(Payment.objects.order_by('id').values_list('status', flat=True)), ['FAILED', 'PENDING']
+        )
+
+    def test_declined_payment_can_be_retried(self):
+        order = self.create_order(60)
+        response = self.pay(order, 'key-1')
+        self.assertEqual((response.status_code, response.data['status']), (201, 'FAILED'))
+        self.assertEqual(self.pay(order, 'key-2').status_code, 201)
+
+    def test_only_own_pending_orders(self):
+        self.order.status = 'CANCELLED'
+        self.order.save()
+        self.assertEqual(self.pay(self.order).status_code, 400)
+        self.assertFalse(self.provider.charges)
+
+
+class WebhookTests(PaymentTestCase):
+    def setUp(self):
+        super().setUp()
+        self.pay(self.order)
+        self.payment = Payment.objects.get()
+
+    def test_acknowledges_and_queues(self):
+        body, headers = self.provider.webhook(self.payment)
+        with mock.patch('apps.payments.views.process_webhook.delay') as delay:
+            response = self.send(body, headers)
+            self.assertEqual(response.status_code, 202)
+            event = WebhookEvent.objects.get()
+            delay.assert_called_once_with(event.pk)
+            self.assertEqual(event.status, 'RECEIVED')
+            self.payment.refresh_from_db()
+            self.assertEqual(self.payment.status, 'PENDING')
+
+            # Redelivered: acknowledged, not queued again
+            self.assertEqual(self.send(body, headers).status_code, 200)
+            delay.assert_called_once()
+
+    def test_acknowledges_unknown_event_types(self):
+        body = json.dumps({'id': 'evt_refund', 'type': 'refund.created', 'data': {'refund': 're_1'}}).encode()
+        headers = {'X-Fake-Signature': self.provider.sign(body)}
+        with mock.patch('apps.payments.views.process_webhook.delay') as delay:
+            self.assertEqual(self.send(body, headers).status_code, 200)
+            self.assertEqual(self.send(body, headers).status_code, 200)
+        delay.assert_not_called()
+        event = WebhookEvent.objects.get()
+        self.assertEqual((event.event_id, event.status), ('evt_refund', 'IGNORED'))
+        self.assertFalse(process_event(event.pk))
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'PENDING')
+
+    def test_rejects_bad_signatures(self):
+        body, headers = self.provider.webhook(self.payment)
+        response = self.send(body, {'X-Fake-Signature': '0' * 64})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.send(b'{}', {'X-Fake-Signature': self.provider.sign(b'{}')}).status_code, 400)
+        self.assertEqual(APIClient().post('/api/payments/webhooks/other/', {}).status_code, 404)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+    def test_success_pays_the_order(self):
+        # Tests run Celery tasks inline
+        body, headers = self.provider.webhook(self.payment)
+        self.assertEqual(self.send(body, headers).status_code, 202)
+        self.payment.refresh_from_db()
+        self.order.refresh_from_db()
+        self.assertEqual((self.payment.status, self.order.status), ('SUCCEEDED', 'PAID'))
+        self.assertEqual(self.order.reservations.get().status, StockReservation.COMMITTED)
+        self.assertEqual(WebhookEvent.objects.get().status, 'PROCESSED')
+        self.assertFalse(process_event(WebhookEvent.objects.get().pk))
+
+        # A failure reported afterwards does not undo it
+        self.send(*self.provider.webhook(self.payment, succeeded=False))
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'SUCCEEDED')
+        self.assertEqual(self.payment.transactions.count(), 2)
+
+    def test_failure_frees_the_order_for_another_payment(self):
+        self.send(*self.provider.webhook(self.payment, succeeded=False))
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'FAILED')
+        self.assertEqual(self.pay(self.order, 'key-2').status_code, 201)
+
+    def test_wrong_amount_is_ignored(self):
+        with self.assertLogs('apps.payments.webhooks', 'WARNING'):
+            self.send(*self.provider.webhook(self.payment, amount='1.00'))
+        event = WebhookEvent.objects.get()
+        self.assertEqual(event.status, 'IGNORED')
+        self.assertIn('Reported 1.00 NGN', event.error)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'PENDING')
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_lost_tasks_are_queued_again(self):
+        body, headers = self.provider.webhook(self.payment)
+        with mock.patch('apps.payments.views.process_webhook.delay'):
+            self.send(body, headers)
+        WebhookEvent.objects.update(received_at=self.payment.created_at.replace(year=2000))
+        self.assertEqual(requeue_stale_events(), 1)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'PAID')
+        self.assertEqual(requeue_stale_events(), 0)
+
+
+class CryptoWatcherTests(PaymentTestCase):
+    def setUp(self):
+        super().setUp()
+        DepositAddress.objects.bulk_create(
+            DepositAddress(address='0x%040x' % index) for index in range(1, 6)
+        )
+        ChainCursor.objects.create(name='ethereum', block=0)
+
+    def pay_crypto(self, key):
+        order = self.create_order(2, payment_method='CRYPTO')
+        response = self.pay(order, key)
+        self.assertEqual(response.status_code, 201)
+        return order, response.data['next_action']
+
+    def replay(self, blocks, head=20):
+        """A RecordedChain of ``blocks`` ({number: [(to, value)]}) up to ``head``."""
+        self.file = tempfile.NamedTemporaryFile('w', suffix='.jsonl')
+        self.addCleanup(self.file.close)
+        for number in range(1, head + 1):
+            transactions = [
+                {'hash': '0x%d-%d' % (number, index), 'to': to, 'value': value}
+                for index, (to, value) in enumerate(blocks.get(number, []))
+            ]
+            self.file.write(json.dumps({'number': number, 'transactions': transactions}) + '\n')
+        self.file.flush()
+        return RecordedChain(self.file.name)
+
+    def test_quotes_a_deposit_address(self):
+        order, action = self.pay_crypto('key-1')
+        payment = Payment.objects.get(order=order)
+        self.assertEqual((payment.provider, payment.method), ('crypto', 'CRYPTO'))
+        # 45.00 at 1,000,000 per ether
+        self.assertEqual(action['amount_wei'], str(45 * 10 ** 12))
+        self.assertEqual(action['pay_to'], payment.deposit.address)
+
+    def test_settles_final_deposits_in_bulk(self):
+        paid, first = self.pay_crypto('key-1')
+        short, second = self.pay_crypto('key-2')
+        late, third = self.pay_crypto('key-3')
+        chain = self.replay({
+            3: [('0x' + 'f' * 40, 10 ** 18), (first['pay_to'].upper(), int(first['amount_wei']) + 1)],
+            4: [(second['pay_to'], int(second['amount_wei']) - 1)],
+            # Not final yet: the head is 20 and five confirmations are needed
+            17: [(third['pay_to'], int(third['amount_wei']))],
+        })
+        with self.assertLogs('apps.payments.crypto', 'WARNING'):
+            Watcher(chain, confirmations=5, batch_blocks=4).run(once=True)
+
+        self.assertEqual(ChainCursor.objects.get().block, 16)
+        statuses = dict(Order.objects.values_list('pk', 'status'))
+        self.assertEqual(
+            [statuses[order.pk] for order in (paid, short, late)], ['PAID', 'PENDING', 'PENDING']
+        )
+        payment = Payment.objects.get(order=paid)
+        self.assertEqual(payment.status, 'SUCCEEDED')
+        self.assertEqual(payment.transactions.get().provider_reference, '0x3-1')
+        self.assertEqual(paid.reservations.get().status, StockReservation.COMMITTED)
+
+    def test_settling_costs_the_same_for_any_batch(self):
+        payments = [Payment.objects.get(order=self.pay_crypto('key-%d' % i)[0]) for i in range(5)]
+        matches = [Match(payment.pk, '0x%d' % payment.pk, 1, 1) for payment in payments]
+        with self.assertNumQueries(6):
+            settled = settle_deposits('crypto', matches)
+        self.assertEqual(sorted(settled), sorted(payment.pk for payment in payments))
+        self.assertEqual(Order.objects.filter(status='PAID').count(), 5)
+
+    def test_runs_out_of_addresses(self):
+        DepositAddress.objects.filter(payment=None).delete()
+        order = self.create_order(1, payment_method='CRYPTO')
+        self.assertEqual(self.pay(order).status_code, 502)
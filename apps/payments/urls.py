@@ -0,0 +1,11 @@
+from django.urls import path, include
+from rest_framework.routers import DefaultRouter
+from .views import PaymentViewSet, WebhookView
+
+router = DefaultRouter()
+router.register(r'payments', PaymentViewSet, basename='payment')
+
+urlpatterns = [
+    path('', include(router.urls)),
+    path('webhooks/<str:provider>/', WebhookView.as_view(), name='payment-webhook'),
+]
@@ -1,3 +1,57 @@
-from django.shortcuts import render
+# apps/payments/views.py
+import json
+import logging
 
-# Create your views here.
+from django.conf import settings
+from django.http import Http404
+from kombu.exceptions import OperationalError as BrokerError
+from rest_framework import mixins, permissions, status, viewsets
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .idempotency import IdempotentCreateMixin
+from .models import Payment, WebhookEvent
+from .providers import get_provider
+from .serializers import PaymentSerializer
+from .tasks import process_webhook
+from .webhooks import record_event
+
+logger = logging.getLogger(__name__)
+
+
+class PaymentViewSet(IdempotentCreateMixin, mixins.CreateModelMixin, mixins.ListModelMixin,
+                     mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    serializer_class = PaymentSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return Payment.objects.filter(order__user=self.request.user)
+
+
+class WebhookView(APIView):
+    """Acknowledges provider webhooks and leaves the processing to a worker."""
+    # Providers authenticate by signing the body
+    authentication_classes = []
+    permission_classes = [permissions.AllowAny]
+
+    def post(self, request, provider):
+        if provider not in settings.PAYMENT_PROVIDERS:
+            raise Http404
+        backend = get_provider(provider)
+        body = request.body
+        if not backend.verify(body, request.headers):
+            return Response({'detail': 'Invalid signature.'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            event = record_event(backend, json.loads(body))
+        except (ValueError, KeyError, TypeError):
+            return Response({'detail': 'Malformed event.'}, status=status.HTTP_400_BAD_REQUEST)
+        if event is None or event.status != WebhookEvent.RECEIVED:
+            # A redelivery of an event already stored, or one with nothing to apply
+            return Response(status=status.HTTP_200_OK)
+
+        try:
+            process_webhook.delay(event.pk)
+        except BrokerError:
+            # Stored all the same; the sweep queues it again
+            logger.exception('Could not queue %s webhook %s', provider, event.event_id)
+        return Response(status=status.HTTP_202_ACCEPTED)
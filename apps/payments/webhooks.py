@@ -0,0 +1,116 @@
+# apps/payments/webhooks.py
+"""
+Webhook ingestion.
+
+Providers time out and redeliver when a webhook is slow to answer, so the
+endpoint only checks the signature and stores the event (``record_event``)
+before acknowledging; a Celery worker applies it (``process_event``).
+Redeliveries of a stored event are acknowledged without being queued
+again, and so are events of types that carry no charge outcome, which
+are stored as IGNORED: refusing them would only make the provider
+redeliver them. ``requeue_stale_events`` picks up events whose task was lost, e.g.
+because the broker was down when they arrived.
+"""
+import logging
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from apps.orders.inventory import commit_reservations
+from apps.orders.models import Order
+from .models import Payment, Transaction, WebhookEvent
+from .providers import get_provider
+
+logger = logging.getLogger(__name__)
+
+
+def record_event(provider, payload):
+    """Store a verified webhook. Returns the new WebhookEvent, or None for a redelivery."""
+    reported = provider.parse(payload)
+    fields = {}
+    if reported.status is None:
+        fields = {'status': WebhookEvent.IGNORED, 'error': 'Not a charge outcome', 'processed_at': timezone.now()}
+    try:
+        with transaction.atomic():
+            return WebhookEvent.objects.create(
+                provider=provider.name, event_id=reported.id, payload=payload, **fields
+            )
+    except IntegrityError:
+        return None
+
+
+def process_event(event_id):
+    """Apply a stored webhook to its payment and order. Returns whether it was applied."""
+    with transaction.atomic():
+        # Locked, so a redelivered task waits for the first and then skips
+        event = WebhookEvent.objects.select_for_update().filter(
+            pk=event_id, status=WebhookEvent.RECEIVED
+        ).first()
+        if event is None:
+            return False
+        reported = get_provider(event.provider).parse(event.payload)
+        payment = Payment.objects.select_for_update().filter(
+            provider=event.provider, reference=reported.reference
+        ).first()
+
+        error = ''
+        if reported.status is None:
+            error = 'Not a charge outcome'
+        elif payment is None:
+            error = 'Unknown payment %s' % reported.reference
+        elif (reported.amount, reported.currency) != (payment.amount, payment.currency):
+            error = 'Reported %s %s for a payment of %s %s' % (
+                reported.amount, reported.currency, payment.amount, payment.currency)
+        else:
+            _, created = Transaction.objects.get_or_create(
+                provider=event.provider, provider_reference=reported.transaction,
+                defaults={
+                    'payment': payment, 'status': reported.status, 'amount': reported.amount,
+                    'currency': reported.currency, 'event': event,
+                },
+            )
+            if created:
+                apply_status(payment, reported.status)
+
+        event.status = WebhookEvent.IGNORED if error else WebhookEvent.PROCESSED
+        event.error = error
+        event.processed_at = timezone.now()
+        event.save(update_fields=['status', 'error', 'processed_at'])
+    if error:
+        logger.warning('Ignored %s webhook %s: %s', event.provider, event.event_id, error)
+    return not error
+
+
+def apply_status(payment, status):
+    # A success is final; a failure only ends a payment still pending
+    if payment.status == Payment.SUCCEEDED or payment.status == status:
+        return
+    if status == Payment.FAILED and payment.status != Payment.PENDING:
+        return
+    payment.status = status
+    payment.save(update_fields=['status', 'updated_at'])
+    if status != Payment.SUCCEEDED:
+        return
+
+    order = Order.objects.select_for_update().get(pk=payment.order_id)
+    if order.status != 'PENDING':
+        # E.g. cancelled when its reservation expired while the customer paid
+        logger.warning('Payment %s succeeded for order %s in status %s',
+                       payment.reference, order.order_number, order.status)
+        return
+    order.status = 'PAID'
+    order.save(update_fields=['status', 'updated_at'])
+    commit_reservations(order)
+
+
+def requeue_stale_events(older_than=timedelta(minutes=5)):
+    """Queue again the events still unprocessed after ``older_than``. Returns how many."""
+    from .tasks import process_webhook
+
+    stale = list(WebhookEvent.objects.filter(
+        status=WebhookEvent.RECEIVED, received_at__lte=timezone.now() - older_than,
+    ).values_list('pk', flat=True))
+    for event_id in stale:
+        process_webhook.delay(event_id)
+    return len(stale)
@@ -1,6 +1,7 @@
 # apps/products/admin.py
 from django.contrib import admin
-from .models import Product, ProductVariant
+from .models import Product, ProductImage, ProductVariant
 
 admin.site.register(Product)
+admin.site.register(ProductImage)
 admin.site.register(ProductVariant)
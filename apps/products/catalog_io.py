@@ -0,0 +1,355 @@
+# apps/products/catalog_io.py
+"""
+Bulk import and export of the catalog as CSV or JSON Lines.
+
+A catalog file is a sequence of flat records, each with a ``type`` of
+``product``, ``variant`` or ``image``:
+
+    type,product,sku,name,slug,category,description,price,weight,is_active,value,price_adjustment,stock_quantity,image,is_primary
+    product,,SHOE-1,Runner,runner,shoes,Light running shoe,99.99,0.80,True,,,25,,
+    variant,SHOE-1,,Size,,,,,,,42,0.00,10,,
+    image,SHOE-1,,,,,,,,,,,,products/runner.jpg,True
+
+JSON Lines files hold the same records as objects. Products are matched
+on ``sku`` (one is generated when it is left out), variants on their
+product, name and value, and images on their product and file name.
+Matches are updated where they differ and the rest created. Variant and
+image records name their product by SKU in ``product`` and must come
+after it. ``category`` is a category slug. Image files must already be
+in storage; new images get their renditions queued.
+
+Records are read, validated and written ``batch_size`` at a time, each
+batch in its own transaction with one INSERT ... ON CONFLICT for its
+products and a bulk_create plus a bulk_update for its variants and
+images, so memory stays flat however long the file is. Records that do
+not validate are skipped and reported with their line number.
+
+Exports read products through a server-side cursor and load each
+batch's variants and images with one query each.
+"""
+import csv
+import json
+from collections import defaultdict
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Q
+from django.utils.text import slugify
+
+from apps.outbox import outbox
+from core.utils import generate_sku
+from core.versioning import bump_version_on_commit
+
+from .models import Category, Product, ProductImage, ProductVariant
+from .search import invalidate_search_index
+
+FORMATS = ('csv', 'jsonl')
+BATCH_SIZE = 2000
+# Errors kept for the report; the rest are only counted
+MAX_ERRORS = 100
+
+PRODUCT_FIELDS = ['sku', 'name', 'slug', 'category', 'description', 'price', 'weight', 'stock_quantity',
+                  'is_active']
+VARIANT_FIELDS = ['name', 'value', 'price_adjustment', 'stock_quantity']
+IMAGE_FIELDS = ['image', 'is_primary']
+COLUMNS = ['type', 'product', 'sku', 'name', 'slug', 'category', 'description', 'price', 'weight',
+           'is_active', 'value', 'price_adjustment', 'stock_quantity', 'image', 'is_primary']
+TYPES = ('product', 'variant', 'image')
+
+
+def format_of(name, default=None):
+    """The catalog format a file name's extension implies."""
+    extension = name.rpartition('.')[2].lower()
+    return {'csv': 'csv', 'jsonl': 'jsonl', 'ndjson': 'jsonl'}.get(extension, default)
+
+
+def read_csv(lines):
+    """(line number, record) pairs from the lines of a CSV catalog."""
+    reader = csv.DictReader(lines)
+    for row in reader:
+        # Empty cells are left out, as they are in JSON Lines
+        yield reader.line_num, {key: value for key, value in row.items() if key and value not in ('', None)}
+
+
+def read_jsonl(lines):
+    """(line number, record) pairs from the lines of a JSON Lines catalog."""
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError:
+            yield number, None
+
+
+READERS = {'csv': read_csv, 'jsonl': read_jsonl}
+
+
+def clean_fields(model, record, names):
+    """The values of the fields ``names`` in ``record``, validated as the model fields would be."""
+    values, errors = {}, {}
+    for name in names:
+        field = model._meta.get_field(name)
+        value = record.get(name)
+        if value is None and field.has_default():
+            value = field.get_default()
+        try:
+            values[name] = field.clean(value, None)
+        except ValidationError as error:
+            errors[name] = error.messages
+    return values, errors
+
+
+class CatalogImport:
+    """Loads catalog records into the database; see the module docstring."""
+
+    def __init__(self, batch_size=BATCH_SIZE):
+        self.batch_size = batch_size
+        self.categories = dict(Category.objects.values_list('slug', 'pk'))
+        self.created = dict.fromkeys(TYPES, 0)
+        self.updated = dict.fromkeys(TYPES, 0)
+        self.unchanged = dict.fromkeys(TYPES, 0)
+        self.failed = 0
+        self.errors = []
+
+    def run(self, records):
+        """Import ``records``, (line number, record) pairs. Returns the report."""
+        records = iter(records)
+        while True:
+            batch = list(islice(records, self.batch_size))
+            if not batch:
+                return self.report()
+            self.load(batch)
+
+    def report(self):
+        return {
+            'created': self.created, 'updated': self.updated, 'unchanged': self.unchanged,
+            'failed': self.failed, 'errors': self.errors,
+        }
+
+    def fail(self, line, errors):
+        self.failed += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append({'line': line, 'errors': errors})
+
+    def load(self, batch):
+        rows = {kind: [] for kind in TYPES}
+        for line, record in batch:
+            kind, values, errors = self.clean(record)
+            if errors:
+                self.fail(line, errors)
+            else:
+                rows[kind].append((line, values))
+        with transaction.atomic():
+            # Products first, so the batch's variants and images can find them
+            self.save_products(rows['product'])
+            self.save_variants(rows['variant'])
+            self.save_images(rows['image'])
+
+    def clean(self, record):
+        if not isinstance(record, dict):
+            return None, None, {'non_field_errors': ['Expected an object.']}
+        kind = record.get('type')
+        if kind == 'product':
+            record = dict(record)
+            if not record.get('sku'):
+                record['sku'] = generate_sku()
+            if not record.get('slug'):
+                record['slug'] = slugify(record.get('name', ''))
+            # Looked up among the slugs loaded once, rather than by the
+            # foreign key's own validation, which queries for every row
+            values, errors = clean_fields(Product, record, [name for name in PRODUCT_FIELDS if name != 'category'])
+            values['category'] = self.categories.get(record.get('category'))
+            if values['category'] is None:
+                errors['category'] = (
+                    ['Unknown category "%s".' % record['category']] if record.get('category')
+                    else ['This field is required.']
+                )
+            return kind, values, errors
+        if kind in ('variant', 'image'):
+            model, names = (ProductVariant, VARIANT_FIELDS) if kind == 'variant' else (ProductImage, IMAGE_FIELDS)
+            values, errors = clean_fields(model, record, names)
+            values['product'] = record.get('product')
+            if not values['product']:
+                errors['product'] = ['This field is required.']
+            return kind, values, errors
+        return None, None, {'type': ['Expected one of %s.' % ', '.join(TYPES)]}
+
+    def save_products(self, rows):
+        if not rows:
+            return
+        # A SKU given twice in a batch is imported once, from its last record
+        rows = {values['sku']: (line, values) for line, values in rows}
+        fields = PRODUCT_FIELDS[1:]
+        existing, owners = {}, {}
+        for sku, *current in Product.objects.filter(
+            Q(sku__in=list(rows)) | Q(slug__in=[values['slug'] for _, values in rows.values()])
+        ).values_list('sku', *fields):
+            existing[sku] = current
+            owners[current[fields.index('slug')]] = sku
+
+        products = []
+        for line, values in rows.values():
+            sku, slug = values['sku'], values['slug']
+            # Slugs are unique as well; one clash would fail the whole INSERT
+            if owners.setdefault(slug, sku) != sku:
+                self.fail(line, {'slug': ['Product with this slug already exists.']})
+            elif existing.get(sku) == [values[name] for name in fields]:
+                self.unchanged['product'] += 1
+            else:
+                values['category_id'] = values.pop('category')
+                products.append(Product(**values))
+        if not products:
+            return
+        Product.objects.bulk_create(
+            products, update_conflicts=True, unique_fields=['sku'], update_fields=fields + ['updated_at'],
+        )
+        updated = sum(product.sku in existing for product in products)
+        self.created['product'] += len(products) - updated
+        self.updated['product'] += updated
+        invalidate_search_index()
+
+    def resolve(self, rows):
+        """``rows`` with their product SKU replaced by its id, failing those whose product is unknown."""
+        ids = dict(Product.objects.filter(sku__in={values['product'] for _, values in rows}).values_list('sku', 'pk'))
+        resolved = []
+        for line, values in rows:
+            product_id = ids.get(values.pop('product'))
+            if product_id is None:
+                self.fail(line, {'product': ['Unknown product SKU.']})
+            else:
+                resolved.append((product_id, values))
+        return resolved
+
+    def save_variants(self, rows):
+        if not rows:
+            return
+        variants = {}
+        for product_id, values in self.resolve(rows):
+            variants[product_id, values['name'], values['value']] = ProductVariant(product_id=product_id, **values)
+        fields = ['price_adjustment', 'stock_quantity']
+        existing = {
+            (product_id, name, value): current
+            for product_id, name, value, *current in ProductVariant.objects.filter(
+                product_id__in={key[0] for key in variants}
+            ).values_list('product_id', 'name', 'value', 'pk', *fields)
+        }
+        if self.save(ProductVariant, variants, existing, fields, 'variant') is not None:
+            bump_version_on_commit('product_variants')
+
+    def save_images(self, rows):
+        if not rows:
+            return
+        images, primary = {}, {}
+        for product_id, values in self.resolve(rows):
+            image = images[product_id, values['image']] = ProductImage(product_id=product_id, **values)
+            if image.is_primary:
+                # The last image marked primary wins, as when saving them one by one
+                if product_id in primary:
+                    primary[product_id].is_primary = False
+                primary[product_id] = image
+        existing = {
+            (product_id, name): current
+            for product_id, name, *current in ProductImage.objects.filter(
+                product_id__in={key[0] for key in images}
+            ).values_list('product_id', 'image', 'pk', 'is_primary')
+        }
+        # Keep one primary image per product
+        ProductImage.objects.filter(product_id__in=primary, is_primary=True).exclude(pk__in=[
+            existing[product_id, image.image.name][0] for product_id, image in primary.items()
+            if (product_id, image.image.name) in existing
+        ]).update(is_primary=False)
+        created = self.save(ProductImage, images, existing, ['is_primary'], 'image')
+        if created:
+            outbox.enqueue([
+                outbox.message('apps.products.tasks.render_product_image', image_id=image.pk) for image in created
+            ])
+        if created is not None:
+            bump_version_on_commit('product_images')
+
+    def save(self, model, objects, existing, fields, kind):
+        """
+        Create the ``objects`` whose key is not in ``existing``, a map of
+        keys to the pk and ``fields`` of the stored row, and update those
+        whose ``fields`` differ. Returns those created, or None when
+        nothing was written.
+        """
+        created, updated = [], []
+        for key, instance in objects.items():
+            if key not in existing:
+                created.append(instance)
+                continue
+            instance.pk, *current = existing[key]
+            # Rewriting identical rows would only cost time and dead tuples
+            if current != [getattr(instance, name) for name in fields]:
+                updated.append(instance)
+        model.objects.bulk_create(created)
+        # An upsert on the primary key: one plain INSERT, where bulk_update
+        # would build a CASE expression per row and field
+        model.objects.bulk_create(updated, update_conflicts=True, unique_fields=['id'], update_fields=fields)
+        self.created[kind] += len(created)
+        self.updated[kind] += len(updated)
+        self.unchanged[kind] += len(objects) - len(created) - len(updated)
+        return created if created or updated else None
+
+
+def import_catalog(lines, file_format, batch_size=BATCH_SIZE):
+    """Import the catalog in ``lines``, an iterable of text lines. Returns the report."""
+    return CatalogImport(batch_size).run(READERS[file_format](lines))
+
+
+def export_records(batch_size=BATCH_SIZE):
+    """Every product as a record, followed by the records of its variants and images."""
+    rows = Product.objects.order_by('pk').values_list(
+        'pk', *['category__slug' if name == 'category' else name for name in PRODUCT_FIELDS]
+    ).iterator(chunk_size=batch_size)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return
+        ids = [row[0] for row in batch]
+        variants, images = defaultdict(list), defaultdict(list)
+        for product_id, *values in ProductVariant.objects.filter(product_id__in=ids).order_by('pk').values_list(
+            'product_id', *VARIANT_FIELDS
+        ):
+            variants[product_id].append(values)
+        for product_id, *values in ProductImage.objects.filter(product_id__in=ids).order_by('pk').values_list(
+            'product_id', *IMAGE_FIELDS
+        ):
+            images[product_id].append(values)
+
+        for pk, sku, *values in batch:
+            yield {'type': 'product', 'sku': sku, **dict(zip(PRODUCT_FIELDS[1:], values))}
+            for variant in variants[pk]:
+                yield {'type': 'variant', 'product': sku, **dict(zip(VARIANT_FIELDS, variant))}
+            for image in images[pk]:
+                yield {'type': 'image', 'product': sku, **dict(zip(IMAGE_FIELDS, image))}
+
+
+class Echo:
+    """A file that hands back what is written to it, for csv.writer to produce lines."""
+    def write(self, value):
+        return value
+
+
+def write_csv(records):
+    writer = csv.DictWriter(Echo(), COLUMNS)
+    yield writer.writeheader()
+    for record in records:
+        yield writer.writerow(record)
+
+
+def write_jsonl(records):
+    encoder = DjangoJSONEncoder()
+    for record in records:
+        yield encoder.encode(record) + '\n'
+
+
+WRITERS = {'csv': write_csv, 'jsonl': write_jsonl}
+
+
+def export_catalog(file_format, batch_size=BATCH_SIZE):
+    """The whole catalog as lines of text in ``file_format``."""
+    return WRITERS[file_format](export_records(batch_size))
@@ -0,0 +1,87 @@
+# apps/products/category_tree.py
+"""
+In-memory copy of the category tree.
+
+The whole tree is loaded with one query and kept per process, and is
+rebuilt whenever the ``categories`` version token changes.
+"""
+from asgiref.sync import sync_to_async
+
+from core.db.replicas import primary_reads
+from core.versioning import bump_version_on_commit, get_version
+
+VERSION = 'categories'
+
+_tree = None
+
+
+class CategoryTree:
+    def __init__(self, categories, version):
+        self.version = version
+        self.by_id = {}
+        self.by_slug = {}
+        self._children = {}
+        for category in categories:
+            self.by_id[category.pk] = category
+            self.by_slug[category.slug] = category
+            self._children.setdefault(category.parent_id, []).append(category)
+
+    def get(self, slug):
+        return self.by_slug.get(slug)
+
+    def roots(self):
+        return self._children.get(None, [])
+
+    def children(self, category_id):
+        return self._children.get(category_id, [])
+
+    def descendant_ids(self, category_id):
+        """Ids of the category and everything below it."""
+        ids = []
+        stack = [category_id]
+        while stack:
+            current = stack.pop()
+            ids.append(current)
+            stack.extend(child.pk for child in self.children(current))
+        return ids
+
+
+def get_category_tree():
+    global _tree
+    from .models import Category
+
+    version = get_version(VERSION)
+    tree = _tree
+    if tree is None or tree.version != version:
+        # Rebuilt right after writes, which a replica may not have yet
+        with primary_reads():
+            tree = CategoryTree(Category.objects.order_by('path'), version)
+        _tree = tree
+    return tree
+
+
+def invalidate_category_tree():
+    bump_version_on_commit(VERSION)
+
+
+class CategoryTreeMixin:
+    """Shares one copy of the category tree between a request's serializers."""
+    _category_tree = None
+
+    def get_category_tree(self):
+        if self._category_tree is None:
+            self._category_tree = get_category_tree()
+        return self._category_tree
+
+    def needs_category_tree(self):
+        return True
+
+    async def aprepare(self):
+        # Serializers on the async path cannot query to rebuild it
+        if self.needs_category_tree():
+            await sync_to_async(self.get_category_tree)()
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['category_tree'] = self._category_tree
+        return context
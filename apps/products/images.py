@@ -0,0 +1,124 @@
+# apps/products/images.py
+"""
+Resized renditions of product images.
+
+Saving a ProductImage with a new file queues ``render_product_image``
+(see tasks.py), which writes a WebP and a JPEG of the image at each
+configured width and stores the map of them on ``renditions``:
+
+    {
+        'source': 'products/shoe.jpg',
+        'sizes': {
+            'thumb': {'width': 160, 'height': 120,
+                      'webp': 'products/renditions/3f2a...-160w.webp',
+                      'jpeg': 'products/renditions/9c41...-160w.jpg'},
+            ...
+        },
+    }
+
+Rendition file names carry a hash of their content, so they can be
+served with a far-future cache lifetime: a new upload gets new names,
+and identical renditions are stored once. Images are never scaled up;
+sizes wider than the original use its width.
+
+Settings, in ``PRODUCT_IMAGE_RENDITIONS``:
+
+    PRODUCT_IMAGE_RENDITIONS = {
+        'SIZES': {'thumb': 160, 'small': 320, 'medium': 640, 'large': 1280},
+        'FORMATS': {
+            'webp': {'quality': 80, 'method': 2},
+            'jpeg': {'quality': 82, 'optimize': True, 'progressive': True},
+        },
+        'PATH': 'products/renditions',
+    }
+"""
+import hashlib
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+DEFAULTS = {
+    'SIZES': {'thumb': 160, 'small': 320, 'medium': 640, 'large': 1280},
+    'FORMATS': {
+        # Higher methods take 2-3 times as long for files within a few
+        # percent of the size
+        'webp': {'quality': 80, 'method': 2},
+        'jpeg': {'quality': 82, 'optimize': True, 'progressive': True},
+    },
+    'PATH': 'products/renditions',
+}
+
+EXTENSIONS = {'webp': 'webp', 'jpeg': 'jpg'}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'PRODUCT_IMAGE_RENDITIONS', {})}
+
+
+def open_image(file, max_width):
+    """The image in ``file``, upright, in RGB or RGBA."""
+    with Image.open(file) as image:
+        # JPEGs can be decoded at 1/2, 1/4 or 1/8 scale for almost nothing,
+        # as long as that still covers the largest rendition
+        image.draft('RGB', (max_width, max_width))
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    transparent = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+    return image.convert('RGBA' if transparent else 'RGB')
+
+
+def encode(image, image_format, options):
+    if image_format == 'jpeg' and image.mode == 'RGBA':
+        # JPEG has no transparency; put it on white
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    buffer = BytesIO()
+    image.save(buffer, image_format.upper(), **options)
+    return buffer.getvalue()
+
+
+def store(data, width, image_format, path, storage=None):
+    """Save ``data`` under a name made from its hash. Returns the name."""
+    storage = storage or default_storage
+    digest = hashlib.sha256(data).hexdigest()[:16]
+    name = '%s/%s-%dw.%s' % (path, digest, width, EXTENSIONS[image_format])
+    if storage.exists(name):
+        return name
+    return storage.save(name, ContentFile(data))
+
+
+def render(file, config=None, storage=None):
+    """Write the renditions of the image in ``file``. Returns their map by size name."""
+    config = config or get_config()
+    sizes = sorted(config['SIZES'].items(), key=lambda size: size[1], reverse=True)
+    image = open_image(file, sizes[0][1])
+    renditions = {}
+    # Largest first, each scaled from the one before, which is much
+    # cheaper than going back to the original every time
+    for name, width in sizes:
+        if width < image.width:
+            image = image.resize(
+                (width, max(1, round(image.height * width / image.width))), Image.LANCZOS, reducing_gap=3.0
+            )
+        rendition = {'width': image.width, 'height': image.height}
+        for image_format, options in config['FORMATS'].items():
+            data = encode(image, image_format, options)
+            rendition[image_format] = store(data, image.width, image_format, config['PATH'], storage)
+        renditions[name] = rendition
+    return renditions
+
+
+def rendition_urls(renditions, storage=None):
+    """``renditions['sizes']`` with the file names replaced by their URLs."""
+    storage = storage or default_storage
+    return {
+        name: {
+            key: storage.url(value) if key in EXTENSIONS else value
+            for key, value in rendition.items()
+        }
+        for name, rendition in (renditions or {}).get('sizes', {}).items()
+    }
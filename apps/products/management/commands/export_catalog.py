@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from apps.products.catalog_io import BATCH_SIZE, FORMATS, export_catalog, format_of
+
+
+class Command(BaseCommand):
+    help = 'Write every product with its variants and images to a CSV or JSON Lines catalog file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help='Catalog file, or - for standard output')
+        parser.add_argument('--format', choices=FORMATS, help='Defaults to the file extension, or CSV')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or format_of(path, 'csv')
+        lines = export_catalog(file_format, options['batch_size'])
+        if path == '-':
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+        with open(path, 'w', encoding='utf-8', newline='') as output:
+            output.writelines(lines)
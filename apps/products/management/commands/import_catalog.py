@@ -0,0 +1,34 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.products.catalog_io import BATCH_SIZE, FORMATS, format_of, import_catalog
+
+
+class Command(BaseCommand):
+    help = 'Create or update products, variants and images from a CSV or JSON Lines catalog file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Catalog file, or - for standard input')
+        parser.add_argument('--format', choices=FORMATS, help='Defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or format_of(path)
+        if file_format is None:
+            raise CommandError('Cannot tell the format of %s; pass --format' % path)
+        # utf-8-sig drops the byte order mark spreadsheets put before CSV exports
+        if path == '-':
+            report = import_catalog(sys.stdin, file_format, options['batch_size'])
+        else:
+            with open(path, encoding='utf-8-sig', newline='') as lines:
+                report = import_catalog(lines, file_format, options['batch_size'])
+        for error in report['errors']:
+            self.stderr.write('Line %d: %s' % (error['line'], json.dumps(error['errors'])))
+        for outcome in ('created', 'updated', 'unchanged'):
+            self.stdout.write('%s %s' % (outcome.capitalize(), ', '.join(
+                '%d %s(s)' % (count, kind) for kind, count in report[outcome].items()
+            )))
+        self.stdout.write('Skipped %d invalid record(s)' % report['failed'])
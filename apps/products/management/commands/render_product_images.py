@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from apps.products.models import ProductImage
+from apps.products.tasks import render_product_image
+
+
+class Command(BaseCommand):
+    help = 'Render the resized copies of product images that have none, or of all of them with --all'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Also redo rendered images, e.g. after changing sizes')
+
+    def handle(self, *args, **options):
+        images = ProductImage.objects.order_by('id')
+        if not options['all']:
+            images = images.filter(renditions={})
+        rendered = sum(render_product_image(pk) for pk in images.values_list('pk', flat=True).iterator())
+        self.stdout.write('Rendered %d product image(s)' % rendered)
@@ -0,0 +1,45 @@
+# Generated by Django 5.0.1 on 2026-10-18 17:20
+
+from django.db import migrations, models
+
+
+def populate_paths(apps, schema_editor):
+    Category = apps.get_model("products", "Category")
+    children = {}
+    for category in Category.objects.only("id", "parent_id"):
+        children.setdefault(category.parent_id, []).append(category)
+
+    updated = []
+    stack = [(category, "/", 0) for category in children.get(None, [])]
+    while stack:
+        category, parent_path, depth = stack.pop()
+        category.path = "%s%d/" % (parent_path, category.pk)
+        category.depth = depth
+        updated.append(category)
+        stack.extend(
+            (child, category.path, depth + 1) for child in children.get(category.pk, [])
+        )
+    Category.objects.bulk_update(updated, ["path", "depth"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="category",
+            name="depth",
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="category",
+            name="path",
+            field=models.CharField(
+                db_index=True, default="", editable=False, max_length=255
+            ),
+        ),
+        migrations.RunPython(populate_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Full-text search support for products on PostgreSQL. The search vector is
+# a generated column, so it stays current on every insert and update. Other
+# databases skip this migration and use the in-process index in search.py.
+
+from django.db import migrations
+
+
+def add_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("""
+        ALTER TABLE products_product ADD COLUMN search_vector tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', coalesce(name, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(description, '')), 'B')
+        ) STORED
+        """)
+    schema_editor.execute(
+        "CREATE INDEX products_product_search_vector_idx "
+        "ON products_product USING gin (search_vector)"
+    )
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        has_trigram = cursor.fetchone() is not None
+    if has_trigram:
+        schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        schema_editor.execute(
+            "CREATE INDEX products_product_name_trgm_idx "
+            "ON products_product USING gin (name gin_trgm_ops)"
+        )
+
+
+def remove_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("DROP INDEX IF EXISTS products_product_name_trgm_idx")
+    schema_editor.execute(
+        "ALTER TABLE products_product DROP COLUMN IF EXISTS search_vector"
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0002_category_path"),
+    ]
+
+    operations = [
+        migrations.RunPython(add_search_vector, remove_search_vector),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.0.14 on 2026-10-18 18:52
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def keep_latest_primary(apps, schema_editor):
+    # Concurrent saves could leave a product with several primary images;
+    # keep the newest so the constraint can be added
+    ProductImage = apps.get_model("products", "ProductImage")
+    primaries = ProductImage.objects.filter(is_primary=True)
+    latest = primaries.values("product").annotate(latest=Max("id")).values("latest")
+    primaries.exclude(id__in=latest).update(is_primary=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0004_pagination_indexes"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                condition=models.Q(("is_active", True)),
+                fields=["category", "price"],
+                name="product_active_cat_price_idx",
+            ),
+        ),
+        migrations.RunPython(keep_latest_primary, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="productimage",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("is_primary", True)),
+                fields=("product",),
+                name="one_primary_image_per_product",
+            ),
+        ),
+    ]
@@ -1,5 +1,7 @@
 # apps/products/models.py
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Concat, Substr
 from django.utils.text import slugify
 from core.utils import generate_sku
 
@@ -7,6 +9,10 @@ class Category(models.Model):
     name = models.CharField(max_length=100)
     slug = models.SlugField(unique=True)
     parent = models.ForeignKey('self', null=True, blank=True, on_delete=models.CASCADE)
+    # Materialized path of ancestor ids, e.g. "/1/5/12/" for category 12
+    # under 5 under 1, so a subtree is a single prefix match
+    path = models.CharField(max_length=255, db_index=True, editable=False, default='')
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
     
     class Meta:
         verbose_name_plural = 'Categories'
@@ -14,7 +20,24 @@ class Category(models.Model):
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
-        super().save(*args, **kwargs)
+        parent_path = self.parent.path if self.parent_id else '/'
+        old_path = self.path
+        if old_path and parent_path.startswith(old_path):
+            raise ValueError('A category cannot be moved under itself or its descendants.')
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            path = '%s%d/' % (parent_path, self.pk)
+            if path != old_path:
+                depth = path.count('/') - 2
+                Category.objects.filter(pk=self.pk).update(path=path, depth=depth)
+                if old_path:
+                    # Re-root the subtree that moved along with this category
+                    Category.objects.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                        path=Concat(Value(path), Substr('path', len(old_path) + 1)),
+                        depth=F('depth') + depth - self.depth,
+                    )
+                self.path, self.depth = path, depth
 
 class Product(models.Model):
     sku = models.CharField(max_length=20, unique=True, editable=False)
@@ -29,6 +52,19 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Keyset pagination order of product lists
+            models.Index(fields=['created_at', 'id'], name='product_created_id_idx'),
+            # Catalog filters: active products by category and price range.
+            # Staff lists, which include inactive products, use the
+            # category foreign key index instead.
+            models.Index(
+                fields=['category', 'price'], condition=models.Q(is_active=True),
+                name='product_active_cat_price_idx',
+            ),
+        ]
+
     def save(self, *args, **kwargs):
         if not self.sku:
             self.sku = generate_sku()
@@ -40,11 +76,26 @@ class ProductImage(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
     image = models.ImageField(upload_to='products/')
     is_primary = models.BooleanField(default=False)
-    
+    # Resized copies of ``image``, written by a background task, see images.py
+    renditions = models.JSONField(default=dict, blank=True, editable=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['product'], condition=models.Q(is_primary=True),
+                name='one_primary_image_per_product',
+            ),
+        ]
+
+    @transaction.atomic
     def save(self, *args, **kwargs):
+        # Renditions of a replaced file are stale; signals.py queues new ones
+        if self.renditions and self.renditions.get('source') != self.image.name:
+            self.renditions = {}
         if self.is_primary:
             # Set all other images of product to non-primary
-            ProductImage.objects.filter(product=self.product).update(is_primary=False)
+            ProductImage.objects.filter(product=self.product, is_primary=True).exclude(
+                pk=self.pk).update(is_primary=False)
         super().save(*args, **kwargs)
 
 class ProductVariant(models.Model):
@@ -52,4 +103,8 @@ class ProductVariant(models.Model):
     name = models.CharField(max_length=100)  # e.g., "Size", "Color"
     value = models.CharField(max_length=100)  # e.g., "XL", "Red"
     price_adjustment = models.DecimalField(max_digits=10, decimal_places=2, default=0)
-    stock_quantity = models.PositiveIntegerField()
\ No newline at end of file
+    stock_quantity = models.PositiveIntegerField()
+
+    @property
+    def price(self):
+        return self.product.price + self.price_adjustment
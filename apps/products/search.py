@@ -0,0 +1,158 @@
+# apps/products/search.py
+"""
+Product search backends.
+
+On PostgreSQL products are matched against the ``search_vector`` column
+(a generated tsvector over name and description, see migration 0003) and
+ranked with ``ts_rank``; when pg_trgm is installed, misspelled names are
+matched by trigram similarity as well. Other databases use an in-process
+inverted index, which keeps SQLite test runs close to production
+behaviour without scanning every description.
+
+Set ``PRODUCT_SEARCH_BACKEND`` to a dotted path to override the choice.
+"""
+import bisect
+import re
+from collections import defaultdict
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVectorField, TrigramSimilarity)
+from django.db import connection
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast
+from django.utils.module_loading import import_string
+
+from core.db.replicas import primary_reads
+from core.versioning import bump_version_on_commit, get_version
+
+VERSION = 'products'
+TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+class PostgresSearchBackend:
+    config = 'english'
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def has_trigram():
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+            return cursor.fetchone() is not None
+
+    def search(self, queryset, term):
+        table = connection.ops.quote_name(queryset.model._meta.db_table)
+        query = SearchQuery(term, config=self.config, search_type='websearch')
+        document = RawSQL('%s.search_vector' % table, [], output_field=SearchVectorField())
+        # Pass the column itself; a field name would make SearchRank wrap it
+        # in to_tsvector() and re-parse every matching row
+        queryset = queryset.alias(document=document)
+        rank = SearchRank(document, query)
+        match = Q(document=query)
+        if self.has_trigram():
+            rank = rank + TrigramSimilarity('name', term)
+            match |= Q(name__trigram_similar=term)
+        # ts_rank is a real; as a double it survives the round trip through
+        # a pagination cursor and compares equal to itself again
+        rank = Cast(rank, FloatField())
+        return queryset.annotate(search_rank=rank).filter(match).order_by('-search_rank', 'pk')
+
+
+class InvertedIndex:
+    """Token -> {product id: weight} postings, with name hits weighted higher."""
+    NAME_WEIGHT = 3
+    DESCRIPTION_WEIGHT = 1
+
+    def __init__(self, rows, version):
+        self.version = version
+        postings = defaultdict(dict)
+        for pk, name, description in rows:
+            for weight, text in ((self.NAME_WEIGHT, name), (self.DESCRIPTION_WEIGHT, description)):
+                for token in tokenize(text):
+                    scores = postings[token]
+                    scores[pk] = scores.get(pk, 0) + weight
+        self.postings = dict(postings)
+        self.vocabulary = sorted(self.postings)
+
+    def lookup(self, token):
+        """Scores for every indexed token starting with ``token``."""
+        scores = defaultdict(int)
+        start = bisect.bisect_left(self.vocabulary, token)
+        for word in self.vocabulary[start:]:
+            if not word.startswith(token):
+                break
+            for pk, weight in self.postings[word].items():
+                scores[pk] += weight
+        return scores
+
+    def search(self, term):
+        """Ids matching every token of ``term``, best match first."""
+        results = None
+        for token in tokenize(term):
+            scores = self.lookup(token)
+            if results is None:
+                results = dict(scores)
+            else:
+                results = {pk: results[pk] + score for pk, score in scores.items() if pk in results}
+            if not results:
+                return []
+        return sorted(results or {}, key=lambda pk: (-results[pk], pk))
+
+
+class InvertedIndexSearchBackend:
+    # Results are ranked in SQL with a CASE over the matching ids, so keep
+    # the statement bounded
+    max_results = 1000
+    _index = None
+
+    @classmethod
+    def get_index(cls):
+        from .models import Product
+
+        version = get_version(VERSION)
+        index = cls._index
+        if index is None or index.version != version:
+            # Rebuilt right after writes, which a replica may not have yet
+            with primary_reads():
+                rows = Product.objects.values_list('pk', 'name', 'description').iterator(chunk_size=2000)
+                index = InvertedIndex(rows, version)
+            cls._index = index
+        return index
+
+    def search(self, queryset, term):
+        ids = self.get_index().search(term)[:self.max_results]
+        if not ids:
+            return queryset.annotate(search_rank=Value(0.0, output_field=FloatField())).none()
+        # Built as plain SQL: resolving a Case() with a When() per id costs
+        # more than the query itself. Ids are integers from the index.
+        column = '%s.%s' % (
+            connection.ops.quote_name(queryset.model._meta.db_table),
+            connection.ops.quote_name(queryset.model._meta.pk.column),
+        )
+        ranking = RawSQL('CASE %s %s END' % (column, ' '.join(
+            'WHEN %d THEN %d' % (pk, -position) for position, pk in enumerate(ids)
+        )), [], output_field=FloatField())
+        return queryset.filter(pk__in=ids).annotate(search_rank=ranking).order_by('-search_rank', 'pk')
+
+
+def get_search_backend():
+    path = getattr(settings, 'PRODUCT_SEARCH_BACKEND', None)
+    if path:
+        return import_string(path)()
+    if connection.vendor == 'postgresql':
+        return PostgresSearchBackend()
+    return InvertedIndexSearchBackend()
+
+
+def search_products(queryset, term):
+    return get_search_backend().search(queryset, term)
+
+
+def invalidate_search_index():
+    bump_version_on_commit(VERSION)
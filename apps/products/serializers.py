@@ -1,7 +1,10 @@
 from rest_framework import serializers
+from core.serializers import DynamicFieldsMixin
+from .category_tree import get_category_tree
+from .images import rendition_urls
 from .models import Category, Product, ProductImage, ProductVariant
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     children = serializers.SerializerMethodField()
 
     class Meta:
@@ -10,14 +13,34 @@ class CategorySerializer(serializers.ModelSerializer):
         read_only_fields = ['slug']
 
     def get_children(self, obj):
-        return CategorySerializer(obj.category_set.all(), many=True).data
+        # Children come from the cached tree, so nesting costs no queries.
+        # Views pass the tree in the context so it is loaded only once.
+        tree = self.context.get('category_tree') or get_category_tree()
+        children = tree.children(obj.pk)
+        serializer = CategorySerializer(children, many=True, context=self.context)
+        # Bound so ?fields= paths like category.children.name resolve
+        serializer.bind('children', self)
+        return serializer.data
+
+    def validate_parent(self, parent):
+        # Category.save refuses a cycle too, but as a 500; catch it here
+        if parent is not None and self.instance is not None and parent.path.startswith(self.instance.path):
+            raise serializers.ValidationError('A category cannot be moved under itself or its descendants.')
+        return parent
+
+class ProductImageSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    # Resized copies by size name, each with its width, height and a WebP
+    # and JPEG URL; empty until they are rendered
+    renditions = serializers.SerializerMethodField()
 
-class ProductImageSerializer(serializers.ModelSerializer):
     class Meta:
         model = ProductImage
-        fields = ['id', 'image', 'is_primary']
+        fields = ['id', 'image', 'is_primary', 'renditions']
+
+    def get_renditions(self, obj):
+        return rendition_urls(obj.renditions)
 
-class ProductVariantSerializer(serializers.ModelSerializer):
+class ProductVariantSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     price = serializers.SerializerMethodField()
 
     class Meta:
@@ -25,9 +48,9 @@ class ProductVariantSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'value', 'price_adjustment', 'stock_quantity', 'price']
 
     def get_price(self, obj):
-        return obj.product.price + obj.price_adjustment
+        return obj.price
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     category = CategorySerializer(read_only=True)
     category_id = serializers.PrimaryKeyRelatedField(
         queryset=Category.objects.all(),
@@ -47,7 +70,12 @@ class ProductSerializer(serializers.ModelSerializer):
         read_only_fields = ['sku', 'slug', 'created_at', 'updated_at']
 
     def get_primary_image(self, obj):
-        primary_image = obj.images.filter(is_primary=True).first()
+        # Pick from the images already loaded for the images field rather
+        # than querying again
+        primary_image = next((image for image in obj.images.all() if image.is_primary), None)
         if primary_image:
-            return ProductImageSerializer(primary_image).data
+            serializer = ProductImageSerializer(primary_image, context=self.context)
+            # Bound so ?fields= paths like primary_image.id resolve
+            serializer.bind('primary_image', self)
+            return serializer.data
         return None
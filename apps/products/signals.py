@@ -0,0 +1,41 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from apps.outbox import outbox
+from core.versioning import bump_version_on_commit
+
+from .category_tree import invalidate_category_tree
+from .models import Category, Product, ProductImage, ProductVariant
+from .search import invalidate_search_index
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, **kwargs):
+    invalidate_category_tree()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_changed(sender, **kwargs):
+    invalidate_search_index()
+
+
+# Only the cached catalog responses depend on these
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def product_image_changed(sender, **kwargs):
+    bump_version_on_commit('product_images')
+
+
+@receiver(post_save, sender=ProductImage)
+def product_image_saved(sender, instance, **kwargs):
+    # Rendered once the upload commits, off the request
+    if instance.image and not instance.renditions:
+        outbox.enqueue([outbox.message('apps.products.tasks.render_product_image', image_id=instance.pk)])
+
+
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+def product_variant_changed(sender, **kwargs):
+    bump_version_on_commit('product_variants')
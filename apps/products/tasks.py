@@ -0,0 +1,35 @@
+# apps/products/tasks.py
+import logging
+
+from celery import shared_task
+from django.db import OperationalError, transaction
+
+from core.versioning import bump_version_on_commit
+from .images import render
+from .models import ProductImage
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(autoretry_for=(OperationalError,), retry_backoff=True, max_retries=5)
+def render_product_image(image_id):
+    """Write the renditions of a product image. Returns whether it had a file to render."""
+    image = ProductImage.objects.filter(pk=image_id).first()
+    if image is None or not image.image:
+        return False
+    source = image.image.name
+    try:
+        with image.image.open('rb') as file:
+            sizes = render(file)
+    except OSError as exc:
+        # Missing or not an image; retrying will not help
+        logger.warning('Could not render product image %s (%s): %s', image_id, source, exc)
+        return False
+
+    with transaction.atomic():
+        # Unless the file was replaced while this one was rendered
+        ProductImage.objects.filter(pk=image_id, image=source).update(
+            renditions={'source': source, 'sizes': sizes}
+        )
+        bump_version_on_commit('product_images')
+    return True
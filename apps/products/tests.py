@@ -1,3 +1,791 @@
-from django.test import TestCase
+from decimal import Decimal
 
-# Create your tests here.
+import hashlib
+import json
+import tempfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, transaction
+from asgiref.sync import iscoroutinefunction
+from django.test import TestCase, override_settings
+from PIL import Image, ImageDraw
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .category_tree import get_category_tree
+from apps.accounts.models import User
+from apps.outbox.models import OutboxMessage
+from .models import Category, Product, ProductImage, ProductVariant
+from .catalog_io import export_catalog, import_catalog
+from .views import ProductViewSet
+from .search import InvertedIndex
+from core.caching import get_config
+from core.pagination import KeysetPagination
+from core.tests.utils import QueryPlanMixin, analyze, requires_query_plans
+
+
+def create_product(category, index, images=2, variants=2):
+    product = Product.objects.create(
+        name=f'Product {index}', category=category, description='Description',
+        price=Decimal('20.00'), stock_quantity=10, weight=Decimal('0.50')
+    )
+    for position in range(images):
+        ProductImage.objects.create(
+            product=product, image=f'products/{index}-{position}.jpg',
+            is_primary=position == 0
+        )
+    for position in range(variants):
+        ProductVariant.objects.create(
+            product=product, name='Size', value=str(position),
+            price_adjustment=Decimal(position), stock_quantity=5
+        )
+    return product
+
+
+class ProductListQueryTests(TestCase):
+    url = '/api/products/products/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.categories = [Category.objects.create(name=f'Category {i}') for i in range(3)]
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        get_category_tree()
+
+    def test_query_count_is_capped_per_page(self):
+        for index in range(5):
+            create_product(self.categories[index % 3], index)
+        # products + categories, images, variants
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.data['results']), 5)
+
+        for index in range(5, 50):
+            create_product(self.categories[index % 3], index)
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.data['results']), 50)
+
+    def test_primary_image_and_variant_price_come_from_prefetch(self):
+        create_product(self.categories[0], 0, images=3, variants=3)
+
+        with self.assertNumQueries(3):
+            product = self.client.get(self.url).data['results'][0]
+
+        self.assertTrue(product['primary_image']['image'].endswith('products/0-0.jpg'))
+        self.assertEqual(
+            [variant['price'] for variant in product['variants']],
+            [Decimal('20.00'), Decimal('21.00'), Decimal('22.00')]
+        )
+
+
+class ProductFieldsTests(TestCase):
+    url = '/api/products/products/'
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Sparse')
+        for index in range(3):
+            create_product(category, index)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        get_category_tree()
+
+    def test_unrequested_relations_are_not_loaded(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, {'fields': 'id,name'})
+        self.assertEqual(set(response.data['results'][0]), {'id', 'name'})
+
+    def test_nested_fields(self):
+        # Products and categories, then images for the primary image
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url, {'fields': 'name,category.name,primary_image'})
+        product = response.data['results'][0]
+        self.assertEqual(product['category'], {'name': 'Sparse'})
+        self.assertTrue(product['primary_image']['image'].endswith('-0.jpg'))
+
+    def test_primary_image_honours_fields(self):
+        response = self.client.get(self.url, {'fields': 'primary_image.id,primary_image.image'})
+        image = response.data['results'][0]['primary_image']
+        self.assertEqual(set(image), {'id', 'image'})
+        # Rendered with the request, like the images field
+        self.assertTrue(image['image'].startswith('http://testserver/media/'))
+
+    def test_detail_honours_fields(self):
+        slug = Product.objects.first().slug
+        response = self.client.get(f'{self.url}{slug}/', {'fields': 'slug,variants.price'})
+        self.assertEqual(response.data, {
+            'slug': slug, 'variants': [{'price': Decimal('20.00')}, {'price': Decimal('21.00')}],
+        })
+
+
+class CategoryTreeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.electronics = Category.objects.create(name='Electronics')
+        self.phones = Category.objects.create(name='Phones', parent=self.electronics)
+        self.android = Category.objects.create(name='Android', parent=self.phones)
+        self.books = Category.objects.create(name='Books')
+
+    def test_paths_follow_parents(self):
+        self.assertEqual(self.electronics.path, f'/{self.electronics.pk}/')
+        self.assertEqual(self.android.path, f'{self.phones.path}{self.android.pk}/')
+        self.assertEqual(self.android.depth, 2)
+
+    def test_moving_a_category_moves_its_subtree(self):
+        self.phones.parent = self.books
+        self.phones.save()
+
+        self.android.refresh_from_db()
+        self.assertEqual(self.android.path, f'/{self.books.pk}/{self.phones.pk}/{self.android.pk}/')
+        self.assertEqual(self.android.depth, 2)
+        self.assertEqual(
+            [c.slug for c in get_category_tree().children(self.books.pk)], ['phones']
+        )
+
+    def test_category_cannot_move_under_its_descendant(self):
+        self.electronics.parent = self.android
+        with self.assertRaises(ValueError):
+            self.electronics.save()
+
+    def test_api_rejects_moving_a_category_under_its_descendant(self):
+        staff = User.objects.create_user(
+            email='staff@example.com', username='staff', password='secret', is_staff=True
+        )
+        self.client.force_authenticate(staff)
+
+        response = self.client.patch(
+            '/api/products/categories/electronics/', {'parent': self.android.pk}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('parent', response.data)
+        self.electronics.refresh_from_db()
+        self.assertIsNone(self.electronics.parent_id)
+
+        response = self.client.patch(
+            '/api/products/categories/android/', {'parent': self.books.pk}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_root_reads_the_whole_tree_from_cache(self):
+        get_category_tree()
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/products/categories/root/')
+
+        electronics = next(c for c in response.data if c['slug'] == 'electronics')
+        self.assertEqual(electronics['children'][0]['children'][0]['slug'], 'android')
+
+    def test_tree_is_rebuilt_after_a_write(self):
+        tree = get_category_tree()
+        Category.objects.create(name='Tablets', parent=self.electronics)
+
+        rebuilt = get_category_tree()
+        self.assertIsNot(rebuilt, tree)
+        self.assertEqual(
+            sorted(c.slug for c in rebuilt.children(self.electronics.pk)), ['phones', 'tablets']
+        )
+
+    def test_category_filter_includes_descendants(self):
+        in_android = create_product(self.android, 1, images=0, variants=0)
+        in_electronics = create_product(self.electronics, 2, images=0, variants=0)
+        create_product(self.books, 3, images=0, variants=0)
+
+        response = self.client.get('/api/products/products/', {'category': 'electronics'})
+        self.assertEqual(
+            sorted(p['slug'] for p in response.data['results']), sorted([in_android.slug, in_electronics.slug])
+        )
+
+        response = self.client.get('/api/products/products/', {'category': 'missing'})
+        self.assertEqual(response.data['results'], [])
+
+
+class ProductSearchTests(TestCase):
+    url = '/api/products/products/'
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Fashion')
+        for name, description in [
+            ('Running shoes', 'Lightweight trainers for the road'),
+            ('Denim jacket', 'Goes well with running shoes'),
+            ('Leather belt', 'Brown leather with a brass buckle'),
+        ]:
+            Product.objects.create(
+                name=name, category=category, description=description,
+                price=Decimal('30.00'), stock_quantity=3, weight=Decimal('0.40')
+            )
+
+    def setUp(self):
+        cache.clear()
+
+    def search(self, term):
+        return [p['name'] for p in self.client.get(self.url, {'search': term}).data['results']]
+
+    def test_name_matches_rank_above_description_matches(self):
+        self.assertEqual(self.search('running shoes'), ['Running shoes', 'Denim jacket'])
+
+    def test_search_matches_description_only(self):
+        self.assertEqual(self.search('buckle'), ['Leather belt'])
+        self.assertEqual(self.search('umbrella'), [])
+
+    def test_new_products_are_searchable(self):
+        self.assertEqual(self.search('umbrella'), [])
+        Product.objects.create(
+            name='Golf umbrella', category=Category.objects.get(), description='Large',
+            price=Decimal('12.00'), stock_quantity=1, weight=Decimal('0.90')
+        )
+        self.assertEqual(self.search('umbrella'), ['Golf umbrella'])
+
+    def test_search_results_page_by_rank(self):
+        data = self.client.get(self.url, {'search': 'running shoes', 'page_size': 1}).data
+        names = [p['name'] for p in data['results']]
+        names += [p['name'] for p in self.client.get(data['next']).data['results']]
+        self.assertEqual(names, ['Running shoes', 'Denim jacket'])
+
+    def test_search_in_unknown_category(self):
+        response = self.client.get(self.url, {'search': 'shoes', 'category': 'nope'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], [])
+
+
+class InvertedIndexTests(TestCase):
+    def setUp(self):
+        self.index = InvertedIndex([
+            (1, 'Red shoes', 'Canvas'),
+            (2, 'Blue shirt', 'Red stripes'),
+            (3, 'Shoehorn', 'Steel'),
+        ], version='v1')
+
+    def test_tokens_match_by_prefix(self):
+        self.assertEqual(self.index.search('shoe'), [1, 3])
+
+    def test_every_token_must_match(self):
+        self.assertEqual(self.index.search('red shoes'), [1])
+        self.assertEqual(self.index.search('red steel'), [])
+
+    def test_name_hits_outrank_description_hits(self):
+        self.assertEqual(self.index.search('red'), [1, 2])
+
+
+class ProductPaginationTests(TestCase):
+    url = '/api/products/products/'
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Paged')
+        cls.products = [create_product(category, index, images=0, variants=0) for index in range(7)]
+        # Give some products the same timestamp so ties are broken by id
+        now = timezone.now()
+        for index, product in enumerate(cls.products):
+            Product.objects.filter(pk=product.pk).update(
+                created_at=now - timedelta(seconds=index // 2)
+            )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def walk(self, url, direction):
+        slugs = []
+        while url:
+            data = self.client.get(url).data
+            page = [p['slug'] for p in data['results']]
+            slugs = page + slugs if direction == 'previous' else slugs + page
+            url = data[direction]
+        return slugs, data
+
+    def test_pages_cover_every_product_once_in_order(self):
+        expected = [p.slug for p in sorted(
+            Product.objects.all(), key=lambda p: (p.created_at, p.id), reverse=True
+        )]
+        slugs, last_page = self.walk(self.url + '?page_size=3', 'next')
+        self.assertEqual(slugs, expected)
+
+        # Walking back from the last page returns the same sequence
+        slugs, first_page = self.walk(last_page['previous'], 'previous')
+        self.assertEqual(slugs + [p['slug'] for p in last_page['results']], expected)
+        self.assertIsNone(first_page['previous'])
+
+    def test_page_query_count_does_not_depend_on_depth(self):
+        get_category_tree()
+        first = self.client.get(self.url, {'page_size': 2}).data
+        with self.assertNumQueries(3):
+            self.client.get(first['next'])
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get(self.url, {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_tampered_cursor_is_rejected(self):
+        paginator = KeysetPagination()
+        paginator.ordering = ['-created_at', '-id']
+        for values in (['abc', 'xyz'], [12, 3], [timezone.now().isoformat(), 'x'], [None, 1], [[1], {}]):
+            cursor = paginator.encode_cursor(values, reverse=False)
+            with self.subTest(values=values):
+                self.assertEqual(self.client.get(self.url, {'cursor': cursor}).status_code, 404)
+        response = self.client.get(self.url, {'search': 'product', 'cursor': paginator.encode_cursor(['x', 1], False)})
+        self.assertEqual(response.status_code, 404)
+
+    def test_staff_can_stream_the_whole_list(self):
+        staff = User.objects.create_user(
+            email='staff@example.com', username='staff', password='secret', is_staff=True
+        )
+        self.client.force_authenticate(staff)
+
+        response = self.client.get(self.url, {'stream': '1'})
+        rows = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(len(rows), 7)
+
+        self.client.force_authenticate(None)
+        response = self.client.get(self.url, {'stream': '1'})
+        self.assertIn('results', response.data)
+
+
+class ResponseCacheTests(TestCase):
+    url = '/api/products/products/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Cached')
+        cls.product = create_product(cls.category, 0)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_repeated_reads_are_served_from_cache(self):
+        first = self.client.get(self.url, {'page_size': 10, 'min_price': ''})
+        self.assertEqual(first['X-Cache'], 'MISS')
+
+        # Same query with the params in another order
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url + '?min_price=&page_size=10')
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second['ETag'], first['ETag'])
+
+    def test_matching_etag_gets_not_modified(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_related_writes_change_the_response(self):
+        detail = f'{self.url}{self.product.slug}/'
+        etags = {self.client.get(detail)['ETag']}
+
+        ProductImage.objects.create(product=self.product, image='products/new.jpg')
+        response = self.client.get(detail)
+        self.assertEqual(len(response.data['images']), 3)
+        etags.add(response['ETag'])
+
+        ProductVariant.objects.filter(product=self.product).first().delete()
+        response = self.client.get(detail)
+        self.assertEqual(len(response.data['variants']), 1)
+        etags.add(response['ETag'])
+
+        Category.objects.create(name='Child', parent=self.category)
+        response = self.client.get(detail)
+        self.assertEqual(response.data['category']['children'][0]['slug'], 'child')
+        etags.add(response['ETag'])
+
+        self.assertEqual(len(etags), 4)
+
+    def test_stale_response_is_served_while_another_request_rebuilds(self):
+        self.client.get('/api/products/categories/root/')
+        Category.objects.create(name='Garden')
+
+        # Hold the rebuild lock as a concurrent request would
+        stale_key = 'response:stale:%s' % hashlib.sha256(b'/api/products/categories/root/').hexdigest()
+        cache.add('%s:lock' % stale_key, 1, get_config()['STALE_TIMEOUT'])
+        response = self.client.get('/api/products/categories/root/')
+        self.assertEqual(response['X-Cache'], 'STALE')
+        self.assertEqual([c['slug'] for c in response.data], ['cached'])
+
+        cache.delete('%s:lock' % stale_key)
+        response = self.client.get('/api/products/categories/root/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(sorted(c['slug'] for c in response.data), ['cached', 'garden'])
+
+    def test_staff_reads_bypass_the_cache(self):
+        Product.objects.filter(pk=self.product.pk).update(is_active=False)
+        self.assertEqual(self.client.get(self.url).data['results'], [])
+
+        staff = User.objects.create_user(
+            email='staff@example.com', username='staff', password='secret', is_staff=True
+        )
+        self.client.force_authenticate(staff)
+        response = self.client.get(self.url)
+        self.assertNotIn('X-Cache', response)
+        self.assertEqual(len(response.data['results']), 1)
+
+
+class AsyncCatalogTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.parent = Category.objects.create(name='Audio')
+        Category.objects.create(name='Headphones', parent=cls.parent)
+        cls.product = create_product(cls.parent, 0)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_read_actions_get_an_async_view(self):
+        view = ProductViewSet.as_view({'get': 'list', 'post': 'create'})
+        self.assertTrue(iscoroutinefunction(view))
+
+    async def test_product_list_and_detail(self):
+        response = await self.async_client.get('/api/products/products/')
+        self.assertEqual(response.status_code, 200)
+        product = response.json()['results'][0]
+        self.assertEqual(product['category']['children'][0]['slug'], 'headphones')
+        self.assertEqual(len(product['variants']), 2)
+
+        response = await self.async_client.get(f'/api/products/products/{self.product.slug}/')
+        self.assertEqual(response.json()['slug'], self.product.slug)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        response = await self.async_client.get(f'/api/products/products/{self.product.slug}/')
+        self.assertEqual(response['X-Cache'], 'HIT')
+
+        response = await self.async_client.get('/api/products/products/missing/')
+        self.assertEqual(response.status_code, 404)
+
+    async def test_category_root(self):
+        response = await self.async_client.get('/api/products/categories/root/')
+        self.assertEqual([c['slug'] for c in response.json()], ['audio'])
+
+    async def test_writes_still_go_through_the_viewset(self):
+        response = await self.async_client.post(
+            '/api/products/products/', {'name': 'Speaker'}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('category_id', response.json())
+
+
+def image_file(size=(1200, 900), mode='RGB', image_format='JPEG', name='photo.jpg'):
+    image = Image.new(mode, size, (200, 30, 30, 0) if mode == 'RGBA' else (200, 30, 30))
+    ImageDraw.Draw(image).ellipse((size[0] // 4, size[1] // 4, size[0] // 2, size[1] // 2), fill='blue')
+    buffer = BytesIO()
+    image.save(buffer, image_format)
+    return SimpleUploadedFile(name, buffer.getvalue())
+
+
+class ImageRenditionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(
+            name='Camera', category=Category.objects.create(name='Photo'), description='Takes pictures',
+            price=Decimal('300.00'), stock_quantity=3, weight=Decimal('0.80')
+        )
+        cls.staff = User.objects.create_user(
+            email='staff@example.com', username='staff', password='secret', is_staff=True
+        )
+
+    def setUp(self):
+        cache.clear()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name, MEDIA_URL='/media/'))
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def upload(self, file, **data):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                f'/api/products/products/{self.product.slug}/images/', {'image': file, **data}, format='multipart'
+            )
+        self.assertEqual(response.status_code, 201, response.data)
+        return ProductImage.objects.get(pk=response.data['id'])
+
+    def test_upload_is_rendered_in_every_size_and_format(self):
+        image = self.upload(image_file(), is_primary=True)
+
+        sizes = image.renditions['sizes']
+        self.assertEqual(image.renditions['source'], image.image.name)
+        self.assertEqual(
+            {name: (size['width'], size['height']) for name, size in sizes.items()},
+            {'thumb': (160, 120), 'small': (320, 240), 'medium': (640, 480), 'large': (1200, 900)},
+        )
+        for size in sizes.values():
+            for image_format, extension in [('webp', 'webp'), ('jpeg', 'jpg')]:
+                name = size[image_format]
+                self.assertRegex(name, r'^products/renditions/[0-9a-f]{16}-%dw\.%s$' % (size['width'], extension))
+                with default_storage.open(name) as file:
+                    digest = hashlib.sha256(file.read()).hexdigest()
+                    file.seek(0)
+                    self.assertEqual(Image.open(file).format, image_format.upper())
+                self.assertTrue(name.split('/')[-1].startswith(digest[:16]))
+
+        thumb = ProductImage.objects.get(pk=image.pk).renditions['sizes']['thumb']['webp']
+        response = self.client.get(f'/api/products/products/{self.product.slug}/')
+        self.assertEqual(response.data['primary_image']['renditions']['thumb']['webp'], '/media/' + thumb)
+        self.assertEqual(response.data['images'][0]['renditions']['large']['width'], 1200)
+
+    def test_cached_catalog_picks_up_renditions(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            image = ProductImage.objects.create(product=self.product, image=image_file(), is_primary=True)
+        url = f'/api/products/products/{self.product.slug}/'
+        # Staff responses are not cached
+        client = APIClient()
+        self.assertEqual(client.get(url).data['primary_image']['renditions'], {})
+
+        for callback in callbacks:
+            callback()
+        response = client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(set(response.data['primary_image']['renditions']), {'thumb', 'small', 'medium', 'large'})
+        self.assertTrue(ProductImage.objects.get(pk=image.pk).renditions)
+
+    def test_identical_renditions_are_stored_once(self):
+        first = self.upload(image_file())
+        second = self.upload(image_file(name='copy.jpg'))
+        self.assertNotEqual(first.image.name, second.image.name)
+        self.assertEqual(first.renditions['sizes'], second.renditions['sizes'])
+
+    def test_replaced_file_is_rendered_again(self):
+        image = self.upload(image_file())
+        old = image.renditions['sizes']['thumb']['webp']
+
+        image.image = image_file(size=(800, 800), name='square.jpg')
+        with self.captureOnCommitCallbacks(execute=True):
+            image.save()
+        image.refresh_from_db()
+        self.assertEqual(image.renditions['source'], image.image.name)
+        self.assertEqual(image.renditions['sizes']['thumb']['height'], 160)
+        self.assertNotEqual(image.renditions['sizes']['thumb']['webp'], old)
+
+        # Saving for other reasons keeps them
+        queued = OutboxMessage.objects.count()
+        image.is_primary = True
+        image.save()
+        self.assertEqual(OutboxMessage.objects.count(), queued)
+        self.assertTrue(ProductImage.objects.get(pk=image.pk).renditions)
+
+    def test_transparent_images(self):
+        image = self.upload(image_file(mode='RGBA', image_format='PNG', name='logo.png'))
+        small = image.renditions['sizes']['small']
+        with default_storage.open(small['webp']) as file:
+            self.assertEqual(Image.open(file).mode, 'RGBA')
+        with default_storage.open(small['jpeg']) as file:
+            # The transparent background comes out white
+            self.assertEqual(Image.open(file).convert('RGB').getpixel((0, 0)), (255, 255, 255))
+
+    def test_unreadable_files_are_skipped(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            image = ProductImage.objects.create(product=self.product, image='products/missing.jpg')
+        with self.assertLogs('apps.products.tasks', 'WARNING'):
+            for callback in callbacks:
+                callback()
+        self.assertEqual(ProductImage.objects.get(pk=image.pk).renditions, {})
+
+    def test_command_renders_images_without_renditions(self):
+        with self.captureOnCommitCallbacks():
+            ProductImage.objects.create(product=self.product, image=image_file())
+        out = StringIO()
+        call_command('render_product_images', stdout=out)
+        self.assertEqual(out.getvalue().strip(), 'Rendered 1 product image(s)')
+        call_command('render_product_images', stdout=out)
+        self.assertIn('Rendered 0', out.getvalue())
+
+
+class CatalogImportExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Shoes')
+        cls.staff = User.objects.create_user(
+            email='staff@example.com', username='staff', password='secret', is_staff=True
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def jsonl(self, *records):
+        return [json.dumps(record) + '\n' for record in records]
+
+    def product(self, sku, **fields):
+        return {
+            'type': 'product', 'sku': sku, 'name': 'Runner %s' % sku, 'category': 'shoes',
+            'description': 'Light', 'price': '99.99', 'weight': '0.80', 'stock_quantity': 25, **fields,
+        }
+
+    def test_import_creates_then_updates_by_key(self):
+        records = [
+            self.product('SHOE-1'),
+            {'type': 'variant', 'product': 'SHOE-1', 'name': 'Size', 'value': '42', 'stock_quantity': 10},
+            {'type': 'image', 'product': 'SHOE-1', 'image': 'products/runner.jpg', 'is_primary': True},
+            self.product('SHOE-2', slug='runner-two'),
+        ]
+        with self.captureOnCommitCallbacks():
+            report = import_catalog(self.jsonl(*records), 'jsonl', batch_size=2)
+        self.assertEqual(report['created'], {'product': 2, 'variant': 1, 'image': 1})
+        self.assertEqual(report['failed'], 0)
+        product = Product.objects.get(sku='SHOE-1')
+        self.assertEqual((product.slug, product.price, product.category), ('runner-shoe-1', Decimal('99.99'), self.category))
+        self.assertEqual(product.variants.get().price_adjustment, Decimal('0'))
+        # Bulk-created images still get their renditions queued
+        image = product.images.get()
+        self.assertTrue(OutboxMessage.objects.filter(
+            task='apps.products.tasks.render_product_image', kwargs={'image_id': image.pk}
+        ).exists())
+
+        records = [
+            self.product('SHOE-1', price='89.99'),
+            {'type': 'variant', 'product': 'SHOE-1', 'name': 'Size', 'value': '42', 'stock_quantity': 4},
+            {'type': 'image', 'product': 'SHOE-1', 'image': 'products/side.jpg', 'is_primary': True},
+        ]
+        report = import_catalog(self.jsonl(*records), 'jsonl')
+        self.assertEqual(report['created'], {'product': 0, 'variant': 0, 'image': 1})
+        self.assertEqual(report['updated'], {'product': 1, 'variant': 1, 'image': 0})
+        product.refresh_from_db()
+        self.assertEqual(product.price, Decimal('89.99'))
+        self.assertEqual(product.variants.get().stock_quantity, 4)
+        # The new primary image takes over from the old one
+        self.assertEqual(
+            list(product.images.order_by('id').values_list('is_primary', flat=True)), [False, True]
+        )
+
+    def test_invalid_records_are_reported_and_skipped(self):
+        Product.objects.create(
+            name='Taken', slug='taken', category=self.category, description='x',
+            price=Decimal('1.00'), stock_quantity=1, weight=Decimal('0.10'),
+        )
+        lines = self.jsonl(
+            self.product('A', price='cheap'),
+            self.product('B', category='hats'),
+            self.product('C', slug='taken'),
+            {'type': 'variant', 'product': 'NOPE', 'name': 'Size', 'value': 'M', 'stock_quantity': 1},
+            {'type': 'bundle'},
+            self.product('D'),
+        ) + ['not json\n']
+        report = import_catalog(lines, 'jsonl')
+        self.assertEqual(report['created']['product'], 1)
+        self.assertEqual(report['failed'], 6)
+        self.assertEqual(
+            [(error['line'], sorted(error['errors'])) for error in report['errors']],
+            [(1, ['price']), (2, ['category']), (5, ['type']), (7, ['non_field_errors']),
+             (3, ['slug']), (4, ['product'])],
+        )
+        self.assertTrue(Product.objects.filter(sku='D').exists())
+
+    def test_export_round_trips_through_import(self):
+        product = Product.objects.create(
+            name='Boot', category=self.category, description='Warm, "waterproof"\nand tall',
+            price=Decimal('120.00'), stock_quantity=5, weight=Decimal('1.20'), is_active=False,
+        )
+        ProductVariant.objects.create(product=product, name='Size', value='44', stock_quantity=2,
+                                      price_adjustment=Decimal('5.00'))
+        for file_format in ('csv', 'jsonl'):
+            lines = list(export_catalog(file_format, batch_size=1))
+            report = import_catalog(lines, file_format)
+            # Nothing differs, so nothing is written
+            self.assertEqual(report['unchanged'], {'product': 1, 'variant': 1, 'image': 0}, file_format)
+            self.assertEqual(report['failed'], 0, report['errors'])
+        updated_at = product.updated_at
+        product.refresh_from_db()
+        self.assertEqual(product.updated_at, updated_at)
+        self.assertEqual(product.description, 'Warm, "waterproof"\nand tall')
+        self.assertFalse(product.is_active)
+        self.assertEqual(ProductVariant.objects.get().price_adjustment, Decimal('5.00'))
+
+    def test_export_reads_each_batch_with_three_queries(self):
+        for index in range(4):
+            product = Product.objects.create(
+                name='Boot %d' % index, category=self.category, description='x',
+                price=Decimal('1.00'), stock_quantity=1, weight=Decimal('0.10'),
+            )
+            ProductVariant.objects.create(product=product, name='Size', value='40', stock_quantity=1)
+        # One for the products, then variants and images per batch
+        with self.assertNumQueries(5):
+            records = list(export_catalog('jsonl', batch_size=2))
+        self.assertEqual(len(records), 8)
+
+    def test_admin_endpoints(self):
+        upload = SimpleUploadedFile('catalog.csv', (
+            'type,product,sku,name,category,description,price,weight,stock_quantity\n'
+            'product,,SHOE-9,Trail,shoes,Grippy,50.00,0.90,7\n'
+        ).encode('utf-8-sig'))
+        response = self.client.post('/api/products/catalog/import/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['created']['product'], 1)
+
+        response = self.client.get('/api/products/catalog/export/?file_format=jsonl')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        records = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(records[0]['sku'], 'SHOE-9')
+
+        self.client.force_authenticate(User.objects.create_user(
+            email='shopper@example.com', username='shopper', password='secret'
+        ))
+        self.assertEqual(self.client.get('/api/products/catalog/export/').status_code, 403)
+
+    def test_commands(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = directory + '/catalog.jsonl'
+            with open(path, 'w') as file:
+                file.writelines(self.jsonl(self.product('SHOE-5')))
+            out = StringIO()
+            call_command('import_catalog', path, stdout=out)
+            self.assertIn('Created 1 product(s), 0 variant(s), 0 image(s)\n', out.getvalue())
+        out = StringIO()
+        call_command('export_catalog', stdout=out)
+        self.assertIn('product,,SHOE-5,Runner SHOE-5,runner-shoe-5,shoes', out.getvalue())
+
+
+@requires_query_plans
+class IndexUsageTests(QueryPlanMixin, TestCase):
+    """The catalog queries use the indexes meant for them once the tables have some volume."""
+
+    @classmethod
+    def setUpTestData(cls):
+        categories = Category.objects.bulk_create(
+            Category(name='Category %d' % i, slug='category-%d' % i, path='/%d/' % i) for i in range(100)
+        )
+        products = Product.objects.bulk_create(
+            Product(
+                sku='SKU%05d' % i, name='Product %d' % i, slug='product-%d' % i,
+                category=categories[i % 100], description='', price=Decimal(i % 997),
+                stock_quantity=10, weight=Decimal('1.00'), is_active=i % 50 != 0,
+            )
+            for i in range(20000)
+        )
+        ProductImage.objects.bulk_create(
+            ProductImage(product=product, image='products/%d-%d.jpg' % (product.pk, i), is_primary=i == 0)
+            for product in products[:5000] for i in range(3)
+        )
+        analyze()
+        cls.product = products[0]
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_catalog_filters(self):
+        plan = self.plan_of(
+            '/api/products/products/?category=category-7&min_price=100&max_price=200', 'products_product'
+        )
+        self.assertIn('product_active_cat_price_idx', plan)
+
+    def test_primary_image(self):
+        plan = ProductImage.objects.filter(product=self.product, is_primary=True).explain()
+        self.assertIn('one_primary_image_per_product', plan)
+
+    def test_one_primary_image(self):
+        image = ProductImage.objects.filter(product=self.product, is_primary=False).first()
+        image.is_primary = True
+        image.save()
+        self.assertEqual(list(self.product.images.filter(is_primary=True)), [image])
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ProductImage.objects.filter(product=self.product).update(is_primary=True)
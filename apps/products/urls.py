@@ -1,7 +1,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from rest_framework_nested import routers
-from .views import (CategoryViewSet, ProductViewSet, 
+from .views import (CatalogExportView, CatalogImportView, CategoryViewSet, ProductViewSet,
                    ProductImageViewSet, ProductVariantViewSet)
 
 router = DefaultRouter()
@@ -14,6 +14,8 @@ products_router.register(r'images', ProductImageViewSet, basename='product-image
 products_router.register(r'variants', ProductVariantViewSet, basename='product-variants')
 
 urlpatterns = [
+    path('catalog/import/', CatalogImportView.as_view(), name='catalog-import'),
+    path('catalog/export/', CatalogExportView.as_view(), name='catalog-export'),
     path('', include(router.urls)),
     path('', include(products_router.urls)),
 ]
\ No newline at end of file
@@ -1,43 +1,96 @@
+import codecs
+
 from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
-from django.db.models import Q
+from rest_framework.views import APIView
+from django.db.models import Prefetch
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from core.async_views import AsyncReadMixin
+from core.caching import CachedResponseMixin
+from core.db.replicas import ReplicaReadMixin
+from core.pagination import StreamingListMixin
+from core.serializers import requested
+from core.throttling import CatalogRateThrottle
+from . import catalog_io, category_tree, search as product_search
+from .category_tree import CategoryTreeMixin
 from .models import Category, Product, ProductImage, ProductVariant
+from .search import search_products
 from .serializers import (CategorySerializer, ProductSerializer,
                          ProductImageSerializer, ProductVariantSerializer)
 
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(CategoryTreeMixin, CachedResponseMixin, ReplicaReadMixin, AsyncReadMixin,
+                      StreamingListMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     lookup_field = 'slug'
+    pagination_ordering = ('id',)
+    throttle_classes = [CatalogRateThrottle]
+    cache_versions = (category_tree.VERSION,)
+    async_actions = ('list', 'retrieve', 'root')
+    replica_actions = ('list', 'retrieve', 'root')
 
     @action(detail=False, methods=['get'])
     def root(self, request):
-        root_categories = Category.objects.filter(parent=None)
+        return self.cached_response(request, self.root_response)
+
+    async def aroot(self, request):
+        async def compute():
+            return self.root_response()
+        return await self.acached_response(request, compute)
+
+    def root_response(self):
+        root_categories = self.get_category_tree().roots()
         serializer = self.get_serializer(root_categories, many=True)
         return Response(serializer.data)
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(CategoryTreeMixin, CachedResponseMixin, ReplicaReadMixin, AsyncReadMixin,
+                     StreamingListMixin, viewsets.ModelViewSet):
     serializer_class = ProductSerializer
     lookup_field = 'slug'
+    throttle_classes = [CatalogRateThrottle]
+    # Everything ProductSerializer renders; checkout bumps product_stock
+    cache_versions = (product_search.VERSION, category_tree.VERSION,
+                      'product_images', 'product_variants', 'product_stock')
+
+    def get_pagination_ordering(self):
+        if self.request.query_params.get('search'):
+            return ('-search_rank', 'id')
+        return ('-created_at', '-id')
 
     def get_queryset(self):
+        # Load what ProductSerializer nests up front: one query for the
+        # products and their categories plus one per prefetched relation,
+        # however many products are on the page, skipping relations left
+        # out with ?fields=. Category children come from the cached tree.
         queryset = Product.objects.all()
+        if requested(self, 'category'):
+            queryset = queryset.select_related('category')
+        if requested(self, 'images') or requested(self, 'primary_image'):
+            queryset = queryset.prefetch_related(
+                Prefetch('images', queryset=ProductImage.objects.order_by('id'))
+            )
+        if requested(self, 'variants'):
+            queryset = queryset.prefetch_related(
+                Prefetch('variants', queryset=ProductVariant.objects.order_by('id'))
+            )
         if not self.request.user.is_staff:
             queryset = queryset.filter(is_active=True)
         
-        # Filter by category
+        # Filter by category, including everything below it
         category_slug = self.request.query_params.get('category', None)
         if category_slug:
-            queryset = queryset.filter(category__slug=category_slug)
-            
-        # Search by name or description
-        search = self.request.query_params.get('search', None)
-        if search:
-            queryset = queryset.filter(
-                Q(name__icontains=search) | Q(description__icontains=search)
-            )
+            tree = self.get_category_tree()
+            category = tree.get(category_slug)
+            if category is None:
+                # Not returned early: a search below still has to add the
+                # search_rank its pages are ordered by
+                queryset = queryset.none()
+            else:
+                queryset = queryset.filter(category_id__in=tree.descendant_ids(category.pk))
             
         # Filter by price range
         min_price = self.request.query_params.get('min_price', None)
@@ -46,7 +99,12 @@ class ProductViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(price__gte=min_price)
         if max_price:
             queryset = queryset.filter(price__lte=max_price)
-            
+
+        # Full-text search over name and description, best match first
+        search = self.request.query_params.get('search', None)
+        if search:
+            queryset = search_products(queryset, search)
+
         return queryset
 
     @action(detail=True, methods=['post'])
@@ -74,9 +132,58 @@ class ProductImageViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         return ProductImage.objects.filter(product__slug=self.kwargs['product_slug'])
 
+    def perform_create(self, serializer):
+        serializer.save(product=get_object_or_404(Product, slug=self.kwargs['product_slug']))
+
 class ProductVariantViewSet(viewsets.ModelViewSet):
     serializer_class = ProductVariantSerializer
     permission_classes = [permissions.IsAdminUser]
 
     def get_queryset(self):
-        return ProductVariant.objects.filter(product__slug=self.kwargs['product_slug'])
+        return ProductVariant.objects.select_related('product').filter(
+            product__slug=self.kwargs['product_slug']
+        )
+
+
+class CatalogImportView(APIView):
+    """
+    Imports an uploaded CSV or JSON Lines catalog file, see catalog_io.py.
+    The file is read from Django's upload buffer in batches; files of
+    more than a few hundred thousand records are better loaded with
+    ``manage.py import_catalog``, outside the request timeout.
+    """
+    permission_classes = [permissions.IsAdminUser]
+    parser_classes = [MultiPartParser]
+
+    def post(self, request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'file': ['No file was submitted.']}, status=status.HTTP_400_BAD_REQUEST)
+        file_format = request.data.get('file_format') or catalog_io.format_of(upload.name)
+        if file_format not in catalog_io.FORMATS:
+            return Response(
+                {'file_format': ['Expected one of %s.' % ', '.join(catalog_io.FORMATS)]},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        lines = codecs.iterdecode(upload, 'utf-8-sig')
+        return Response(catalog_io.import_catalog(lines, file_format))
+
+
+class CatalogExportView(APIView):
+    """Streams the whole catalog as CSV or, with ``?file_format=jsonl``, JSON Lines."""
+    permission_classes = [permissions.IsAdminUser]
+    content_types = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+    def get(self, request):
+        # Not ?format=, which picks a renderer
+        file_format = request.query_params.get('file_format', 'csv')
+        if file_format not in catalog_io.FORMATS:
+            return Response(
+                {'file_format': ['Expected one of %s.' % ', '.join(catalog_io.FORMATS)]},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        response = StreamingHttpResponse(
+            catalog_io.export_catalog(file_format), content_type=self.content_types[file_format]
+        )
+        response['Content-Disposition'] = 'attachment; filename="catalog.%s"' % file_format
+        return response
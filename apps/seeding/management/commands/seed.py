@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.seeding.seeding import DEFAULTS, already_seeded, seed
+
+HELP = {
+    'depth': 'Levels of categories',
+    'breadth': 'Child categories of each category',
+    'products': 'Products, in the leaf categories',
+    'images': 'Most images per product',
+    'variants': 'Most variants per product',
+    'users': 'Users, each with a default address',
+    'orders': 'Orders across all users',
+    'lines': 'Most lines per order',
+    'days': 'Days of order history',
+    'seed': 'Seed of the random choices',
+    'batch_size': 'Rows written per query',
+}
+
+
+class Command(BaseCommand):
+    help = 'Add a synthetic catalog and order history, for benchmarks and local data'
+
+    def add_arguments(self, parser):
+        for name, default in DEFAULTS.items():
+            parser.add_argument(
+                '--%s' % name.replace('_', '-'), type=int, default=default,
+                help='%s (default %d)' % (HELP[name], default),
+            )
+
+    def handle(self, *args, **options):
+        if already_seeded():
+            raise CommandError('The database already has seeded data; flush it first')
+        counts = seed(**{name: options[name] for name in DEFAULTS})
+        self.stdout.write(
+            'Created %(categories)d categories, %(products)d products with %(images)d images and '
+            '%(variants)d variants, %(users)d users, %(orders)d orders with %(lines)d lines' % counts
+        )
@@ -0,0 +1,282 @@
+# apps/seeding/seeding.py
+"""
+Synthetic catalogs and order histories, for benchmarks and local data.
+
+    python manage.py seed --products 100000 --users 2000 --orders 200000
+
+``seed`` adds:
+
+- a category tree ``depth`` levels deep, each category with ``breadth``
+  children;
+- products in the leaf categories, each with one to ``images`` images
+  (the first primary) and up to ``variants`` variants;
+- users with a default address, and orders spread over the last
+  ``days`` days, with one to ``lines`` lines of the catalog's best
+  sellers, most delivered and a few still pending.
+
+Rows are written with bulk_create, a batch per transaction, so the work
+their save() methods and signals would do is done here: category paths,
+order numbers, order totals and line snapshots, and cache invalidation.
+Choices come from a random generator seeded with ``seed``, so the same
+options give the same data. Seeded products have ``SEED-`` SKUs and
+seeded users ``seed`` usernames; seeding twice into one database is
+refused.
+"""
+import random
+from datetime import timedelta
+from decimal import Decimal
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+from django.utils.text import slugify
+
+from apps.accounts.models import Address, User
+from apps.products.category_tree import invalidate_category_tree
+from apps.products.models import Category, Product, ProductImage, ProductVariant
+from apps.products.search import invalidate_search_index
+from apps.shipping.rates import quote
+from core.versioning import bump_version_on_commit
+
+from apps.orders.models import Order, OrderItem
+from apps.orders.numbering import generate_order_number
+
+DEFAULTS = {
+    'depth': 3,
+    'breadth': 4,
+    'products': 1000,
+    'images': 3,
+    'variants': 4,
+    'users': 100,
+    'orders': 1000,
+    'lines': 5,
+    'days': 365,
+    'seed': 0,
+    'batch_size': 2000,
+}
+
+SKU_PREFIX = 'SEED-'
+USERNAME_PREFIX = 'seed'
+PASSWORD = 'password'
+# Products order lines are drawn from
+BESTSELLERS = 5000
+
+DEPARTMENTS = [
+    'Electronics', 'Home', 'Kitchen', 'Garden', 'Fashion', 'Beauty', 'Sports', 'Outdoors', 'Toys', 'Books',
+    'Office', 'Automotive', 'Baby', 'Health', 'Tools', 'Music', 'Pets', 'Grocery', 'Lighting', 'Travel',
+]
+ADJECTIVES = [
+    'classic', 'compact', 'deluxe', 'durable', 'ergonomic', 'foldable', 'heavy', 'lightweight', 'modern',
+    'portable', 'premium', 'rugged', 'slim', 'smart', 'sturdy', 'vintage', 'wireless', 'waterproof',
+]
+MATERIALS = [
+    'aluminium', 'bamboo', 'canvas', 'ceramic', 'cotton', 'glass', 'leather', 'linen', 'oak', 'plastic',
+    'rubber', 'silicone', 'steel', 'wool',
+]
+NOUNS = [
+    'backpack', 'blender', 'bottle', 'chair', 'charger', 'desk', 'drill', 'headphones', 'jacket', 'kettle',
+    'keyboard', 'lamp', 'mat', 'mug', 'organiser', 'pan', 'pillow', 'sandals', 'speaker', 'table', 'tent',
+    'towel', 'umbrella', 'watch',
+]
+VARIANTS = {
+    'Size': ['XS', 'S', 'M', 'L', 'XL', 'XXL'],
+    'Colour': ['Black', 'White', 'Red', 'Blue', 'Green', 'Grey'],
+}
+# Share of orders in each status
+STATUSES = [('DELIVERED', 70), ('SHIPPED', 8), ('PROCESSING', 4), ('PAID', 4), ('PENDING', 8), ('CANCELLED', 6)]
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def already_seeded():
+    return (
+        Product.objects.filter(sku__startswith=SKU_PREFIX).exists()
+        or User.objects.filter(username__startswith=USERNAME_PREFIX).exists()
+    )
+
+
+class Seeder:
+    def __init__(self, **options):
+        self.options = {**DEFAULTS, **options}
+        self.rng = random.Random(self.options['seed'])
+        self.counts = dict.fromkeys(['categories', 'products', 'images', 'variants', 'users', 'orders', 'lines'], 0)
+        # Reservoir sample of the active products, which order lines are
+        # drawn from
+        self.bestsellers = []
+        self.active = 0
+
+    def run(self):
+        leaves = self.seed_categories()
+        self.seed_products(leaves)
+        addresses = self.seed_users()
+        self.seed_orders(addresses)
+        invalidate_category_tree()
+        invalidate_search_index()
+        bump_version_on_commit('product_images')
+        bump_version_on_commit('product_variants')
+        return self.counts
+
+    def seed_categories(self):
+        """Create the category tree, a level at a time; returns the leaves."""
+        parents = [None]
+        for level in range(self.options['depth']):
+            categories = []
+            for parent in parents:
+                for _ in range(self.options['breadth']):
+                    index = self.counts['categories'] + len(categories)
+                    name = '%s %d' % (self.rng.choice(DEPARTMENTS), index)
+                    categories.append(Category(name=name, slug='seed-%s' % slugify(name), parent=parent, depth=level))
+            with transaction.atomic():
+                Category.objects.bulk_create(categories)
+                # Paths need the ids bulk_create just assigned
+                for category in categories:
+                    category.path = '%s%d/' % (category.parent.path if category.parent else '/', category.pk)
+                Category.objects.bulk_update(categories, ['path'])
+            self.counts['categories'] += len(categories)
+            parents = categories
+        return parents
+
+    def seed_products(self, categories):
+        for batch in batched(range(self.options['products']), self.options['batch_size']):
+            products = [self.product(index, categories) for index in batch]
+            with transaction.atomic():
+                Product.objects.bulk_create(products)
+                images, variants = [], []
+                for product in products:
+                    images.extend(self.images(product))
+                    variants.extend(self.variants(product))
+                ProductImage.objects.bulk_create(images)
+                ProductVariant.objects.bulk_create(variants)
+            for product in products:
+                self.sample(product)
+            self.counts['products'] += len(products)
+            self.counts['images'] += len(images)
+            self.counts['variants'] += len(variants)
+
+    def product(self, index, categories):
+        rng = self.rng
+        name = '%s %s %s' % (rng.choice(ADJECTIVES).capitalize(), rng.choice(MATERIALS), rng.choice(NOUNS))
+        return Product(
+            sku='%s%08d' % (SKU_PREFIX, index), name=name, slug='%s-%d' % (slugify(name), index),
+            category=rng.choice(categories),
+            description='A %s %s for everyday use. Ships in recyclable packaging.' % (
+                rng.choice(ADJECTIVES), name.split()[-1]
+            ),
+            price=Decimal(rng.randint(1, 500)) - Decimal('0.01'),
+            weight=Decimal(rng.randint(1, 200)).scaleb(-1),
+            stock_quantity=rng.randint(50, 1000),
+            is_active=rng.random() < 0.95,
+        )
+
+    def images(self, product):
+        return [
+            ProductImage(product=product, image='products/seed/%s-%d.jpg' % (product.sku, index), is_primary=index == 0)
+            for index in range(self.rng.randint(1, self.options['images']))
+        ]
+
+    def variants(self, product):
+        name, values = self.rng.choice(list(VARIANTS.items()))
+        count = self.rng.randint(0, self.options['variants'])
+        return [
+            ProductVariant(
+                product=product, name=name, value=value, stock_quantity=self.rng.randint(0, 100),
+                price_adjustment=Decimal(self.rng.choice([0, 0, 0, 2, 5])),
+            )
+            for value in values[:count]
+        ]
+
+    def sample(self, product):
+        if not product.is_active:
+            return
+        self.active += 1
+        if len(self.bestsellers) < BESTSELLERS:
+            self.bestsellers.append(product)
+        else:
+            slot = self.rng.randrange(self.active)
+            if slot < BESTSELLERS:
+                self.bestsellers[slot] = product
+
+    def seed_users(self):
+        """Create the users and their default addresses; returns the addresses."""
+        # Hashing is slow on purpose, so every user shares one hash
+        password = make_password(PASSWORD)
+        states = [code for code, _ in Address.STATES]
+        addresses = []
+        for batch in batched(range(self.options['users']), self.options['batch_size']):
+            users = [
+                User(
+                    username='%s%d' % (USERNAME_PREFIX, index), email='%s%d@example.com' % (USERNAME_PREFIX, index),
+                    password=password, first_name='Seed', last_name='User %d' % index, is_verified=True,
+                )
+                for index in batch
+            ]
+            with transaction.atomic():
+                User.objects.bulk_create(users)
+                created = Address.objects.bulk_create(
+                    Address(
+                        user=user, street_address='%d Seed Street' % index, city='Seed City',
+                        state=self.rng.choice(states), phone_number='080%08d' % index, is_default=True,
+                    )
+                    for index, user in zip(batch, users)
+                )
+            addresses.extend(created)
+            self.counts['users'] += len(users)
+        return addresses
+
+    def seed_orders(self, addresses):
+        if not addresses or not self.bestsellers:
+            return
+        statuses, weights = zip(*STATUSES)
+        now = timezone.now()
+        for batch in batched(range(self.options['orders']), self.options['batch_size']):
+            orders, lines = [], []
+            for _ in batch:
+                address = self.rng.choice(addresses)
+                items = [
+                    OrderItem(product=product, price=product.price, quantity=quantity)
+                    for product, quantity in self.lines()
+                ]
+                subtotal = sum(item.get_total() for item in items)
+                weight = sum(item.product.weight * item.quantity for item in items)
+                shipping_cost = quote(weight, address.state)
+                orders.append(Order(
+                    user_id=address.user_id, shipping_address=address, order_number=generate_order_number(),
+                    status=self.rng.choices(statuses, weights)[0],
+                    payment_method='CRYPTO' if self.rng.random() < 0.2 else 'FIAT',
+                    subtotal=subtotal, item_count=sum(item.quantity for item in items),
+                    item_summary=[item.summary() for item in items],
+                    shipping_cost=shipping_cost, total_amount=subtotal + shipping_cost,
+                    created_at=now - timedelta(seconds=self.rng.randrange(self.options['days'] * 86400)),
+                ))
+                lines.append(items)
+            with transaction.atomic():
+                # bulk_create stamps created_at with the current time
+                created_at = [order.created_at for order in orders]
+                Order.objects.bulk_create(orders)
+                for order, timestamp in zip(orders, created_at):
+                    order.created_at = timestamp
+                Order.objects.bulk_update(orders, ['created_at'])
+                for order, items in zip(orders, lines):
+                    for item in items:
+                        item.order = order
+                items = OrderItem.objects.bulk_create(item for items in lines for item in items)
+            self.counts['orders'] += len(orders)
+            self.counts['lines'] += len(items)
+
+    def lines(self):
+        """(product, quantity) of a new order's lines."""
+        count = min(self.rng.randint(1, self.options['lines']), len(self.bestsellers))
+        return [
+            (product, self.rng.choice([1, 1, 1, 2, 3]))
+            for product in self.rng.sample(self.bestsellers, count)
+        ]
+
+
+def seed(**options):
+    """Add a synthetic catalog and order history; returns the number of rows of each kind."""
+    return Seeder(**options).run()
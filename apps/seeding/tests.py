@@ -0,0 +1,55 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.utils import timezone
+
+from apps.accounts.models import Address, User
+from apps.orders.models import Order
+from apps.products.models import Category, Product, ProductImage
+
+
+class SeedCommandTests(TestCase):
+    def seed(self, **options):
+        out = StringIO()
+        call_command('seed', stdout=out, **{
+            'depth': 2, 'breadth': 3, 'products': 60, 'users': 5, 'orders': 40, 'batch_size': 25, **options
+        })
+        return out.getvalue()
+
+    def test_seeds_catalog_and_order_history(self):
+        self.assertIn('Created 12 categories, 60 products', self.seed())
+
+        leaves = Category.objects.filter(depth=1)
+        self.assertEqual(leaves.count(), 9)
+        for category in leaves.select_related('parent'):
+            self.assertEqual(category.path, '%s%d/' % (category.parent.path, category.pk))
+        self.assertFalse(Product.objects.exclude(category__in=leaves).exists())
+        self.assertEqual(ProductImage.objects.filter(is_primary=True).count(), 60)
+        self.assertEqual(Address.objects.filter(is_default=True).count(), 5)
+
+        self.assertEqual(Order.objects.count(), 40)
+        # Totals match the lines, and the history spans more than a day
+        for order in Order.objects.prefetch_related('items'):
+            items = order.items.all()
+            self.assertEqual(order.subtotal, sum(item.get_total() for item in items))
+            self.assertEqual(order.item_count, sum(item.quantity for item in items))
+            self.assertEqual(order.total_amount, order.subtotal + order.shipping_cost)
+        oldest = Order.objects.order_by('created_at').first().created_at
+        self.assertLess(oldest, timezone.now() - timedelta(days=1))
+
+    def test_same_seed_gives_same_data(self):
+        self.seed(orders=0)
+        names = list(Product.objects.order_by('sku').values_list('name', 'price'))
+        Product.objects.all().delete()
+        Category.objects.all().delete()
+        User.objects.all().delete()
+        self.seed(orders=0)
+        self.assertEqual(list(Product.objects.order_by('sku').values_list('name', 'price')), names)
+
+    def test_refuses_to_seed_twice(self):
+        self.seed(orders=0)
+        with self.assertRaises(CommandError):
+            self.seed(orders=0)
@@ -0,0 +1,131 @@
+# apps/shipping/rates.py
+"""
+Shipping quotes from basket weight and destination state.
+
+The tables (see apps/shipping/tables.py) are compiled once per process
+into flat arrays, so a quote is a few index lookups:
+
+* ``zones`` holds the rate zone of every (origin, destination) pair of
+  states, one byte each, row by origin;
+* ``brackets`` holds the weight bracket of every 100 g of weight up to
+  the heaviest bracket, so no search over the brackets is needed;
+* ``prices`` holds the price in kobo of every (zone, bracket).
+
+Settings, in ``SHIPPING``:
+
+    SHIPPING = {
+        # State parcels are sent from
+        'ORIGIN': 'LA',
+        # Module with REGIONS, NEIGHBOURS, BRACKETS, RATES and EXTRA_PER_KG
+        'TABLES': 'apps.shipping.tables',
+    }
+"""
+import math
+from array import array
+from decimal import Decimal
+from functools import lru_cache
+from importlib import import_module
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from apps.accounts.models import Address
+
+DEFAULTS = {
+    'ORIGIN': 'LA',
+    'TABLES': 'apps.shipping.tables',
+}
+
+# Steps per kg the weight bracket lookup resolves
+STEPS_PER_KG = 10
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'SHIPPING', {})}
+
+
+class UnknownState(ValueError):
+    pass
+
+
+def units(weight):
+    """``weight`` in kg, rounded up to whole steps."""
+    return math.ceil(Decimal(weight) * STEPS_PER_KG)
+
+
+class RateTable:
+    def __init__(self, regions, neighbours, brackets, rates, extra_per_kg, origin):
+        self.states = [code for code, _ in Address.STATES]
+        self.index = {code: position for position, code in enumerate(self.states)}
+        region_of = {state: region for region, states in regions.items() for state in states}
+        missing = set(self.states) - set(region_of)
+        if missing:
+            raise ValueError('No region for %s' % ', '.join(sorted(missing)))
+        neighbours = {frozenset(pair) for pair in neighbours}
+
+        def zone(source, destination):
+            if source == destination:
+                return 0
+            if region_of[source] == region_of[destination]:
+                return 1
+            if frozenset([region_of[source], region_of[destination]]) in neighbours:
+                return 2
+            return 3
+
+        self.zones = bytes(zone(source, destination) for source in self.states for destination in self.states)
+        self.origin = self.index[origin]
+
+        limits = [units(bracket) for bracket in brackets]
+        self.max_units = limits[-1]
+        self.brackets = bytearray(self.max_units + 1)
+        bracket = 0
+        for weight in range(self.max_units + 1):
+            while weight > limits[bracket]:
+                bracket += 1
+            self.brackets[weight] = bracket
+
+        self.width = len(brackets)
+        self.prices = array('q', (int(Decimal(price) * 100) for row in rates for price in row))
+        self.extra = array('q', (int(Decimal(price) * 100) for price in extra_per_kg))
+
+    def zone(self, destination, origin=None):
+        try:
+            source = self.origin if origin is None else self.index[origin]
+            return self.zones[source * len(self.states) + self.index[destination]]
+        except KeyError as exc:
+            raise UnknownState('No rates for state %s' % exc.args[0]) from None
+
+    def quote(self, weight, destination, origin=None):
+        """Cost of sending ``weight`` kg to the ``destination`` state."""
+        zone = self.zone(destination, origin)
+        weight = math.ceil(weight * STEPS_PER_KG)
+        if weight <= self.max_units:
+            return Decimal(self.prices[zone * self.width + self.brackets[weight]]).scaleb(-2)
+        over = -(-(weight - self.max_units) // STEPS_PER_KG)
+        return Decimal(self.prices[zone * self.width + self.width - 1] + over * self.extra[zone]).scaleb(-2)
+
+
+@lru_cache(maxsize=None)
+def get_rate_table():
+    config = get_config()
+    tables = import_module(config['TABLES'])
+    return RateTable(
+        tables.REGIONS, tables.NEIGHBOURS, tables.BRACKETS, tables.RATES, tables.EXTRA_PER_KG,
+        config['ORIGIN'],
+    )
+
+
+def quote(weight, destination, origin=None):
+    return get_rate_table().quote(weight, destination, origin)
+
+
+def basket_weight(items):
+    """Total weight of validated order or cart items, in kg."""
+    return sum((item['product'].weight * item['quantity'] for item in items), Decimal(0))
+
+
+@receiver(setting_changed)
+def reset_rate_table(setting, **kwargs):
+    if setting == 'SHIPPING':
+        get_rate_table.cache_clear()
@@ -0,0 +1,54 @@
+# apps/shipping/serializers.py
+from rest_framework import serializers
+
+from apps.accounts.models import Address
+from apps.products.models import Product
+from .rates import basket_weight, get_rate_table
+
+
+class CartItemSerializer(serializers.Serializer):
+    MAX_QUANTITY = 1000
+
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1, max_value=MAX_QUANTITY)
+
+
+class CartSerializer(serializers.Serializer):
+    MAX_ITEMS = 100
+
+    state = serializers.ChoiceField(choices=Address.STATES)
+    items = CartItemSerializer(many=True, min_length=1, max_length=MAX_ITEMS)
+
+
+class QuoteRequestSerializer(serializers.Serializer):
+    MAX_CARTS = 100
+
+    carts = CartSerializer(many=True, min_length=1, max_length=MAX_CARTS)
+
+    def validate_carts(self, carts):
+        # One query for the products of every cart
+        product_ids = {item['product_id'] for cart in carts for item in cart['items']}
+        # Products taken off sale cannot be quoted
+        products = Product.objects.filter(is_active=True).only('id', 'weight').in_bulk(product_ids)
+        missing = product_ids - set(products)
+        if missing:
+            raise serializers.ValidationError(
+                'Unknown product(s): %s.' % ', '.join(map(str, sorted(missing)))
+            )
+        for cart in carts:
+            for item in cart['items']:
+                item['product'] = products[item.pop('product_id')]
+        return carts
+
+    def quotes(self):
+        table = get_rate_table()
+        quotes = []
+        for cart in self.validated_data['carts']:
+            weight = basket_weight(cart['items'])
+            quotes.append({
+                'state': cart['state'],
+                'weight': weight,
+                'zone': table.zone(cart['state']),
+                'cost': table.quote(weight, cart['state']),
+            })
+        return quotes
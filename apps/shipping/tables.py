@@ -0,0 +1,41 @@
+# apps/shipping/tables.py
+"""
+Default shipping rates, in naira.
+
+Every state belongs to one of the six geopolitical zones (REGIONS). A
+parcel's rate zone follows from where it ships from and to:
+
+    0  within the same state
+    1  within the same region
+    2  to a neighbouring region (NEIGHBOURS)
+    3  anywhere else
+
+RATES has one row per rate zone, priced for each weight bracket; the
+brackets are upper bounds in kg. Parcels above the last bracket pay its
+price plus EXTRA_PER_KG for every kg, or part of one, over it.
+"""
+
+REGIONS = {
+    'NC': ['BE', 'FC', 'KO', 'KW', 'NA', 'NI', 'PL'],
+    'NE': ['AD', 'BA', 'BO', 'GO', 'TA', 'YO'],
+    'NW': ['JI', 'KD', 'KE', 'KN', 'KT', 'SO', 'ZA'],
+    'SE': ['AB', 'AN', 'EB', 'EN', 'IM'],
+    'SS': ['AK', 'BY', 'CR', 'DE', 'ED', 'RI'],
+    'SW': ['EK', 'LA', 'OG', 'ON', 'OS', 'OY'],
+}
+
+NEIGHBOURS = [
+    ('NC', 'NE'), ('NC', 'NW'), ('NC', 'SE'), ('NC', 'SS'), ('NC', 'SW'),
+    ('NE', 'NW'), ('SE', 'SS'), ('SS', 'SW'),
+]
+
+BRACKETS = ['0.5', '1', '2', '5', '10', '20', '30', '50']
+
+RATES = [
+    [1000, 1200, 1500, 2000, 3000, 4500, 6000, 9000],
+    [1500, 1800, 2300, 3200, 4800, 7000, 9500, 14000],
+    [2000, 2500, 3200, 4500, 6500, 9500, 13000, 19000],
+    [2500, 3200, 4200, 6000, 8500, 12500, 17000, 25000],
+]
+
+EXTRA_PER_KG = [150, 220, 300, 400]
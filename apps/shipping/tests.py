@@ -1,3 +1,187 @@
-from django.test import TestCase
+from bisect import bisect_left
+from decimal import ROUND_CEILING, Decimal
 
-# Create your tests here.
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.test import APIClient
+
+from apps.accounts.models import Address, User
+from apps.orders.models import Order
+from apps.products.models import Category, Product
+from core import throttling
+from . import tables
+from .rates import UnknownState, get_rate_table, quote
+
+
+def reference_quote(weight, destination, origin='LA'):
+    """The tables read directly, without compiling them."""
+    region_of = {state: region for region, states in tables.REGIONS.items() for state in states}
+    if origin == destination:
+        zone = 0
+    elif region_of[origin] == region_of[destination]:
+        zone = 1
+    elif {region_of[origin], region_of[destination]} in [set(pair) for pair in tables.NEIGHBOURS]:
+        zone = 2
+    else:
+        zone = 3
+    limits = [Decimal(bracket) for bracket in tables.BRACKETS]
+    # Weights are rounded up to 100 g first
+    weight = (Decimal(weight) * 10).to_integral_value(ROUND_CEILING) / 10
+    if weight <= limits[-1]:
+        return Decimal(tables.RATES[zone][bisect_left(limits, weight)])
+    over = (weight - limits[-1]).to_integral_value(ROUND_CEILING)
+    return Decimal(tables.RATES[zone][-1] + over * tables.EXTRA_PER_KG[zone])
+
+
+class RateTableTests(SimpleTestCase):
+    def test_zones(self):
+        table = get_rate_table()
+        self.assertEqual(
+            [table.zone(state) for state in ['LA', 'OG', 'KW', 'RI', 'EN', 'KN']],
+            [0, 1, 2, 2, 3, 3],
+        )
+        self.assertEqual(table.zone('KN', origin='KD'), 1)
+        self.assertEqual(len(table.zones), len(Address.STATES) ** 2)
+
+    def test_weight_brackets(self):
+        self.assertEqual(quote(Decimal('0'), 'LA'), Decimal('1000.00'))
+        self.assertEqual(quote(Decimal('0.5'), 'LA'), Decimal('1000.00'))
+        self.assertEqual(quote(Decimal('0.51'), 'LA'), Decimal('1200.00'))
+        self.assertEqual(quote(Decimal('50'), 'KN'), Decimal('25000.00'))
+        # Every kg or part of one over 50 kg
+        self.assertEqual(quote(Decimal('50.01'), 'KN'), Decimal('25400.00'))
+        self.assertEqual(quote(Decimal('52'), 'KN'), Decimal('25800.00'))
+
+    def test_matches_uncompiled_tables(self):
+        weights = [Decimal(grams) / 1000 for grams in range(0, 60000, 370)]
+        for origin in ['LA', 'FC', 'BO']:
+            for destination, _ in Address.STATES:
+                for weight in weights:
+                    self.assertEqual(
+                        quote(weight, destination, origin), reference_quote(weight, destination, origin),
+                        (weight, origin, destination),
+                    )
+
+    def test_unknown_state(self):
+        with self.assertRaisesMessage(UnknownState, 'XX'):
+            quote(Decimal('1'), 'XX')
+
+    def test_origin_setting(self):
+        with override_settings(SHIPPING={'ORIGIN': 'KN'}):
+            self.assertEqual(get_rate_table().zone('KN'), 0)
+        self.assertEqual(get_rate_table().zone('KN'), 3)
+
+
+class QuoteTests(TestCase):
+    url = '/api/shipping/quotes/'
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Hardware')
+        cls.light, cls.heavy = [
+            Product.objects.create(
+                name=name, category=category, description='A part', price=Decimal('10.00'),
+                stock_quantity=100, weight=Decimal(weight),
+            )
+            for name, weight in [('Bolt', '0.25'), ('Anvil', '30.00')]
+        ]
+        cls.hidden = Product.objects.create(
+            name='Rivet', category=category, description='A part', price=Decimal('1.00'),
+            stock_quantity=100, weight=Decimal('0.01'), is_active=False,
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_quotes_every_cart_with_one_query(self):
+        carts = [
+            {'state': 'LA', 'items': [{'product_id': self.light.pk, 'quantity': 2}]},
+            {'state': 'OY', 'items': [
+                {'product_id': self.light.pk, 'quantity': 1},
+                {'product_id': self.heavy.pk, 'quantity': 1},
+            ]},
+            {'state': 'BO', 'items': [{'product_id': self.heavy.pk, 'quantity': 2}]},
+        ]
+        with self.assertNumQueries(1):
+            response = self.client.post(self.url, {'carts': carts}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['quotes'], [
+            {'state': 'LA', 'weight': '0.50', 'zone': 0, 'cost': '1000.00'},
+            {'state': 'OY', 'weight': '30.25', 'zone': 1, 'cost': '14000.00'},
+            {'state': 'BO', 'weight': '60.00', 'zone': 3, 'cost': '29000.00'},
+        ])
+
+    def test_invalid_carts(self):
+        item = {'product_id': self.light.pk, 'quantity': 1}
+        for carts in [
+            [],
+            [{'state': 'XX', 'items': [item]}],
+            [{'state': 'LA', 'items': []}],
+            [{'state': 'LA', 'items': [{'product_id': 0, 'quantity': 1}]}],
+            [{'state': 'LA', 'items': [item]}] * 101,
+            [{'state': 'LA', 'items': [item] * 101}],
+            [{'state': 'LA', 'items': [{'product_id': self.light.pk, 'quantity': 1001}]}],
+            [{'state': 'LA', 'items': [{'product_id': self.hidden.pk, 'quantity': 1}]}],
+        ]:
+            response = self.client.post(self.url, {'carts': carts}, format='json')
+            self.assertEqual(response.status_code, 400, carts)
+
+    @override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {'quote': '2/min'}})
+    def test_quotes_are_limited_per_client(self):
+        throttling.get_limiter.cache_clear()
+        carts = [{'state': 'LA', 'items': [{'product_id': self.light.pk, 'quantity': 1}]}]
+        for _ in range(2):
+            self.assertEqual(self.client.post(self.url, {'carts': carts}, format='json').status_code, 200)
+        self.assertEqual(self.client.post(self.url, {'carts': carts}, format='json').status_code, 429)
+        response = self.client.post(self.url, {'carts': carts}, format='json', REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(response.status_code, 200)
+
+
+class OrderShippingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='buyer@example.com', username='buyer', password='secret')
+        cls.kano = Address.objects.create(
+            user=cls.user, street_address='1 Bompai', city='Kano', state='KN', phone_number='0'
+        )
+        cls.product = Product.objects.create(
+            name='Bolt', category=Category.objects.create(name='Hardware'), description='A part',
+            price=Decimal('10.00'), stock_quantity=100, weight=Decimal('1.50'),
+        )
+
+    def setUp(self):
+        # Checkouts are throttled per user id, which the next test reuses
+        throttling.get_limiter.cache_clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_shipping_cost_is_priced_by_the_server(self):
+        response = self.client.post('/api/orders/orders/', {
+            'shipping_address_id': self.kano.pk,
+            'shipping_cost': '0.01',
+            'items': [{'product_id': self.product.pk, 'quantity': 2}],
+        }, format='json')
+
+        self.assertEqual(response.status_code, 201, response.data)
+        order = Order.objects.get(pk=response.data['id'])
+        # 3 kg from Lagos to Kano
+        self.assertEqual(order.shipping_cost, Decimal('6000.00'))
+        self.assertEqual(order.total_amount, Decimal('6020.00'))
+
+    def test_changing_the_address_reprices_shipping(self):
+        order_id = self.client.post('/api/orders/orders/', {
+            'shipping_address_id': self.kano.pk,
+            'items': [{'product_id': self.product.pk, 'quantity': 2}],
+        }, format='json').data['id']
+        lagos = Address.objects.create(
+            user=self.user, street_address='1 Marina', city='Lagos', state='LA', phone_number='0'
+        )
+
+        response = self.client.patch(
+            '/api/orders/orders/%d/' % order_id, {'shipping_address_id': lagos.pk}, format='json'
+        )
+
+        self.assertEqual(response.status_code, 200, response.data)
+        order = Order.objects.get(pk=order_id)
+        self.assertEqual((order.shipping_cost, order.total_amount), (Decimal('2000.00'), Decimal('2020.00')))
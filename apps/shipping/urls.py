@@ -0,0 +1,6 @@
+from django.urls import path
+from .views import QuoteView
+
+urlpatterns = [
+    path('quotes/', QuoteView.as_view(), name='shipping-quotes'),
+]
@@ -1,3 +1,21 @@
-from django.shortcuts import render
+# apps/shipping/views.py
+from rest_framework import permissions
+from rest_framework.response import Response
+from rest_framework.views import APIView
 
-# Create your views here.
+from core.throttling import QuoteRateThrottle
+from .serializers import QuoteRequestSerializer
+
+
+class QuoteView(APIView):
+    """Shipping costs of up to MAX_CARTS carts, for basket and checkout pages."""
+    permission_classes = [permissions.AllowAny]
+    throttle_classes = [QuoteRateThrottle]
+
+    def post(self, request):
+        serializer = QuoteRequestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response({'quotes': [
+            {**quote, 'weight': str(quote['weight']), 'cost': str(quote['cost'])}
+            for quote in serializer.quotes()
+        ]})
@@ -0,0 +1,150 @@
+# benchmarks/catalog.py
+"""
+Bulk catalog import and export: throughput and memory.
+
+    python -m benchmarks.catalog --rows 100000 1000000 --format csv
+
+Each catalog file has ``--rows`` records: products, each followed by two
+variants and an image. For every size the script reports
+
+``one by one``
+    Product.save() and the variants' and images' create() per record,
+    with their signals, which is what loading the catalog through the
+    API costs before serialization and HTTP. Run on at most
+    ``--baseline-rows`` records.
+``import``
+    manage.py import_catalog into an empty catalog.
+``re-import``
+    The same file again: every record matches and none has changed.
+``update``
+    A file with every price and stock level changed.
+``export``
+    manage.py export_catalog to a file.
+
+``peak RSS MB`` is the process's peak resident memory once the phase has
+run; flat across sizes means memory does not grow with the file.
+Rendering tasks for imported images are dropped rather than run.
+"""
+import argparse
+import os
+import resource
+import tempfile
+import time
+from itertools import islice
+from unittest import mock
+
+from benchmarks.utils import print_table, setup, test_database
+
+CATEGORIES = 20
+
+
+def records(revision=0):
+    index = 0
+    while True:
+        sku = 'SKU-%d' % index
+        yield {
+            'type': 'product', 'sku': sku, 'name': 'Product %d' % index, 'slug': 'product-%d' % index,
+            'category': 'category-%d' % (index % CATEGORIES), 'description': 'Supplier item %d' % index,
+            'price': '%d.99' % (index % 500 + revision), 'weight': '0.50', 'stock_quantity': 100 + revision,
+            'is_active': True,
+        }
+        for size in ('S', 'M'):
+            yield {'type': 'variant', 'product': sku, 'name': 'Size', 'value': size, 'price_adjustment': '0.00',
+                   'stock_quantity': 50 + revision}
+        yield {'type': 'image', 'product': sku, 'image': 'products/%d.jpg' % index, 'is_primary': True}
+        index += 1
+
+
+def write_file(path, count, file_format, revision=0):
+    from apps.products.catalog_io import WRITERS
+
+    with open(path, 'w', newline='') as file:
+        file.writelines(WRITERS[file_format](islice(records(revision), count)))
+
+
+def peak_rss():
+    # Kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def one_by_one(count):
+    from apps.products.models import Category, Product, ProductImage, ProductVariant
+
+    categories = {category.slug: category for category in Category.objects.all()}
+    products = {}
+    start = time.perf_counter()
+    for record in islice(records(), count):
+        kind = record.pop('type')
+        if kind == 'product':
+            record['category'] = categories[record['category']]
+            product = products[record['sku']] = Product(**record)
+            product.save()
+        elif kind == 'variant':
+            ProductVariant.objects.create(product=products[record.pop('product')], **record)
+        else:
+            ProductImage.objects.create(product=products[record.pop('product')], **record)
+    return time.perf_counter() - start
+
+
+def timed(name, count, func):
+    start = time.perf_counter()
+    func()
+    seconds = time.perf_counter() - start
+    return [name, count, seconds, count / seconds, peak_rss()]
+
+
+def run(count, file_format, baseline_rows, directory):
+    from django.core.management import call_command
+    from django.db import connection
+
+    from apps.products.models import Category
+
+    path = os.path.join(directory, 'catalog.%s' % file_format)
+    write_file(path, count, file_format)
+    changed = os.path.join(directory, 'changed.%s' % file_format)
+    write_file(changed, count, file_format, revision=1)
+    rows = []
+    with test_database():
+        Category.objects.bulk_create(
+            Category(name='Category %d' % index, slug='category-%d' % index) for index in range(CATEGORIES)
+        )
+        if baseline_rows:
+            baseline = min(count, baseline_rows)
+            seconds = one_by_one(baseline)
+            rows.append(['one by one', baseline, seconds, baseline / seconds, peak_rss()])
+            with connection.cursor() as cursor:
+                cursor.execute('TRUNCATE products_product CASCADE')
+
+        quiet = open(os.devnull, 'w')
+        rows.append(timed('import', count, lambda: call_command('import_catalog', path, stdout=quiet)))
+        rows.append(timed('re-import', count, lambda: call_command('import_catalog', path, stdout=quiet)))
+        rows.append(timed('update', count, lambda: call_command('import_catalog', changed, stdout=quiet)))
+        export = os.path.join(directory, 'export.%s' % file_format)
+        rows.append(timed('export', count, lambda: call_command('export_catalog', export)))
+        quiet.close()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[100000, 1000000])
+    parser.add_argument('--format', choices=['csv', 'jsonl'], default='csv')
+    parser.add_argument('--baseline-rows', type=int, default=20000)
+    args = parser.parse_args()
+
+    setup()
+    from django.test import override_settings
+
+    rows = []
+    # DEBUG keeps the SQL of the last 9000 queries, which for bulk INSERTs
+    # would be most of the memory measured. Queued renditions are dropped:
+    # there are no image files (and a Mock would keep every call).
+    drop_tasks = mock.patch('celery.app.task.Task.apply_async', lambda *args, **kwargs: None)
+    with override_settings(DEBUG=False), drop_tasks, tempfile.TemporaryDirectory() as directory:
+        for count in args.rows:
+            rows.extend(run(count, args.format, args.baseline_rows, directory))
+    print_table(['phase', 'rows', 'seconds', 'rows/s', 'peak RSS MB'], rows)
+
+
+if __name__ == '__main__':
+    main()
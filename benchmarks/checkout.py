@@ -0,0 +1,127 @@
+# benchmarks/checkout.py
+"""
+Checkout latency with the post-checkout tasks inline versus queued.
+
+    python -m benchmarks.checkout --orders 300 --smtp-ms 50
+
+Each row places ``--orders`` orders of three lines through the Django
+test client in one thread, and reports the request latency.
+
+``no tasks``
+    Checkout with no follow-up work at all.
+``inline``
+    The confirmation email, low-stock check, analytics event and expiry
+    check run inside the request once the order commits. That is eager
+    mode, and it is how checkout behaves without a queue. Sending an
+    email takes ``--smtp-ms`` milliseconds, about one SMTP round trip.
+``outbox``
+    The tasks are stored in the outbox with the order and published
+    after commit onto an in-memory list, so the broker is left out. A
+    Redis publish adds well under a millisecond per task.
+"""
+import argparse
+import time
+from decimal import Decimal
+from unittest import mock
+
+from django.conf import settings
+from django.core.mail.backends.base import BaseEmailBackend
+
+from benchmarks.utils import print_table, setup, test_database
+
+
+class SlowEmailBackend(BaseEmailBackend):
+    def send_messages(self, messages):
+        time.sleep(settings.BENCHMARK_SMTP_SECONDS)
+        return len(messages)
+
+
+def seed():
+    from apps.accounts.models import Address, User
+    from apps.products.models import Category, Product
+
+    user = User.objects.create_user(email='bench@example.com', username='bench', password='secret')
+    address = Address.objects.create(
+        user=user, street_address='1 Bench', city='Lagos', state='LA', phone_number='0'
+    )
+    category = Category.objects.create(name='Bench')
+    products = Product.objects.bulk_create(
+        Product(
+            name='Bench %d' % index, slug='bench-%d' % index, sku='BENCH-%d' % index,
+            category=category, description='', price=Decimal('10.00'), stock_quantity=10 ** 6,
+            weight=Decimal('0.50'),
+        )
+        for index in range(3)
+    )
+    return user, address, products
+
+
+def place_orders(client, address, products, count):
+    body = {
+        'shipping_address_id': address.pk,
+        'items': [{'product_id': product.pk, 'quantity': 1} for product in products],
+    }
+    timings = []
+    for _ in range(count):
+        start = time.perf_counter()
+        response = client.post('/api/orders/orders/', body, format='json')
+        timings.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 201, response.status_code
+    return timings
+
+
+def summary(name, timings):
+    timings = sorted(timings)
+    return [
+        name, len(timings), timings[len(timings) // 2],
+        timings[min(len(timings) - 1, int(len(timings) * 0.99))], timings[-1],
+    ]
+
+
+def run(count, smtp_seconds):
+    from celery import current_app
+    from django.test import override_settings
+    from rest_framework.test import APIClient
+
+    from apps.outbox.models import OutboxMessage
+
+    # Without a broker configured, as here, tasks run eagerly
+    assert current_app.conf.task_always_eager
+
+    user, address, products = seed()
+    client = APIClient()
+    client.force_authenticate(user)
+    rows = []
+    # The test client's host is 'testserver'
+    with override_settings(ALLOWED_HOSTS=['testserver'], EMAIL_BACKEND='benchmarks.checkout.SlowEmailBackend',
+                           BENCHMARK_SMTP_SECONDS=smtp_seconds):
+        # Warm up imports and caches
+        place_orders(client, address, products, 5)
+
+        with mock.patch('apps.orders.views.events.order_placed'):
+            rows.append(summary('no tasks', place_orders(client, address, products, count)))
+
+        rows.append(summary('inline', place_orders(client, address, products, count)))
+
+        queue = []
+        with mock.patch('celery.app.task.Task.apply_async', lambda task, **kwargs: queue.append(task.name)):
+            rows.append(summary('outbox', place_orders(client, address, products, count)))
+        assert len(queue) == 4 * count, len(queue)
+        assert not OutboxMessage.objects.filter(sent_at=None).exists()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--orders', type=int, default=300)
+    parser.add_argument('--smtp-ms', type=float, default=50)
+    args = parser.parse_args()
+
+    setup()
+    with test_database():
+        rows = run(args.orders, args.smtp_ms / 1000)
+    print_table(['mode', 'orders', 'p50 ms', 'p99 ms', 'max ms'], rows)
+
+
+if __name__ == '__main__':
+    main()
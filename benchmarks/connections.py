@@ -0,0 +1,150 @@
+# benchmarks/connections.py
+"""
+What a database connection costs per request under each DATABASE_POOLING
+mode of config/production.py.
+
+    python -m benchmarks.connections --repeat 500 --duration 10
+
+``startup`` times a request's database work in-process, the way Django's
+request_started/request_finished handlers drive it: once on a thread
+that already served a request (gunicorn's sync workers) and once on a
+brand new thread (every request under ASGI). ``requests`` serves the API
+with config.production under gunicorn and uvicorn and measures latency
+over HTTP.
+"""
+import argparse
+import asyncio
+import sys
+import threading
+
+from benchmarks.utils import measure, print_table, setup, test_database
+
+MODES = {
+    'none': {'CONN_MAX_AGE': 0},
+    'persistent': {'CONN_MAX_AGE': 600, 'CONN_HEALTH_CHECKS': True},
+    'pool': {'ENGINE': 'core.db.postgresql_pool', 'CONN_MAX_AGE': 0},
+}
+
+# Persistent connections are per thread, and ASGI serves every request
+# on a new one
+SERVED = {'wsgi': ['none', 'persistent', 'pool'], 'asgi': ['none', 'pool']}
+
+
+def make_wrapper(mode):
+    from django.db import connection
+    from django.db.utils import load_backend
+
+    settings_dict = {
+        **connection.settings_dict, **MODES[mode],
+        'OPTIONS': {'options': '-c statement_timeout=30000'},
+    }
+    if mode == 'pool':
+        settings_dict['OPTIONS']['pool'] = {'MAX_SIZE': 4}
+    return load_backend(settings_dict['ENGINE']).DatabaseWrapper(settings_dict, connection.alias)
+
+
+def request_cycle(wrapper):
+    wrapper.close_if_unusable_or_obsolete()
+    with wrapper.cursor() as cursor:
+        cursor.execute('SELECT 1')
+    wrapper.close_if_unusable_or_obsolete()
+
+
+def on_new_thread(mode):
+    def run():
+        # Each thread gets its own connection handler entry in Django;
+        # a fresh wrapper per call stands in for that
+        wrapper = make_wrapper(mode)
+        request_cycle(wrapper)
+        wrapper.close()
+
+    def call():
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+    return call
+
+
+def startup(repeat):
+    rows = []
+    for mode in MODES:
+        wrapper = make_wrapper(mode)
+        same = measure(lambda: request_cycle(wrapper), repeat=repeat)
+        wrapper.close()
+        new = measure(on_new_thread(mode), repeat=repeat)
+        rows.append([mode, same['median'], same['p95'], new['median'], new['p95']])
+
+    from core.db.postgresql_pool.pool import close_pools
+    close_pools()
+    print_table(
+        ['mode', 'same thread ms', 'same thread p95', 'new thread ms', 'new thread p95'],
+        rows,
+    )
+
+
+def requests(workers, concurrency, duration):
+    from django.conf import settings
+    from django.db import connection, connections
+
+    from benchmarks.serving import load, seed, start_server, stop_server
+
+    slug, session_key = seed(50, 50)
+    connections.close_all()
+    settings_dict = connection.settings_dict
+    env = {
+        'DJANGO_SETTINGS_MODULE': 'config.production',
+        # The seeded session is signed with it
+        'SECRET_KEY': settings.SECRET_KEY,
+        'ALLOWED_HOSTS': '127.0.0.1',
+        'DATABASE_USER': settings_dict['USER'] or '',
+        'DATABASE_PASSWORD': settings_dict['PASSWORD'] or '',
+        'DATABASE_HOST': settings_dict['HOST'] or '',
+        'DATABASE_PORT': str(settings_dict['PORT'] or ''),
+    }
+    endpoints = [
+        ('product detail', '/api/products/products/%s/' % slug, {}),
+        ('order list', '/api/orders/orders/?page_size=20', {'Cookie': 'sessionid=%s' % session_key}),
+    ]
+    rows = []
+    for kind, modes in SERVED.items():
+        for mode in modes:
+            process, base = start_server(
+                kind, workers, settings_dict['NAME'], dict(env, DATABASE_POOLING=mode)
+            )
+            try:
+                for name, path, headers in endpoints:
+                    result = asyncio.run(load(base + path, headers, concurrency, duration, False))
+                    rows.append([
+                        kind, mode, name, result['rps'], result['p50'], result['p99'], result['errors'],
+                    ])
+            finally:
+                stop_server(process)
+
+    print('%d workers each, %d concurrent clients, %ss per endpoint' % (
+        workers, concurrency, duration), file=sys.stderr)
+    print_table(['server', 'mode', 'endpoint', 'req/s', 'p50 ms', 'p99 ms', 'errors'], rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=500)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--skip', nargs='*', default=[], choices=['startup', 'requests'])
+    args = parser.parse_args()
+
+    setup()
+    from django.db import connection
+
+    with test_database():
+        if connection.vendor != 'postgresql':
+            parser.error('needs PostgreSQL')
+        if 'startup' not in args.skip:
+            startup(args.repeat)
+        if 'requests' not in args.skip:
+            requests(args.workers, args.concurrency, args.duration)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+# benchmarks/crypto_watcher.py
+"""
+On-chain payment confirmation with thousands of pending orders.
+
+    python -m benchmarks.crypto_watcher --pending 1000 5000 --blocks 100
+
+Replays a recorded chain of ``--blocks`` blocks of ``--txs`` transfers
+each, into which one deposit for every pending payment is mixed. The
+``watcher`` rows run apps.payments.crypto.Watcher over it. The
+``per-order poll`` rows do what a watcher without the index would: ask
+the node for the balance of every pending deposit address once the
+blocks are final, then settle each paid order on its own. The node is
+in-process in both cases, so the ``rpc calls`` column is what would
+dominate against a real one.
+"""
+import argparse
+import json
+import random
+import tempfile
+import time
+from collections import defaultdict
+from decimal import Decimal
+
+from benchmarks.utils import print_table, setup, test_database
+
+CONFIRMATIONS = 12
+
+
+def seed(count):
+    """``count`` pending crypto payments of a new user, each with its deposit address."""
+    from apps.accounts.models import Address, User
+    from apps.orders.models import Order
+    from apps.payments.models import DepositAddress, Payment
+
+    run = User.objects.count()
+    user = User.objects.create_user(email='bench%d@example.com' % run, username='bench%d' % run)
+    address = Address.objects.create(
+        user=user, street_address='1 Bench', city='Lagos', state='LA', phone_number='0'
+    )
+    orders = Order.objects.bulk_create(
+        Order(
+            user=user, shipping_address=address, order_number='CW%d-%d' % (run, index),
+            payment_method='CRYPTO', subtotal=Decimal('10.00'), shipping_cost=Decimal('5.00'),
+            total_amount=Decimal('15.00'),
+        )
+        for index in range(count)
+    )
+    payments = Payment.objects.bulk_create(
+        Payment(order=order, provider='crypto', method='CRYPTO', amount=order.total_amount, currency='NGN')
+        for order in orders
+    )
+    deposits = DepositAddress.objects.bulk_create(
+        DepositAddress(
+            address='0x%08x%032x' % (run, index), payment=payment,
+            expected_wei=15 * 10 ** 12, assigned_at=payment.created_at,
+        )
+        for index, payment in enumerate(payments)
+    )
+    return user, deposits
+
+
+def record(deposits, blocks, txs, path):
+    rng = random.Random(0)
+    transfers = defaultdict(list)
+    for deposit in deposits:
+        transfers[rng.randint(1, blocks)].append((deposit.address, int(deposit.expected_wei)))
+    with open(path, 'w') as file:
+        for number in range(1, blocks + CONFIRMATIONS):
+            block = transfers.get(number, [])
+            block += [('0x%040x' % rng.getrandbits(160), 10 ** 17) for _ in range(max(0, txs - len(block)))]
+            file.write(json.dumps({
+                'number': number,
+                'transactions': [
+                    {'hash': '0x%d-%d' % (number, index), 'to': to, 'value': value}
+                    for index, (to, value) in enumerate(block)
+                ],
+            }) + '\n')
+
+
+class CountingChain:
+    def __init__(self, chain):
+        self.chain = chain
+        self.calls = 0
+        self.balances = None
+
+    def head(self):
+        self.calls += 1
+        return self.chain.head()
+
+    def block(self, number):
+        self.calls += 1
+        return self.chain.block(number)
+
+    def balance(self, address, block):
+        self.calls += 1
+        if self.balances is None:
+            self.balances = defaultdict(int)
+            for number in range(1, block + 1):
+                for tx in self.chain.block(number)['transactions']:
+                    self.balances[tx['to'].lower()] += int(tx['value'])
+        return self.balances[address.lower()]
+
+
+def watcher(chain):
+    from apps.payments.crypto import Watcher
+    from apps.payments.models import ChainCursor
+
+    ChainCursor.objects.update_or_create(name='bench', defaults={'block': 0})
+    Watcher(chain, cursor='bench', confirmations=CONFIRMATIONS).run(once=True)
+
+
+def per_order_poll(chain):
+    from apps.payments.models import DepositAddress, Payment
+    from apps.payments.webhooks import apply_status
+    from django.db import transaction
+
+    final = chain.head() - CONFIRMATIONS + 1
+    for deposit in DepositAddress.objects.filter(payment__status=Payment.PENDING).select_related('payment'):
+        if chain.balance(deposit.address, final) >= deposit.expected_wei:
+            with transaction.atomic():
+                apply_status(deposit.payment, Payment.SUCCEEDED)
+
+
+def run(pending, blocks, txs):
+    from django.db import connection
+
+    from apps.orders.models import Order
+    from apps.payments.crypto import RecordedChain
+
+    rows = []
+    for name, strategy in [('watcher', watcher), ('per-order poll', per_order_poll)]:
+        user, deposits = seed(pending)
+        with tempfile.NamedTemporaryFile(suffix='.jsonl') as file:
+            record(deposits, blocks, txs, file.name)
+            chain = CountingChain(RecordedChain(file.name))
+        queries = []
+
+        def count(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        start = time.perf_counter()
+        with connection.execute_wrapper(count):
+            strategy(chain)
+        elapsed = time.perf_counter() - start
+        paid = Order.objects.filter(user=user, status='PAID').count()
+        assert paid == pending, (name, paid)
+        rows.append([
+            pending, name, elapsed * 1000, pending / elapsed, chain.calls, len(queries),
+        ])
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pending', type=int, nargs='+', default=[1000, 5000])
+    parser.add_argument('--blocks', type=int, default=100)
+    parser.add_argument('--txs', type=int, default=200, help='Transfers per block')
+    args = parser.parse_args()
+
+    setup()
+    rows = []
+    with test_database():
+        for pending in args.pending:
+            rows.extend(run(pending, args.blocks, args.txs))
+    print_table(['pending', 'strategy', 'total ms', 'orders/s', 'rpc calls', 'queries'], rows)
+
+
+if __name__ == '__main__':
+    main()
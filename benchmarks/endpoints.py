@@ -0,0 +1,202 @@
+# benchmarks/endpoints.py
+"""
+API endpoints against a seeded database, compared with a stored baseline.
+
+    python -m benchmarks.endpoints --products 100000 --orders 200000 --save-baseline
+    python -m benchmarks.endpoints --products 100000 --orders 200000
+
+The throwaway database is filled by manage.py seed with the given scale,
+then each endpoint is requested through the test client, as the seeded
+user with the most orders:
+
+``products list``, ``products search``, ``product detail``, ``categories root``
+    The catalog reads, each with a throwaway query param so the response
+    cache never answers them.
+``orders list``, ``orders with lines``, ``orders pending``, ``users me``
+    The user's own reads; ``orders with lines`` is the order list with
+    ``?expand=items``.
+``order create``
+    A three line checkout, each from different products.
+
+For every endpoint the script reports latency, the queries one request
+runs and the peak memory Python allocated while serving it. With
+``--save-baseline`` the results are written to ``--baseline``;
+otherwise they are compared with it, and the script exits with status 1
+if any endpoint runs more queries than the baseline, or is slower or
+allocates more by over ``--tolerance`` (memory) or ``--latency-tolerance``.
+Latency depends on the machine, so only compare baselines saved on the
+one running the comparison; a baseline of a different scale is not
+compared with. Tasks queued by checkouts are dropped rather than run.
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import tracemalloc
+from unittest import mock
+
+from benchmarks.utils import measure, print_table, setup, test_database
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baselines', 'endpoints.json')
+SCALE = ['depth', 'breadth', 'products', 'users', 'orders']
+
+
+def cases(client, counter):
+    """{name: (request function, expected status)} of the benchmarked endpoints."""
+    from django.db.models import Count
+
+    from apps.orders.models import Order
+    from apps.seeding.seeding import NOUNS
+    from apps.products.models import Product
+
+    user_id = Order.objects.values('user').annotate(orders=Count('id')).order_by('-orders')[0]['user']
+    address = Order.objects.filter(user_id=user_id).values_list('shipping_address', flat=True)[0]
+    product = Product.objects.filter(is_active=True, variants__isnull=False).order_by('id').first()
+    basket = list(Product.objects.filter(is_active=True).order_by('-stock_quantity').values_list('id', flat=True)[:99])
+
+    from apps.accounts.models import User
+    client.force_login(User.objects.get(pk=user_id))
+
+    def get(path, **params):
+        return lambda: client.get(path, {**params, '_': next(counter)})
+
+    def checkout():
+        start = next(counter) % (len(basket) // 3) * 3
+        items = [{'product_id': product_id, 'quantity': 1} for product_id in basket[start:start + 3]]
+        return client.post(
+            '/api/orders/orders/', {'shipping_address_id': address, 'items': items}, content_type='application/json'
+        )
+
+    return {
+        'products list': (get('/api/products/products/'), 200),
+        'products search': (get('/api/products/products/', search=NOUNS[0]), 200),
+        'product detail': (get('/api/products/products/%s/' % product.slug), 200),
+        'categories root': (get('/api/products/categories/root/'), 200),
+        'orders list': (get('/api/orders/orders/'), 200),
+        'orders with lines': (get('/api/orders/orders/', expand='items'), 200),
+        'orders pending': (get('/api/orders/orders/pending/'), 200),
+        'users me': (get('/api/accounts/users/me/'), 200),
+        'order create': (checkout, 201),
+    }
+
+
+def probe(name, request, expected):
+    """(queries, peak KB) of one request."""
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    with CaptureQueriesContext(connection) as ctx:
+        response = request()
+    if response.status_code != expected:
+        sys.exit('%s: expected %d, got %d: %s' % (name, expected, response.status_code, response.content[:500]))
+    # The next request clears the query log the context reads from
+    queries = len(ctx.captured_queries)
+    tracemalloc.start()
+    try:
+        request()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return queries, peak / 1024
+
+
+def run(args):
+    from django.core.management import call_command
+    from django.test import Client
+
+    results = {}
+    with test_database():
+        call_command('seed', stdout=open(os.devnull, 'w'), **{name: getattr(args, name) for name in SCALE})
+        client = Client()
+        for name, (request, expected) in cases(client, itertools.count()).items():
+            queries, peak = probe(name, request, expected)
+            timings = measure(request, repeat=args.repeat, warmup=args.warmup)
+            results[name] = {**timings, 'queries': queries, 'peak_kb': peak}
+    return results
+
+
+def change(value, baseline):
+    return (value - baseline) / baseline if baseline else 0.0
+
+
+def compare(results, baseline, args):
+    """Table rows of ``results`` against ``baseline``, and whether any regressed."""
+    rows, regressed = [], False
+    for name, result in results.items():
+        row = [name, result['median'], result['p95'], result['queries'], result['peak_kb']]
+        before = baseline.get(name)
+        if before is None:
+            rows.append(row + ['', '', '', 'new'])
+            continue
+        latency = change(result['median'], before['median'])
+        memory = change(result['peak_kb'], before['peak_kb'])
+        queries = result['queries'] - before['queries']
+        failures = [
+            label for label, failed in [
+                ('queries', queries > 0),
+                ('latency', latency > args.latency_tolerance),
+                ('memory', memory > args.tolerance),
+            ] if failed
+        ]
+        regressed = regressed or bool(failures)
+        rows.append(row + [
+            '%+.0f%%' % (latency * 100), '%+d' % queries, '%+.0f%%' % (memory * 100),
+            'REGRESSED: %s' % ', '.join(failures) if failures else 'ok',
+        ])
+    return rows, regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--breadth', type=int, default=5)
+    parser.add_argument('--products', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--orders', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--latency-tolerance', type=float, default=0.3,
+                        help='Slowdown of the median allowed, as a fraction')
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help='Growth of peak memory allowed, as a fraction')
+    args = parser.parse_args()
+
+    setup()
+    from django.test import override_settings
+
+    # Measure what production runs: no DEBUG query log, no profiling
+    serving = override_settings(DEBUG=False, ALLOWED_HOSTS=['testserver'], PROFILING={'SAMPLE_RATE': 0})
+    drop_tasks = mock.patch('celery.app.task.Task.apply_async', lambda *args, **kwargs: None)
+    with serving, drop_tasks:
+        results = run(args)
+    scale = {name: getattr(args, name) for name in SCALE}
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, 'w') as file:
+            json.dump({'scale': scale, 'results': results}, file, indent=2, sort_keys=True)
+    baseline = {}
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            stored = json.load(file)
+        if stored['scale'] == scale:
+            baseline = stored['results']
+        else:
+            print('Baseline is of a different scale (%s); not compared' % stored['scale'], file=sys.stderr)
+
+    rows, regressed = compare(results, baseline, args)
+    print_table(
+        ['endpoint', 'median ms', 'p95 ms', 'queries', 'peak KB', 'median change', 'query change',
+         'memory change', 'vs baseline'],
+        rows,
+    )
+    if args.save_baseline:
+        print('\nSaved baseline to %s' % args.baseline)
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+# benchmarks/images.py
+"""
+Product image renditions: processing time per upload and bytes saved.
+
+    python -m benchmarks.images --sizes 1600x1200 4000x3000 --repeat 5
+
+Originals are synthetic photos (gradients, shapes and sensor-like noise)
+saved as quality 92 JPEGs, about what a camera or phone uploads.
+``pipeline`` is apps.products.images.render with the configured sizes
+and formats: JPEG decoded at reduced scale, each size scaled from the
+next larger one. ``from original`` decodes the full image and scales
+every size from it, for comparison. The second table compares each
+rendition's bytes with the original's, which is what a catalog page
+downloaded before renditions existed.
+"""
+import argparse
+import random
+import statistics
+import tempfile
+import time
+from io import BytesIO
+
+from benchmarks.utils import print_table, setup
+
+
+def photo(width, height, seed=0):
+    from PIL import Image, ImageDraw, ImageFilter
+
+    rng = random.Random(seed)
+    image = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    draw = ImageDraw.Draw(image)
+    for _ in range(40):
+        x, y = rng.randrange(width), rng.randrange(height)
+        radius = rng.randint(width // 40, width // 6)
+        colour = tuple(rng.randrange(256) for _ in range(3))
+        draw.ellipse((x - radius, y - radius, x + radius, y + radius), fill=colour)
+    image = image.filter(ImageFilter.GaussianBlur(2))
+    noise = Image.effect_noise((width, height), 64).convert('RGB')
+    image = Image.blend(image, noise, 0.2)
+    buffer = BytesIO()
+    image.save(buffer, 'JPEG', quality=92)
+    return buffer.getvalue()
+
+
+def from_original(file, config, storage):
+    from PIL import Image, ImageOps
+
+    from apps.products.images import encode, store
+
+    with Image.open(file) as original:
+        image = ImageOps.exif_transpose(original).convert('RGB')
+    for width in config['SIZES'].values():
+        resized = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+        for image_format, options in config['FORMATS'].items():
+            store(encode(resized, image_format, options), width, image_format, config['PATH'], storage)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', nargs='+', default=['1600x1200', '3000x2000', '4000x3000'])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    setup()
+    from django.core.files.storage import FileSystemStorage
+
+    from apps.products.images import get_config, render
+
+    config = get_config()
+    timings, savings = [], []
+    for size in args.sizes:
+        width, height = map(int, size.split('x'))
+        data = photo(width, height)
+        for name, strategy in [('pipeline', render), ('from original', from_original)]:
+            runs = []
+            for _ in range(args.repeat):
+                with tempfile.TemporaryDirectory() as media:
+                    storage = FileSystemStorage(location=media)
+                    start = time.perf_counter()
+                    renditions = strategy(BytesIO(data), config, storage)
+                    runs.append((time.perf_counter() - start) * 1000)
+                    if strategy is render:
+                        files = {
+                            label: {key: storage.size(rendition[key]) for key in config['FORMATS']}
+                            for label, rendition in renditions.items()
+                        }
+            timings.append([size, len(data) // 1024, name, statistics.median(runs), min(runs)])
+        for label, rendition in files.items():
+            savings.append([
+                size, label, rendition['webp'] / 1024, rendition['jpeg'] / 1024,
+                100 * (1 - rendition['webp'] / len(data)),
+            ])
+
+    print_table(['original', 'KB', 'strategy', 'median ms', 'min ms'], timings)
+    print()
+    print_table(['original', 'size', 'webp KB', 'jpeg KB', 'webp saves %'], savings)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+# benchmarks/search.py
+"""
+Product search latency: the old icontains scan against the search backends.
+
+    python -m benchmarks.search --sizes 10000 100000 1000000
+
+Sizes are cumulative, so the catalog is seeded once and grown between
+rounds. The in-process index holds every posting in memory; leave it out
+of very large runs with ``--backends icontains postgres``.
+"""
+import argparse
+import random
+import time
+from decimal import Decimal
+
+from benchmarks.utils import measure, print_table, setup, test_database
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'ti', 'vo', 'ze', 'ba', 'do', 'fu', 'gi', 'ha', 'je']
+
+
+def build_vocabulary(rng, size=5000):
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def seed_products(category, start, stop, vocabulary, rng, batch_size=5000):
+    from apps.products.models import Product
+
+    # Zipf-like skew so some words are common and most are rare
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    for offset in range(start, stop, batch_size):
+        batch = []
+        for index in range(offset, min(offset + batch_size, stop)):
+            name = ' '.join(rng.choices(vocabulary, weights, k=3))
+            batch.append(Product(
+                sku='B%011d' % index, slug='product-%d' % index, name=name,
+                description=' '.join(rng.choices(vocabulary, weights, k=30)),
+                category=category, price=Decimal('9.99'), stock_quantity=1,
+                weight=Decimal('1.00'),
+            ))
+        Product.objects.bulk_create(batch)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--backends', nargs='+', default=['icontains', 'postgres', 'inverted-index'])
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    setup()
+    from django.db import connection
+    from django.db.models import Q
+
+    from apps.products.models import Category, Product
+    from apps.products.search import (InvertedIndexSearchBackend, PostgresSearchBackend,
+                                      invalidate_search_index)
+
+    backends = {
+        'icontains': lambda qs, term: qs.filter(Q(name__icontains=term) | Q(description__icontains=term)),
+        'postgres': PostgresSearchBackend().search,
+        'inverted-index': InvertedIndexSearchBackend().search,
+    }
+
+    rng = random.Random(42)
+    vocabulary = build_vocabulary(rng)
+    # A common word, a mid-frequency word, a rare word and a two word query
+    terms = [vocabulary[0], vocabulary[50], vocabulary[4000], '%s %s' % (vocabulary[1], vocabulary[10])]
+
+    rows = []
+    with test_database():
+        if connection.vendor != 'postgresql' and 'postgres' in args.backends:
+            args.backends.remove('postgres')
+        category = Category.objects.create(name='Benchmark')
+        seeded = 0
+        for size in sorted(args.sizes):
+            seed_products(category, seeded, size, vocabulary, rng)
+            seeded = size
+            # bulk_create skips the post_save hook that normally does this
+            invalidate_search_index()
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute('ANALYZE products_product')
+
+            for name in args.backends:
+                search = backends[name]
+                if name == 'inverted-index':
+                    start = time.perf_counter()
+                    InvertedIndexSearchBackend.get_index()
+                    rows.append([size, name, 'index build', (time.perf_counter() - start) * 1000, '', ''])
+                for term in terms:
+                    queryset = Product.objects.all()
+                    stats = measure(
+                        lambda: list(search(queryset, term).values_list('pk', flat=True)[:50]),
+                        repeat=args.repeat,
+                    )
+                    rows.append([size, name, term, stats['median'], stats['p95'], stats['max']])
+
+    print_table(['products', 'backend', 'query', 'median ms', 'p95 ms', 'max ms'], rows)
+
+
+if __name__ == '__main__':
+    main()
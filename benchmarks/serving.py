@@ -0,0 +1,190 @@
+# benchmarks/serving.py
+"""
+Read throughput under sync WSGI (gunicorn) and async ASGI (uvicorn).
+
+    python -m benchmarks.serving --workers 2 --concurrency 32 --duration 10
+
+Both servers run the same code with the same number of worker processes
+against a seeded throwaway database, and are driven by the same asyncio
+load generator. Every request carries a unique throwaway query param so
+the response cache never answers it; pass ``--cached`` to measure cache
+hits instead. The load generator shares the machine with the servers, so
+compare the two columns rather than reading the absolute numbers.
+
+Uses gunicorn, uvicorn and aiohttp from requirements.txt.
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from decimal import Decimal
+
+from benchmarks.utils import print_table, setup, test_database
+
+SERVERS = {
+    'wsgi': ['gunicorn', 'config.wsgi:application', '--workers', '{workers}',
+             '--bind', '127.0.0.1:{port}', '--log-level', 'warning'],
+    'asgi': ['uvicorn', 'config.asgi:application', '--workers', '{workers}',
+             '--port', '{port}', '--log-level', 'warning', '--no-access-log'],
+}
+
+
+def seed(products, orders):
+    from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+    from django.contrib.sessions.backends.db import SessionStore
+
+    from apps.accounts.models import Address, User
+    from apps.orders.models import Order, OrderItem
+    from apps.products.models import Category, Product, ProductImage, ProductVariant
+
+    parent = Category.objects.create(name='Electronics')
+    categories = [Category.objects.create(name='Sub %d' % i, parent=parent) for i in range(5)]
+    catalog = []
+    for index in range(products):
+        product = Product.objects.create(
+            name='Product %d' % index, category=categories[index % 5], description='Benchmark',
+            price=Decimal('10.00'), stock_quantity=100, weight=Decimal('1.00'),
+        )
+        ProductImage.objects.create(product=product, image='products/%d.jpg' % index, is_primary=True)
+        ProductVariant.objects.create(product=product, name='Size', value='M', stock_quantity=10)
+        catalog.append(product)
+
+    user = User.objects.create_user(email='bench@example.com', username='bench', password='secret')
+    address = Address.objects.create(
+        user=user, street_address='1 Bench', city='Lagos', state='LA', phone_number='0'
+    )
+    for index in range(orders):
+        order = Order.objects.create(user=user, shipping_address=address, shipping_cost=Decimal('5.00'))
+        OrderItem.objects.create(order=order, product=catalog[index % len(catalog)], quantity=1, price=Decimal('10.00'))
+
+    session = SessionStore()
+    session[SESSION_KEY] = str(user.pk)
+    session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.create()
+    return catalog[0].slug, session.session_key
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(kind, workers, database, env=None):
+    port = free_port()
+    command = [part.format(workers=workers, port=port) for part in SERVERS[kind]]
+    env = dict(os.environ, DATABASE_NAME=database, **(env or {}))
+    process = subprocess.Popen(command, env=env, start_new_session=True)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return process, 'http://127.0.0.1:%d' % port
+        except OSError:
+            time.sleep(0.2)
+    stop_server(process)
+    raise RuntimeError('%s server did not start' % kind)
+
+
+def stop_server(process):
+    os.killpg(process.pid, signal.SIGTERM)
+    process.wait(timeout=30)
+
+
+async def load(url, headers, concurrency, duration, cached):
+    import aiohttp
+
+    counter = itertools.count()
+    timings, errors = [], 0
+    separator = '&' if '?' in url else '?'
+
+    async def client(session, stop_at):
+        nonlocal errors
+        while time.perf_counter() < stop_at:
+            target = url if cached else '%s%s_=%d' % (url, separator, next(counter))
+            start = time.perf_counter()
+            async with session.get(target, headers=headers) as response:
+                await response.read()
+                if response.status != 200:
+                    errors += 1
+            timings.append((time.perf_counter() - start) * 1000)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        # Warm every worker's connections and caches first
+        warm_until = time.perf_counter() + 2
+        await asyncio.gather(*(client(session, warm_until) for _ in range(concurrency)))
+        timings.clear()
+        errors = 0
+        start = time.perf_counter()
+        await asyncio.gather(*(client(session, start + duration) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    timings.sort()
+    return {
+        'rps': len(timings) / elapsed,
+        'p50': timings[len(timings) // 2],
+        'p99': timings[min(len(timings) - 1, int(len(timings) * 0.99))],
+        'errors': errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--products', type=int, default=200)
+    parser.add_argument('--orders', type=int, default=100)
+    parser.add_argument('--cached', action='store_true')
+    args = parser.parse_args()
+
+    setup()
+    from django.db import connection, connections
+
+    rows = []
+    with test_database():
+        slug, session_key = seed(args.products, args.orders)
+        connections.close_all()
+        cookie = {'Cookie': 'sessionid=%s' % session_key}
+        endpoints = [
+            ('product list', '/api/products/products/?page_size=20', {}),
+            ('product detail', '/api/products/products/%s/' % slug, {}),
+            ('category root', '/api/products/categories/root/', {}),
+            ('order list', '/api/orders/orders/?page_size=20', cookie),
+        ]
+        results = {}
+        for kind in SERVERS:
+            process, base = start_server(kind, args.workers, connection.settings_dict['NAME'])
+            try:
+                for name, path, headers in endpoints:
+                    results[kind, name] = asyncio.run(
+                        load(base + path, headers, args.concurrency, args.duration, args.cached)
+                    )
+            finally:
+                stop_server(process)
+
+        for name, _, _ in endpoints:
+            wsgi, asgi = results['wsgi', name], results['asgi', name]
+            rows.append([
+                name, wsgi['rps'], asgi['rps'], wsgi['p50'], asgi['p50'],
+                wsgi['p99'], asgi['p99'], wsgi['errors'] + asgi['errors'],
+            ])
+
+    print('%d workers each, %d concurrent clients, %ss per endpoint' % (
+        args.workers, args.concurrency, args.duration), file=sys.stderr)
+    print_table(
+        ['endpoint', 'wsgi req/s', 'asgi req/s', 'wsgi p50 ms', 'asgi p50 ms',
+         'wsgi p99 ms', 'asgi p99 ms', 'errors'],
+        rows,
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+# benchmarks/shipping.py
+"""
+Shipping quote latency: compiled rate tables versus reading them directly.
+
+    python -m benchmarks.shipping --quotes 200000 --carts 100
+
+``compiled`` is apps.shipping.rates: zones, weight brackets and prices
+flattened into arrays once, so a quote is index arithmetic. ``tables``
+prices from apps/shipping/tables.py as written, with a region lookup
+per state, a neighbour check and a bisect over the weight brackets.
+Both quote the same random (weight, destination) pairs. ``bulk api``
+posts carts of 5 items to /api/shipping/quotes/ through the Django test
+client, ``--carts`` at a time.
+"""
+import argparse
+import random
+import time
+from bisect import bisect_left
+from decimal import ROUND_CEILING, Decimal
+
+from benchmarks.utils import print_table, setup, test_database
+
+
+class TableQuoter:
+    def __init__(self, tables, origin):
+        self.tables = tables
+        self.origin = origin
+        self.region_of = {state: region for region, states in tables.REGIONS.items() for state in states}
+        self.neighbours = {frozenset(pair) for pair in tables.NEIGHBOURS}
+        self.limits = [Decimal(bracket) for bracket in tables.BRACKETS]
+
+    def quote(self, weight, destination):
+        source, target = self.region_of[self.origin], self.region_of[destination]
+        if self.origin == destination:
+            zone = 0
+        elif source == target:
+            zone = 1
+        elif frozenset([source, target]) in self.neighbours:
+            zone = 2
+        else:
+            zone = 3
+        weight = (weight * 10).to_integral_value(ROUND_CEILING) / 10
+        if weight <= self.limits[-1]:
+            return Decimal(self.tables.RATES[zone][bisect_left(self.limits, weight)]).quantize(Decimal('0.01'))
+        over = (weight - self.limits[-1]).to_integral_value(ROUND_CEILING)
+        return Decimal(self.tables.RATES[zone][-1] + over * self.tables.EXTRA_PER_KG[zone]).quantize(Decimal('0.01'))
+
+
+def time_quotes(quote, pairs):
+    start = time.perf_counter()
+    costs = [quote(weight, state) for weight, state in pairs]
+    return time.perf_counter() - start, costs
+
+
+def bulk_api(count, carts):
+    from django.test import Client, override_settings
+
+    from apps.accounts.models import Address
+    from apps.products.models import Category, Product
+
+    rng = random.Random(1)
+    category = Category.objects.create(name='Bench')
+    products = Product.objects.bulk_create(
+        Product(
+            name='Bench %d' % index, slug='bench-%d' % index, sku='BENCH-%d' % index,
+            category=category, description='', price=Decimal('10.00'), stock_quantity=100, weight=Decimal(rng.randint(1, 2000)) / 100,
+        )
+        for index in range(500)
+    )
+    states = [code for code, _ in Address.STATES]
+    body = {'carts': [
+        {
+            'state': rng.choice(states),
+            'items': [{'product_id': rng.choice(products).pk, 'quantity': rng.randint(1, 3)} for _ in range(5)],
+        }
+        for _ in range(carts)
+    ]}
+
+    client = Client()
+    requests = max(1, count // carts)
+    # The test client's host is 'testserver'
+    with override_settings(ALLOWED_HOSTS=['testserver']):
+        start = time.perf_counter()
+        for _ in range(requests):
+            response = client.post('/api/shipping/quotes/', body, content_type='application/json')
+            assert response.status_code == 200, response.status_code
+        elapsed = time.perf_counter() - start
+    return requests * carts, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--quotes', type=int, default=200000)
+    parser.add_argument('--carts', type=int, default=100, help='Carts per bulk request')
+    args = parser.parse_args()
+
+    setup()
+    from apps.accounts.models import Address
+    from apps.shipping import tables
+    from apps.shipping.rates import get_config, get_rate_table
+
+    rng = random.Random(0)
+    states = [code for code, _ in Address.STATES]
+    pairs = [(Decimal(rng.randint(0, 8000)) / 100, rng.choice(states)) for _ in range(args.quotes)]
+
+    start = time.perf_counter()
+    table = get_rate_table()
+    load = time.perf_counter() - start
+
+    rows = []
+    compiled, expected = time_quotes(table.quote, pairs)
+    direct, costs = time_quotes(TableQuoter(tables, get_config()['ORIGIN']).quote, pairs)
+    assert costs == expected
+    for name, elapsed in [('compiled', compiled), ('tables', direct)]:
+        rows.append([name, len(pairs), len(pairs) / elapsed, elapsed / len(pairs) * 10 ** 6])
+
+    with test_database():
+        quoted, elapsed = bulk_api(min(args.quotes, 20000), args.carts)
+    rows.append(['bulk api', quoted, quoted / elapsed, elapsed / quoted * 10 ** 6])
+
+    print('Rate tables compiled in %.2f ms' % (load * 1000))
+    print_table(['quoter', 'quotes', 'quotes/s', 'us/quote'], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+# benchmarks/stock.py
+"""
+Checkout contention: many processes buying the same few products.
+
+    python -m benchmarks.stock --processes 16 --attempts 200 --stock 500
+
+Every worker places baskets of two or three of the hot products, listed
+in random order so lock ordering matters. ``reserve`` uses the inventory
+engine; ``naive`` reads the stock, checks it in Python and saves, which
+is what checkout would do without it. A run passes when the units sold
+of each product equal the drop in its stock and never exceed what was
+there. Needs PostgreSQL; SQLite serializes writers anyway.
+"""
+import argparse
+import multiprocessing
+import random
+import time
+from collections import Counter
+from decimal import Decimal
+
+from benchmarks.utils import print_table, setup, test_database
+
+
+def naive_take(items):
+    from apps.products.models import Product
+
+    # Written in id order so the run measures lost updates, not deadlocks
+    items = sorted(items)
+    for product_id, quantity in items:
+        product = Product.objects.get(pk=product_id)
+        if product.stock_quantity < quantity:
+            raise ValueError('sold out')
+    for product_id, quantity in items:
+        product = Product.objects.get(pk=product_id)
+        product.stock_quantity -= quantity
+        product.save(update_fields=['stock_quantity'])
+
+
+def worker(args):
+    mode, seed, attempts, product_ids, user_id, address_id = args
+    from django.db import DatabaseError, connections, transaction
+
+    from apps.orders.inventory import InsufficientStock, reserve_stock
+    from apps.orders.models import Order, OrderItem
+
+    rng = random.Random(seed)
+    sold, failed, errors, timings = Counter(), 0, 0, []
+    try:
+        for _ in range(attempts):
+            items = [(pk, rng.randint(1, 3)) for pk in rng.sample(product_ids, rng.randint(2, 3))]
+            start = time.perf_counter()
+            try:
+                with transaction.atomic():
+                    if mode == 'naive':
+                        naive_take(items)
+                    else:
+                        order = Order.objects.create(
+                            user_id=user_id, shipping_address_id=address_id,
+                            shipping_cost=Decimal('0.00'), total_amount=Decimal('0.00'),
+                        )
+                        reserve_stock(order, [
+                            OrderItem(product_id=pk, quantity=quantity, price=Decimal('1.00'))
+                            for pk, quantity in items
+                        ])
+                sold.update(dict(items))
+            except (InsufficientStock, ValueError):
+                failed += 1
+            except DatabaseError:
+                # Deadlocks, and the stock >= 0 check when naive goes negative
+                errors += 1
+            timings.append((time.perf_counter() - start) * 1000)
+    finally:
+        connections.close_all()
+    return sold, failed, errors, timings
+
+
+def run(mode, processes, attempts, stock, products):
+    from django.db import connections
+
+    from apps.accounts.models import Address, User
+    from apps.orders.models import Order, StockReservation
+    from apps.products.models import Category, Product
+
+    StockReservation.objects.all().delete()
+    Order.objects.all().delete()
+    Product.objects.all().delete()
+    category = Category.objects.get_or_create(name='Benchmark')[0]
+    hot = [
+        Product.objects.create(
+            name='Hot %d' % index, category=category, description='Flash sale',
+            price=Decimal('1.00'), stock_quantity=stock, weight=Decimal('1.00'),
+        )
+        for index in range(products)
+    ]
+    user = User.objects.get_or_create(email='bench@example.com', username='bench')[0]
+    address = Address.objects.get_or_create(
+        user=user, street_address='1 Bench', city='Lagos', state='LA', phone_number='0'
+    )[0]
+    product_ids = [product.pk for product in hot]
+    connections.close_all()
+
+    context = multiprocessing.get_context('fork')
+    start = time.perf_counter()
+    with context.Pool(processes) as pool:
+        results = pool.map(worker, [
+            (mode, seed, attempts, product_ids, user.pk, address.pk) for seed in range(processes)
+        ])
+    elapsed = time.perf_counter() - start
+
+    sold, failed, errors, timings = Counter(), 0, 0, []
+    for worker_sold, worker_failed, worker_errors, worker_timings in results:
+        sold.update(worker_sold)
+        failed += worker_failed
+        errors += worker_errors
+        timings.extend(worker_timings)
+    timings.sort()
+
+    remaining = dict(Product.objects.filter(pk__in=product_ids).values_list('pk', 'stock_quantity'))
+    oversold = sum(max(0, sold[pk] - stock) for pk in product_ids)
+    consistent = all(sold[pk] == stock - remaining[pk] for pk in product_ids)
+    return [
+        mode, processes * attempts, processes * attempts - failed - errors, failed, errors,
+        sum(sold.values()), oversold, 'yes' if consistent else 'NO',
+        processes * attempts / elapsed, timings[len(timings) // 2],
+        timings[min(len(timings) - 1, int(len(timings) * 0.99))],
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--processes', type=int, default=16)
+    parser.add_argument('--attempts', type=int, default=200)
+    parser.add_argument('--stock', type=int, default=500)
+    parser.add_argument('--products', type=int, default=5)
+    parser.add_argument('--modes', nargs='+', default=['naive', 'reserve'])
+    args = parser.parse_args()
+
+    setup()
+    from django.db import connection
+
+    rows = []
+    with test_database():
+        if connection.vendor != 'postgresql':
+            parser.error('needs PostgreSQL')
+        for mode in args.modes:
+            rows.append(run(mode, args.processes, args.attempts, args.stock, args.products))
+
+    print_table(
+        ['mode', 'attempts', 'ok', 'sold out', 'db errors', 'units sold', 'oversold',
+         'stock matches', 'checkouts/s', 'median ms', 'p99 ms'],
+        rows,
+    )
+
+
+if __name__ == '__main__':
+    main()
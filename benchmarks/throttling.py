@@ -0,0 +1,135 @@
+# benchmarks/throttling.py
+"""
+Cost of throttling: per check, and per request to a catalog endpoint.
+
+    python -m benchmarks.throttling --checks 20000 --threads 1 8
+
+The first table times throttle checks on their own, from one thread and
+from several at once:
+
+``in-process``
+    core.throttling with no Redis, the sliding window counters.
+``redis``
+    core.throttling's token bucket script, when REDIS_URL is set.
+``drf cache``
+    DRF's stock AnonRateThrottle on the configured cache, which reads
+    and rewrites the list of recent request times on every check.
+
+The second table times anonymous product detail requests through the
+test client with and without CatalogRateThrottle, against a small seeded
+catalog, at a rate high enough that none is refused. The checks use the
+default catalog rate, so most of them are refusals, which cost the same
+as allowed checks. DRF's list of request times stays as long as the
+rate allows.
+"""
+import argparse
+import itertools
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.utils import print_table, setup, test_database
+
+# Rate of the throttle checks, and of the requests, which must all pass
+CHECK_RATE = '300/min'
+RATE = '1000000000/min'
+
+
+def check_rate(throttle_class, checks, threads):
+    from rest_framework.request import Request
+    from rest_framework.test import APIRequestFactory
+
+    factory = APIRequestFactory()
+    requests = [Request(factory.get('/', REMOTE_ADDR='10.0.%d.%d' % (i // 250, i % 250))) for i in range(threads)]
+
+    def work(request):
+        for _ in range(checks // threads):
+            throttle_class().allow_request(request, None)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(work, requests))
+    seconds = time.perf_counter() - start
+    return checks / seconds, seconds / checks * 1e6
+
+
+def limiters():
+    from django.test import override_settings
+    from rest_framework.throttling import AnonRateThrottle
+
+    from core.throttling import CatalogRateThrottle
+
+    class DRFCacheThrottle(AnonRateThrottle):
+        # Rates are read once at import; this one is read when built
+        def get_rate(self):
+            return CHECK_RATE
+
+    yield 'in-process', override_settings(THROTTLING={'REDIS_URL': None}), CatalogRateThrottle
+    if os.getenv('REDIS_URL'):
+        yield 'redis', override_settings(THROTTLING={'REDIS_URL': os.getenv('REDIS_URL')}), CatalogRateThrottle
+    yield 'drf cache', override_settings(), DRFCacheThrottle
+
+
+def endpoint(repeat):
+    from django.core.management import call_command
+    from django.test import Client
+
+    from apps.products.models import Product
+    from apps.products.views import ProductViewSet
+
+    with test_database():
+        call_command('seed', products=200, users=1, orders=0, stdout=open(os.devnull, 'w'))
+        path = '/api/products/products/%s/' % Product.objects.filter(is_active=True).first().slug
+        client = Client()
+        counter = itertools.count()
+        throttles = ProductViewSet.throttle_classes
+        timings = {True: [], False: []}
+        try:
+            # Alternate, so drift over the run (the response cache filling
+            # up, say) shows up in both columns alike
+            for index in range(2 * (repeat + 20)):
+                throttled = index % 2 == 0
+                ProductViewSet.throttle_classes = throttles if throttled else []
+                start = time.perf_counter()
+                # A new query string each time, so the response cache never answers
+                client.get(path, {'_': next(counter)})
+                if index >= 40:
+                    timings[throttled].append((time.perf_counter() - start) * 1000)
+        finally:
+            ProductViewSet.throttle_classes = throttles
+    without, with_ = statistics.median(timings[False]), statistics.median(timings[True])
+    return [['product detail', without, with_, with_ - without, 100 * (with_ - without) / without]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--checks', type=int, default=20000)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--repeat', type=int, default=500)
+    args = parser.parse_args()
+
+    setup()
+    from django.conf import settings
+    from django.test import override_settings
+
+    def rates(rate):
+        return override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {'catalog': rate}})
+
+    checks = []
+    with override_settings(DEBUG=False, ALLOWED_HOSTS=['testserver'], PROFILING={'SAMPLE_RATE': 0}):
+        with rates(CHECK_RATE):
+            for name, configured, throttle_class in limiters():
+                with configured:
+                    for threads in args.threads:
+                        checks.append([name, threads, *check_rate(throttle_class, args.checks, threads)])
+        with rates(RATE):
+            requests = endpoint(args.repeat)
+
+    print_table(['limiter', 'threads', 'checks/s', 'us per check'], checks)
+    print()
+    print_table(['endpoint', 'unthrottled ms', 'throttled ms', 'overhead ms', 'overhead %'], requests)
+
+
+if __name__ == '__main__':
+    main()
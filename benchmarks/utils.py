@@ -0,0 +1,65 @@
+# benchmarks/utils.py
+"""
+Helpers shared by the benchmark scripts.
+
+Every script runs against a throwaway test database created from the
+configured settings, so benchmarks never touch real data:
+
+    python -m benchmarks.search --sizes 10000 100000
+"""
+import contextlib
+import os
+import statistics
+import time
+
+import django
+
+
+def setup():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+    django.setup()
+
+
+@contextlib.contextmanager
+def test_database():
+    from django.db import connection
+
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def measure(func, repeat=20, warmup=2):
+    """Run ``func`` repeatedly and return latency statistics in milliseconds."""
+    for _ in range(warmup):
+        func()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        'median': statistics.median(timings),
+        'p95': timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        'max': timings[-1],
+    }
+
+
+def print_table(headers, rows):
+    rows = [[format_cell(cell) for cell in row] for row in rows]
+    widths = [max(len(str(value)) for value in column) for column in zip(headers, *rows)]
+    line = '  '.join('%%-%ds' % width for width in widths)
+    print(line % tuple(headers))
+    print(line % tuple('-' * width for width in widths))
+    for row in rows:
+        print(line % tuple(row))
+
+
+def format_cell(value):
+    if isinstance(value, float):
+        return '%.2f' % value
+    return str(value)
@@ -0,0 +1,120 @@
+# benchmarks/webhooks.py
+"""
+Payment webhook throughput: acknowledging versus processing in the request.
+
+    python -m benchmarks.webhooks --events 2000
+
+Every event settles a different pending payment. ``ack`` is what the
+webhook endpoint does: check the signature, store the event and queue
+it (onto an in-memory list here, so the broker is left out). ``worker``
+then applies the queued events the way a Celery worker would. ``inline``
+does both inside the request, which is how long a provider would wait
+for its acknowledgement without the queue. Requests go through the
+Django test client in one thread.
+"""
+import argparse
+import time
+from decimal import Decimal
+from unittest import mock
+
+from benchmarks.utils import print_table, setup, test_database
+
+PROVIDERS = {
+    'fake': {'BACKEND': 'apps.payments.providers.FakeProvider', 'OPTIONS': {'webhook_secret': 'bench'}},
+}
+
+
+def seed(count):
+    from apps.accounts.models import Address, User
+    from apps.orders.models import Order
+    from apps.payments.models import Payment
+
+    user = User.objects.create_user(email='bench@example.com', username='bench', password='secret')
+    address = Address.objects.create(
+        user=user, street_address='1 Bench', city='Lagos', state='LA', phone_number='0'
+    )
+    orders = Order.objects.bulk_create(
+        Order(
+            user=user, shipping_address=address, order_number='WH%d' % index,
+            subtotal=Decimal('10.00'), shipping_cost=Decimal('5.00'), total_amount=Decimal('15.00'),
+        )
+        for index in range(count)
+    )
+    return Payment.objects.bulk_create(
+        Payment(order=order, provider='fake', method='FIAT', amount=order.total_amount, currency='NGN')
+        for order in orders
+    )
+
+
+def post_all(client, provider, payments):
+    """Post one success webhook per payment. Returns latencies in milliseconds."""
+    webhooks = [provider.webhook(payment) for payment in payments]
+    timings = []
+    for body, headers in webhooks:
+        start = time.perf_counter()
+        response = client.post('/api/payments/webhooks/fake/', body, content_type='application/json',
+                               headers=headers)
+        timings.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 202, response.status_code
+    return timings
+
+
+def summary(name, timings, elapsed):
+    timings = sorted(timings)
+    return [
+        name, len(timings) / elapsed, timings[len(timings) // 2],
+        timings[min(len(timings) - 1, int(len(timings) * 0.99))],
+    ]
+
+
+def run(count):
+    from django.test import Client, override_settings
+
+    from apps.payments.models import Payment
+    from apps.payments.providers import get_provider
+    from apps.payments.webhooks import process_event
+
+    rows = []
+    client = Client()
+    # The test client's host is 'testserver'
+    with override_settings(PAYMENT_PROVIDERS=PROVIDERS, ALLOWED_HOSTS=['testserver']):
+        provider = get_provider('fake')
+
+        payments = seed(2 * count)
+        queue = []
+        with mock.patch('apps.payments.views.process_webhook.delay', queue.append):
+            start = time.perf_counter()
+            timings = post_all(client, provider, payments[:count])
+            rows.append(summary('ack', timings, time.perf_counter() - start))
+
+        timings = []
+        start = time.perf_counter()
+        for event_id in queue:
+            began = time.perf_counter()
+            process_event(event_id)
+            timings.append((time.perf_counter() - began) * 1000)
+        rows.append(summary('worker', timings, time.perf_counter() - start))
+
+        with mock.patch('apps.payments.views.process_webhook.delay', process_event):
+            start = time.perf_counter()
+            timings = post_all(client, provider, payments[count:])
+            rows.append(summary('inline', timings, time.perf_counter() - start))
+
+        settled = Payment.objects.filter(status=Payment.SUCCEEDED).count()
+        assert settled == 2 * count, settled
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--events', type=int, default=2000)
+    args = parser.parse_args()
+
+    setup()
+    with test_database():
+        rows = run(args.events)
+    print_table(['stage', 'events/s', 'p50 ms', 'p99 ms'], rows)
+
+
+if __name__ == '__main__':
+    main()
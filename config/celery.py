@@ -0,0 +1,18 @@
+# config/celery.py
+"""
+Celery application.
+
+    celery -A config worker -l info
+
+Configured from the Django settings prefixed with ``CELERY_``. Tasks are
+found in each app's tasks.py.
+"""
+import os
+
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+
+app = Celery('config')
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
@@ -0,0 +1,140 @@
+# config/production.py
+"""
+Production settings:
+
+    DJANGO_SETTINGS_MODULE=config.production
+
+Everything deployment-specific comes from the environment. The database
+connection strategy is picked with ``DATABASE_POOLING``:
+
+``pool`` (default)
+    Connections are borrowed from a pool in each worker process (see
+    core/db/postgresql_pool/). Works under both gunicorn and uvicorn.
+    A worker holds at most ``DATABASE_POOL_SIZE`` connections, so the
+    database sees at most workers x pool size of them; requests beyond
+    that wait up to ``DATABASE_POOL_TIMEOUT`` seconds for one.
+``persistent``
+    Each worker thread keeps its own connection for
+    ``DATABASE_CONN_MAX_AGE`` seconds. Only for sync gunicorn workers:
+    under ASGI every request runs in a new thread and the connections
+    pile up.
+``pgbouncer``
+    Connect through PgBouncer in transaction pooling mode. PgBouncer
+    rejects startup parameters and cannot hold server-side cursors
+    across transactions, so set the timeouts on the database role
+    instead (``ALTER ROLE ... SET statement_timeout = ...``).
+``none``
+    A new connection for every request.
+
+Statements running longer than ``DATABASE_STATEMENT_TIMEOUT``
+milliseconds are cancelled, and so are sessions left idle inside a
+transaction for ``DATABASE_IDLE_TRANSACTION_TIMEOUT`` milliseconds.
+"""
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+
+from .settings import *  # noqa: F401,F403
+from .settings import DATABASES, PAYMENT_PROVIDERS
+
+DEBUG = False
+
+SECRET_KEY = os.environ['SECRET_KEY']
+
+ALLOWED_HOSTS = [host for host in os.getenv('ALLOWED_HOSTS', '').split(',') if host]
+
+# Errors go to stderr. Django's default mail_admins handler renders the
+# local variables of every frame, querysets included, so a failing
+# request would go back to the database (and the pool) while holding
+# the logging lock.
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'root': {
+        'handlers': ['console'],
+        'level': os.getenv('LOG_LEVEL', 'WARNING'),
+    },
+    'loggers': {
+        'django': {
+            'handlers': ['console'],
+            'level': os.getenv('LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+        # Order events, one JSON object per line (apps/orders/tasks.py)
+        'analytics': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        # Profiled requests, one JSON object per line (core/profiling.py)
+        'profiling': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
+EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', 'django.core.mail.backends.smtp.EmailBackend')
+EMAIL_HOST = os.getenv('EMAIL_HOST', 'localhost')
+EMAIL_PORT = int(os.getenv('EMAIL_PORT', 587))
+EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER', '')
+EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD', '')
+EMAIL_USE_TLS = os.getenv('EMAIL_USE_TLS', 'true').lower() == 'true'
+# Give up on an unresponsive server and let the task retry
+EMAIL_TIMEOUT = 10
+
+# Opt in with PROFILING_SAMPLE_RATE, e.g. 0.01 to profile 1% of requests
+PROFILING = {'SAMPLE_RATE': float(os.getenv('PROFILING_SAMPLE_RATE', 0))}
+
+# FakeProvider accepts any webhook signed with its secret, and the
+# default secret is public
+PAYMENT_PROVIDERS = {name: provider for name, provider in PAYMENT_PROVIDERS.items() if name != 'fake'}
+
+DATABASE_POOLING = os.getenv('DATABASE_POOLING', 'pool')
+
+if DATABASE_POOLING not in ('pool', 'persistent', 'pgbouncer', 'none'):
+    raise ImproperlyConfigured('Unknown DATABASE_POOLING %r' % DATABASE_POOLING)
+
+# The primary and its replicas alike
+for database in DATABASES.values():
+    database.update({
+        'CONN_MAX_AGE': 0,
+        # Checks a persistent connection at the start of each request instead
+        # of failing the request if the server dropped it
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'connect_timeout': int(os.getenv('DATABASE_CONNECT_TIMEOUT', 5)),
+            # Notice dead peers on long-lived connections
+            'keepalives': 1,
+            'keepalives_idle': 60,
+            'keepalives_interval': 10,
+            'keepalives_count': 3,
+        },
+    })
+
+    if DATABASE_POOLING == 'pgbouncer':
+        database['DISABLE_SERVER_SIDE_CURSORS'] = True
+    else:
+        database['OPTIONS']['options'] = '-c statement_timeout=%d -c idle_in_transaction_session_timeout=%d' % (
+            int(os.getenv('DATABASE_STATEMENT_TIMEOUT', 30000)),
+            int(os.getenv('DATABASE_IDLE_TRANSACTION_TIMEOUT', 60000)),
+        )
+
+    if DATABASE_POOLING == 'pool':
+        database['ENGINE'] = 'core.db.postgresql_pool'
+        database['OPTIONS']['pool'] = {
+            'MAX_SIZE': int(os.getenv('DATABASE_POOL_SIZE', 4)),
+            'TIMEOUT': int(os.getenv('DATABASE_POOL_TIMEOUT', 10)),
+        }
+    elif DATABASE_POOLING == 'persistent':
+        database['CONN_MAX_AGE'] = int(os.getenv('DATABASE_CONN_MAX_AGE', 600))
+    elif DATABASE_POOLING == 'pgbouncer':
+        # Connecting to PgBouncer is cheap; keep connections only under
+        # sync workers, for the same reason as 'persistent'
+        database['CONN_MAX_AGE'] = int(os.getenv('DATABASE_CONN_MAX_AGE', 0))
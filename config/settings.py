@@ -9,6 +9,7 @@ https://docs.djangoproject.com/en/5.1/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
+from datetime import timedelta
 from pathlib import Path
 import os
 from dotenv import load_dotenv
@@ -41,11 +42,14 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "apps.accounts",
     "apps.products",
     "apps.orders",
     "apps.payments",
     "apps.shipping",
+    "apps.outbox",
+    "apps.seeding",
 
     "rest_framework",
     "corsheaders",
@@ -53,11 +57,14 @@ INSTALLED_APPS = [
     ]
 
 MIDDLEWARE = [
+    # First, so its timings cover the rest of the stack
+    "core.profiling.ProfilingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "core.db.replicas.PrimaryPinMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -96,6 +103,102 @@ DATABASES = {
         'PORT': os.getenv('DATABASE_PORT'),
     }
 }
+
+# Read replicas of the default database, one per host in
+# DATABASE_REPLICA_HOSTS. Catalog and order history reads go to them,
+# see core/db/replicas.py
+
+for index, host in enumerate(filter(None, os.getenv('DATABASE_REPLICA_HOSTS', '').split(','))):
+    DATABASES['replica_%d' % index] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['core.db.replicas.ReplicaRouter']
+
+DATABASE_REPLICAS = {
+    'ALIASES': [alias for alias in DATABASES if alias != 'default'],
+    # Seconds a replica may fall behind before reads leave it
+    'MAX_LAG': 5,
+    'LAG_CHECK_INTERVAL': 2,
+    # Seconds a client reads from the primary after a write
+    'STICKY_SECONDS': 10,
+}
+
+# Shared cache for version tokens and cached catalog responses. Without
+# REDIS_URL (local runs, tests) each process gets its own in-memory cache.
+
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Catalog response cache, see core/caching.py
+RESPONSE_CACHE = {
+    'TIMEOUT': 300,
+    # How long a superseded response may still be served while the
+    # first request after a write rebuilds it
+    'STALE_TIMEOUT': 60,
+}
+
+# Query and latency profiling, see core/profiling.py. Every request is
+# profiled here; production profiles none unless PROFILING_SAMPLE_RATE
+# is set.
+PROFILING = {
+    'SAMPLE_RATE': float(os.getenv('PROFILING_SAMPLE_RATE', 1)),
+}
+
+REST_FRAMEWORK = {
+    # Keyset pagination on every list endpoint, see core/pagination.py
+    'DEFAULT_PAGINATION_CLASS': 'core.pagination.KeysetPagination',
+    'PAGE_SIZE': 50,
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        # Bearer tokens from /api/auth/login/, see core/authentication.py
+        'core.authentication.CachedJWTAuthentication',
+        # The browsable API and the admin's session
+        'rest_framework.authentication.SessionAuthentication',
+    ],
+    # Token bucket per scope, see core/throttling.py
+    'DEFAULT_THROTTLE_RATES': {
+        # Anonymous product and category reads, per IP
+        'catalog': os.getenv('THROTTLE_CATALOG_RATE', '300/min'),
+        # Sign-ups and sign-ins, per IP
+        'login': os.getenv('THROTTLE_LOGIN_RATE', '10/min'),
+        # Orders placed, per user
+        'checkout': os.getenv('THROTTLE_CHECKOUT_RATE', '20/min'),
+        # Shipping quotes, per IP
+        'quote': os.getenv('THROTTLE_QUOTE_RATE', '60/min'),
+    },
+}
+
+# Throttles share their buckets through Redis; without it each process
+# counts on its own
+THROTTLING = {
+    'REDIS_URL': os.getenv('THROTTLE_REDIS_URL') or os.getenv('REDIS_URL'),
+}
+
+SIMPLE_JWT = {
+    'ACCESS_TOKEN_LIFETIME': timedelta(minutes=15),
+    'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
+    # Each refresh hands out a new refresh token and revokes the old one
+    'ROTATE_REFRESH_TOKENS': True,
+}
+
+# Seconds the user a token resolves to is cached for
+JWT_USER_CACHE = {
+    'TIMEOUT': 60,
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -132,7 +235,102 @@ USE_TZ = True
 
 STATIC_URL = "static/"
 
+# Uploads. Product image renditions are named by content hash, so
+# whatever serves MEDIA_URL can cache them for good.
+MEDIA_URL = os.getenv('MEDIA_URL', '/media/')
+MEDIA_ROOT = os.getenv('MEDIA_ROOT', BASE_DIR / 'media')
+
+# Resized product images, see apps/products/images.py
+PRODUCT_IMAGE_RENDITIONS = {
+    'SIZES': {'thumb': 160, 'small': 320, 'medium': 640, 'large': 1280},
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+# Order numbers
+# See apps/orders/numbering.py for the available backends
+
+ORDER_NUMBER_GENERATOR = {
+    'BACKEND': 'apps.orders.numbering.SnowflakeGenerator',
+    # SnowflakeGenerator reads a fixed node id from ORDER_NUMBER_NODE_ID,
+    # or else leases one per process from the database
+    'OPTIONS': {},
+}
+
+# Seconds an unpaid order holds its stock before
+# release_expired_reservations puts it back, see apps/orders/inventory.py
+STOCK_RESERVATION_TTL = 15 * 60
+
+# Background tasks, see config/celery.py. Without a broker (local runs,
+# tests) tasks run inline in the calling process.
+
+CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL') or os.getenv('REDIS_URL')
+CELERY_TASK_ALWAYS_EAGER = not CELERY_BROKER_URL
+# A task is only removed from the queue once it finished, so a worker
+# that dies mid-task leaves it for another
+CELERY_TASK_ACKS_LATE = True
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+# Queues, so slow email delivery never holds up payments:
+#   celery -A config worker -Q default,payments
+#   celery -A config worker -Q email,analytics,images
+CELERY_TASK_DEFAULT_QUEUE = 'default'
+CELERY_TASK_ROUTES = {
+    'apps.orders.tasks.send_order_email': {'queue': 'email'},
+    'apps.orders.tasks.record_order_event': {'queue': 'analytics'},
+    'apps.orders.tasks.expire_unpaid_order': {'queue': 'payments'},
+    'apps.payments.tasks.*': {'queue': 'payments'},
+    # CPU-bound; kept apart so a batch of uploads cannot delay the rest
+    'apps.products.tasks.*': {'queue': 'images'},
+}
+
+EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL', 'orders@localhost')
+
+# Staff told when an order leaves a product or variant with this many
+# units or fewer, see apps/orders/tasks.py
+LOW_STOCK_THRESHOLD = 5
+STOCK_ALERT_EMAILS = [email for email in os.getenv('STOCK_ALERT_EMAILS', '').split(',') if email]
+
+# Payment providers by name, see apps/payments/providers.py. A provider's
+# webhooks are posted to /api/payments/webhooks/<name>/.
+
+PAYMENT_PROVIDERS = {
+    'fake': {
+        'BACKEND': 'apps.payments.providers.FakeProvider',
+        'OPTIONS': {'webhook_secret': os.getenv('FAKE_PAYMENT_WEBHOOK_SECRET', 'fake-webhook-secret')},
+    },
+    'crypto': {
+        'BACKEND': 'apps.payments.crypto.CryptoProvider',
+        # Price of one ether in PAYMENT_CURRENCY
+        'OPTIONS': {'rate': os.getenv('CRYPTO_ETH_PRICE')},
+    },
+}
+DEFAULT_PAYMENT_PROVIDER = os.getenv('PAYMENT_PROVIDER', 'fake')
+# Providers for the order payment methods that do not use the default
+PAYMENT_METHOD_PROVIDERS = {'CRYPTO': 'crypto'}
+PAYMENT_CURRENCY = 'NGN'
+
+# Seconds a payment request's Idempotency-Key is remembered
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+
+# On-chain payment watcher (manage.py watch_payments), see
+# apps/payments/crypto.py
+
+CRYPTO_PAYMENTS = {
+    'RPC_URL': os.getenv('CRYPTO_RPC_URL', 'http://127.0.0.1:8545'),
+    # Blocks a deposit must be buried under before it counts
+    'CONFIRMATIONS': int(os.getenv('CRYPTO_CONFIRMATIONS', 12)),
+    'BATCH_BLOCKS': 50,
+    'POLL_INTERVAL': 5,
+}
+
+# Shipping rates, see apps/shipping/rates.py
+
+SHIPPING = {
+    # State orders are shipped from
+    'ORIGIN': os.getenv('SHIPPING_ORIGIN_STATE', 'LA'),
+    'TABLES': 'apps.shipping.tables',
+}
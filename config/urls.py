@@ -3,11 +3,17 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from core.profiling import QueryShapesView
+
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('api/auth/', include('apps.accounts.auth_urls')),
     path('api/accounts/', include('apps.accounts.urls')),
     path('api/products/', include('apps.products.urls')),
-    path('api/orders/', include('apps.orders.urls'))
+    path('api/orders/', include('apps.orders.urls')),
+    path('api/payments/', include('apps.payments.urls')),
+    path('api/shipping/', include('apps.shipping.urls')),
+    path('api/debug/queries/', QueryShapesView.as_view(), name='debug-queries'),
 ]
 
 if settings.DEBUG:
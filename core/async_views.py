@@ -0,0 +1,109 @@
+# core/async_views.py
+"""
+Async read paths for DRF viewsets.
+
+DRF views are synchronous, so under ASGI Django runs every request to
+them on the worker's single sync thread, one at a time. Viewsets using
+AsyncReadMixin get an async view instead: the actions in
+``async_actions`` are served by ``a<action>`` coroutines that read
+through the async ORM and serialize on the event loop, so a worker keeps
+accepting and rendering requests while others wait on the database.
+Every other action runs the normal synchronous viewset in a thread.
+
+Serializers run on the event loop and must not query: everything they
+render has to be loaded (select_related/prefetch_related) beforehand.
+Django raises SynchronousOnlyOperation if one does. Anything else a
+serializer needs can be loaded in ``aprepare()``.
+
+Under WSGI the same views still work; Django runs them to completion in
+the request thread.
+"""
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
+from django.http import Http404
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.response import Response
+
+
+class AsyncReadMixin:
+    async_actions = ('list', 'retrieve')
+
+    @classmethod
+    def as_view(cls, actions=None, **initkwargs):
+        sync_view = super().as_view(actions, **initkwargs)
+        async_methods = {method for method, action in actions.items() if action in cls.async_actions}
+        if 'get' in async_methods:
+            async_methods.add('head')
+        if not async_methods:
+            return sync_view
+
+        async def view(request, *args, **kwargs):
+            if request.method.lower() not in async_methods:
+                return await sync_to_async(sync_view)(request, *args, **kwargs)
+            # The set up ViewSetMixin.as_view() does for a sync request
+            self = cls(**initkwargs)
+            self.action_map = dict(actions)
+            self.action_map.setdefault('head', actions['get'])
+            for method, action in self.action_map.items():
+                setattr(self, method, getattr(self, action))
+            self.request = request
+            self.args = args
+            self.kwargs = kwargs
+            return await self.adispatch(request, *args, **kwargs)
+
+        view.cls = cls
+        view.initkwargs = initkwargs
+        view.actions = actions
+        return csrf_exempt(view)
+
+    async def adispatch(self, request, *args, **kwargs):
+        """APIView.dispatch() for the async actions."""
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+        try:
+            # Authentication, permissions and throttles may query
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            await self.aprepare()
+            handler = getattr(self, 'a%s' % self.action)
+            response = await handler(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    async def aprepare(self):
+        """Load anything serializers need that is not on the queryset."""
+
+    async def aget_queryset(self):
+        # get_queryset() may read cached state that needs the database to
+        # rebuild, so it runs in the sync thread
+        return await sync_to_async(lambda: self.filter_queryset(self.get_queryset()))()
+
+    async def alist(self, request, *args, **kwargs):
+        if getattr(self, 'wants_stream', None) and self.wants_stream(request):
+            return await sync_to_async(self.list)(request, *args, **kwargs)
+
+        queryset = await self.aget_queryset()
+        if self.paginator is None:
+            rows = [row async for row in queryset]
+            return Response(self.get_serializer(rows, many=True).data)
+        page = await self.paginator.apaginate_queryset(queryset, request, view=self)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        instance = await self.aget_object()
+        return Response(self.get_serializer(instance).data)
+
+    async def aget_object(self):
+        queryset = await self.aget_queryset()
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            obj = await queryset.aget(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        except (queryset.model.DoesNotExist, TypeError, ValueError, ValidationError):
+            raise Http404
+        self.check_object_permissions(self.request, obj)
+        return obj
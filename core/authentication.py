@@ -0,0 +1,104 @@
+# core/authentication.py
+"""
+JWT authentication that identifies the caller without a database query.
+
+Access tokens are checked by their signature and expiry
+(djangorestframework-simplejwt). The User a token resolves to is cached
+under the token's id, its ``jti`` claim, for ``TIMEOUT`` seconds, so a
+client making many requests with one token costs one user query per
+timeout instead of one per request. Saving or deleting a user marks its
+cached copies stale, so a deactivated user is refused on their next
+request.
+
+A token is revoked by listing its id in the cache until the token
+expires (see ``revoke()``, used by logout and refresh token rotation).
+With Redis as the cache, every worker shares the list; with the local
+memory cache, a revocation only holds in the process that made it. The
+revocation entry, the cached user and the user's stale mark are read in
+a single cache round trip.
+
+    JWT_USER_CACHE = {'TIMEOUT': 60}
+"""
+import math
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+DEFAULTS = {
+    'TIMEOUT': 60,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'JWT_USER_CACHE', {})}
+
+
+def revoked_key(jti):
+    return 'jwt:revoked:%s' % jti
+
+
+def user_key(jti):
+    return 'jwt:user:%s' % jti
+
+
+def stale_key(user_id):
+    return 'jwt:user-stale:%s' % user_id
+
+
+def seconds_left(token):
+    return token['exp'] - time.time()
+
+
+def revoke(token):
+    """Refuse ``token``, an access or refresh token, from now until it expires."""
+    remaining = seconds_left(token)
+    if remaining > 0:
+        cache.set(revoked_key(token[jwt_settings.JTI_CLAIM]), True, math.ceil(remaining))
+
+
+def is_revoked(token):
+    return cache.get(revoked_key(token[jwt_settings.JTI_CLAIM])) is not None
+
+
+def mark_user_changed(user_id):
+    # Copies cached before the mark carry a different one, or none; the
+    # mark only has to outlive them
+    mark = uuid.uuid4().hex
+    cache.set(stale_key(user_id), mark, get_config()['TIMEOUT'])
+
+
+def mark_user_changed_on_commit(user_id):
+    # Now, so this process sees its own write, and after commit, so no
+    # request caches the row as it was before the commit
+    mark_user_changed(user_id)
+    transaction.on_commit(lambda: mark_user_changed(user_id))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication resolving the user from the cache; see the module docstring."""
+
+    def get_user(self, validated_token):
+        jti = validated_token.get(jwt_settings.JTI_CLAIM)
+        user_id = validated_token.get(jwt_settings.USER_ID_CLAIM)
+        if jti is None or user_id is None:
+            return super().get_user(validated_token)
+        keys = revoked_key(jti), user_key(jti), stale_key(user_id)
+        found = cache.get_many(keys)
+        if keys[0] in found:
+            raise InvalidToken(_('Token has been revoked'))
+        mark = found.get(keys[2])
+        cached = found.get(keys[1])
+        if cached is not None and cached[0] == mark:
+            return cached[1]
+        user = super().get_user(validated_token)
+        timeout = min(get_config()['TIMEOUT'], seconds_left(validated_token))
+        if timeout > 0:
+            cache.set(keys[1], (mark, user), math.ceil(timeout))
+        return user
@@ -0,0 +1,167 @@
+# core/caching.py
+"""
+Response cache for read-heavy catalog endpoints.
+
+Responses are cached under a key built from the request (host, path and
+normalized query params) and the current version tokens of every model
+the payload is built from (see core/versioning.py). A write bumps a
+token, which moves readers to a new key; nothing has to be deleted.
+
+The key doubles as the ETag, so a client revalidating with
+If-None-Match gets a 304 without the response being rebuilt or even read
+from the cache. While one request rebuilds a response whose data
+changed, concurrent requests keep getting the previous response for up
+to ``STALE_TIMEOUT`` seconds instead of all hitting the database.
+
+A response rebuilt shortly after a write is read from the primary, since
+a replica may not have the write yet and the cached copy would outlive
+the lag (see core/db/replicas.py).
+
+Configured with ``RESPONSE_CACHE``:
+
+    RESPONSE_CACHE = {'TIMEOUT': 300, 'STALE_TIMEOUT': 60}
+"""
+import contextlib
+import hashlib
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from .db.replicas import lag_window, primary_reads
+from .versioning import changed_within, get_versions
+
+DEFAULTS = {
+    'TIMEOUT': 300,
+    'STALE_TIMEOUT': 60,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'RESPONSE_CACHE', {})}
+
+
+class CachedResponseMixin:
+    """
+    Caches ``list`` and ``retrieve`` (and their async versions, see
+    core/async_views.py) for non-staff users; other actions can opt in by
+    returning ``self.cached_response(request, compute)``.
+
+    ``cache_versions`` names the version tokens the payload depends on.
+    """
+    cache_versions = ()
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, lambda: super(CachedResponseMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(request, lambda: super(CachedResponseMixin, self).retrieve(request, *args, **kwargs))
+
+    async def alist(self, request, *args, **kwargs):
+        return await self.acached_response(request, lambda: super(CachedResponseMixin, self).alist(request, *args, **kwargs))
+
+    async def aretrieve(self, request, *args, **kwargs):
+        return await self.acached_response(request, lambda: super(CachedResponseMixin, self).aretrieve(request, *args, **kwargs))
+
+    def is_cacheable(self, request):
+        # Staff see inactive products and can stream exports, so only
+        # responses shared by every other caller are cached
+        return request.method in ('GET', 'HEAD') and not request.user.is_staff
+
+    def get_cache_key(self, request, versions):
+        params = sorted(
+            (name, value)
+            for name, values in request.query_params.lists()
+            for value in values if value
+        )
+        raw = repr((
+            request.get_host(), request.is_secure(), request.path, params,
+            [versions[name] for name in self.cache_versions],
+        ))
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def cached_response(self, request, compute):
+        if not self.is_cacheable(request):
+            return compute()
+        response, state = self.cache_lookup(request)
+        if response is not None:
+            return response
+        try:
+            with self.build_context(state):
+                response = compute()
+            return self.cache_store(response, state)
+        finally:
+            self.cache_unlock(state)
+
+    async def acached_response(self, request, compute):
+        """cached_response() for the async read path; ``compute`` is a coroutine function."""
+        if not self.is_cacheable(request):
+            return await compute()
+        response, state = await sync_to_async(self.cache_lookup)(request)
+        if response is not None:
+            return response
+        try:
+            with self.build_context(state):
+                response = await compute()
+            return await sync_to_async(self.cache_store)(response, state)
+        finally:
+            await sync_to_async(self.cache_unlock)(state)
+
+    def cache_lookup(self, request):
+        """A cached response, or None and the state cache_store() needs."""
+        config = get_config()
+        versions = get_versions(self.cache_versions)
+        key = self.get_cache_key(request, versions)
+        state = {
+            'etag': quote_etag(key[:32]),
+            'recent': changed_within(versions.values(), lag_window()),
+            'fresh_key': 'response:%s' % key,
+            # The last response built for this URL, whatever the versions
+            'stale_key': 'response:stale:%s' % hashlib.sha256(request.get_full_path().encode()).hexdigest(),
+            'locked': False,
+        }
+
+        if state['etag'] in parse_etags(request.headers.get('If-None-Match', '')):
+            return self.cache_headers(Response(status=status.HTTP_304_NOT_MODIFIED), state['etag'], 'HIT'), state
+
+        entry = cache.get(state['fresh_key'])
+        if entry is not None:
+            return self.from_entry(entry, 'HIT'), state
+
+        stale = cache.get(state['stale_key'])
+        if stale is not None:
+            if not cache.add('%s:lock' % state['stale_key'], 1, config['STALE_TIMEOUT']):
+                # Another request is already rebuilding this response
+                return self.from_entry(stale, 'STALE'), state
+            state['locked'] = True
+        return None, state
+
+    def build_context(self, state):
+        return primary_reads() if state['recent'] else contextlib.nullcontext()
+
+    def cache_store(self, response, state):
+        if response.status_code == status.HTTP_200_OK:
+            config = get_config()
+            entry = {'data': response.data, 'etag': state['etag']}
+            cache.set(state['fresh_key'], entry, config['TIMEOUT'])
+            cache.set(state['stale_key'], entry, config['TIMEOUT'] + config['STALE_TIMEOUT'])
+            self.cache_headers(response, state['etag'], 'MISS')
+        return response
+
+    def cache_unlock(self, state):
+        if state['locked']:
+            cache.delete('%s:lock' % state['stale_key'])
+
+    def from_entry(self, entry, state):
+        return self.cache_headers(Response(entry['data']), entry['etag'], state)
+
+    def cache_headers(self, response, etag, state):
+        response['ETag'] = etag
+        response['Cache-Control'] = 'public, max-age=0, stale-while-revalidate=%d' % (
+            get_config()['STALE_TIMEOUT']
+        )
+        response['X-Cache'] = state
+        return response
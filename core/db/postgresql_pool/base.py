@@ -0,0 +1,77 @@
+# core/db/postgresql_pool/base.py
+"""
+PostgreSQL backend that borrows connections from a per-process pool.
+
+Django 5.0 opens a new connection per thread, and under ASGI every
+request runs its ORM calls in a thread of its own, so without a pool each
+request pays for a fresh connection. This backend behaves like
+``django.db.backends.postgresql`` except that ``connect()`` takes a
+connection from the pool and ``close()`` gives it back, so it is meant to
+run with ``CONN_MAX_AGE = 0``. Pool settings go in ``OPTIONS['pool']``,
+see core/db/postgresql_pool/pool.py:
+
+    DATABASES = {
+        'default': {
+            'ENGINE': 'core.db.postgresql_pool',
+            ...
+            'OPTIONS': {'pool': {'MAX_SIZE': 4, 'TIMEOUT': 10}},
+        }
+    }
+
+Django 5.1 can pool natively with psycopg 3 (``OPTIONS['pool']`` on the
+stock backend); this backend keeps the same setting so moving is a
+matter of changing ``ENGINE``.
+"""
+import functools
+
+import psycopg2.extras
+from django.db.backends.postgresql import base, creation
+from django.db.backends.postgresql.psycopg_any import IsolationLevel
+from django.utils.asyncio import async_unsafe
+
+from .pool import close_pools, get_pool
+
+
+def connect(conn_params):
+    connection = base.Database.connect(**conn_params)
+    # What the stock backend does for every new connection
+    psycopg2.extras.register_default_jsonb(conn_or_curs=connection, loads=lambda x: x)
+    return connection
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # Idle pooled connections would keep DROP DATABASE from running
+        close_pools(test_database_name)
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    def get_connection_params(self):
+        conn_params = super().get_connection_params()
+        conn_params.pop('pool', None)
+        return conn_params
+
+    @async_unsafe
+    def get_new_connection(self, conn_params):
+        options = self.settings_dict['OPTIONS']
+        self.pool = get_pool(conn_params, functools.partial(connect, conn_params), options.get('pool'))
+        connection = self.pool.getconn()
+        # What the stock backend does around connect()
+        isolation_level = options.get('isolation_level')
+        if isolation_level is None:
+            self.isolation_level = IsolationLevel.READ_COMMITTED
+        else:
+            self.isolation_level = IsolationLevel(isolation_level)
+            connection.isolation_level = self.isolation_level
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            # Django keeps using a connection closed inside atomic() until
+            # the block exits, so that one must not go back to the pool
+            discard = self.in_atomic_block or self.errors_occurred
+            with self.wrap_database_errors:
+                self.pool.putconn(self.connection, discard=discard)
@@ -0,0 +1,182 @@
+# core/db/postgresql_pool/pool.py
+"""
+A process-wide pool of psycopg2 connections.
+
+Each worker process keeps at most ``MAX_SIZE`` connections per database
+and hands them to whichever thread needs one. Connections are checked
+before reuse when they have sat idle for ``CHECK_AFTER`` seconds, and
+closed once they are older than ``MAX_LIFETIME`` or have been idle for
+``MAX_IDLE`` seconds. A thread that finds the pool exhausted waits up to
+``TIMEOUT`` seconds for a connection to come back before giving up.
+"""
+import os
+import threading
+import time
+
+from psycopg2 import extensions
+
+DEFAULTS = {
+    'MAX_SIZE': 4,
+    'TIMEOUT': 10,
+    'CHECK_AFTER': 30,
+    'MAX_IDLE': 300,
+    'MAX_LIFETIME': 3600,
+}
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, connect, options=None):
+        self.connect = connect
+        self.options = {**DEFAULTS, **(options or {})}
+        self.size = 0
+        # (connection, opened at, returned at), most recently returned last
+        self.idle = []
+        self.opened_at = {}
+        self.condition = threading.Condition()
+
+    def getconn(self):
+        connection, opened_at, check = self.take(time.monotonic() + self.options['TIMEOUT'])
+        # Checked outside the lock, so a server that stopped answering
+        # holds up only this thread; the slot goes to a new connection
+        if connection is not None and check and not self.usable(connection):
+            self.close(connection)
+            connection = None
+        if connection is None:
+            try:
+                connection = self.connect()
+            except BaseException:
+                self.forget()
+                raise
+            opened_at = time.monotonic()
+        self.opened_at[id(connection)] = opened_at
+        return connection
+
+    def take(self, deadline):
+        """
+        An idle connection, when it was opened and whether it must be
+        checked before use, or (None, None, False) once there is room to
+        open a new one.
+        """
+        expired = []
+        try:
+            with self.condition:
+                while True:
+                    now = time.monotonic()
+                    while self.idle:
+                        connection, opened_at, returned_at = self.idle.pop()
+                        if self.expired(opened_at, returned_at, now):
+                            expired.append(connection)
+                            self.size -= 1
+                            continue
+                        return connection, opened_at, now - returned_at >= self.options['CHECK_AFTER']
+                    if self.size < self.options['MAX_SIZE']:
+                        self.size += 1
+                        return None, None, False
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        raise PoolTimeout(
+                            'No database connection became free within %ss (MAX_SIZE is %d)' % (
+                                self.options['TIMEOUT'], self.options['MAX_SIZE'])
+                        )
+                    self.condition.wait(remaining)
+        finally:
+            # Closed outside the lock, as in close_idle
+            for connection in expired:
+                self.close(connection)
+
+    def putconn(self, connection, discard=False):
+        opened_at = self.opened_at.pop(id(connection), None)
+        if opened_at is None:
+            # Not ours, or already returned
+            return
+        now = time.monotonic()
+        if discard or not self.reset(connection) or self.expired(opened_at, now, now):
+            self.discard(connection)
+            return
+        with self.condition:
+            self.idle.append((connection, opened_at, now))
+            self.condition.notify()
+
+    def discard(self, connection):
+        self.close(connection)
+        self.forget()
+
+    def forget(self):
+        with self.condition:
+            self.size -= 1
+            self.condition.notify()
+
+    def expired(self, opened_at, returned_at, now):
+        return (
+            now - opened_at >= self.options['MAX_LIFETIME']
+            or now - returned_at >= self.options['MAX_IDLE']
+        )
+
+    def usable(self, connection):
+        if connection.closed:
+            return False
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            return self.reset(connection)
+        except Exception:
+            return False
+
+    @staticmethod
+    def reset(connection):
+        """Roll back anything left open; False when the connection is unusable."""
+        if connection.closed:
+            return False
+        status = connection.get_transaction_status()
+        if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        if status != extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                connection.rollback()
+            except Exception:
+                return False
+        return True
+
+    @staticmethod
+    def close(connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def close_idle(self):
+        with self.condition:
+            idle, self.idle = self.idle, []
+            self.size -= len(idle)
+            self.condition.notify_all()
+        for connection, _, _ in idle:
+            self.close(connection)
+
+
+def get_pool(conn_params, connect, options=None):
+    # Keyed by process as well: a forked worker must open its own
+    # connections, never reuse (or close) its parent's
+    key = (os.getpid(), conn_params.get('dbname'), repr(sorted(conn_params.items())))
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(connect, options)
+        return _pools[key]
+
+
+def close_pools(dbname=None):
+    """Close the idle connections of this process's pools (for ``dbname`` only if given)."""
+    pid = os.getpid()
+    with _pools_lock:
+        pools = [
+            pool for (owner, name, _), pool in _pools.items()
+            if owner == pid and dbname in (None, name)
+        ]
+    for pool in pools:
+        pool.close_idle()
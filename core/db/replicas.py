@@ -0,0 +1,184 @@
+# core/db/replicas.py
+"""
+Read replicas.
+
+Reads go to the primary (``default``) unless a view opts in: viewsets
+using ReplicaReadMixin run the actions in ``replica_actions`` inside
+``replica_reads()``, and ReplicaRouter sends their queries to a replica.
+Writes, ``select_for_update()`` and anything inside a transaction on the
+primary always use the primary.
+
+A replica is only used while its replication lag, measured at most every
+``LAG_CHECK_INTERVAL`` seconds per process, is under ``MAX_LAG`` seconds.
+A client that just wrote is pinned to the primary for ``STICKY_SECONDS``
+(PrimaryPinMiddleware) so it reads its own writes.
+
+Configured with ``DATABASE_REPLICAS``:
+
+    DATABASE_REPLICAS = {
+        'ALIASES': ['replica_0'],
+        'MAX_LAG': 5,
+        'LAG_CHECK_INTERVAL': 2,
+        'STICKY_SECONDS': 10,
+    }
+"""
+import contextlib
+import contextvars
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.utils.deprecation import MiddlewareMixin
+from rest_framework.permissions import SAFE_METHODS
+
+DEFAULTS = {
+    'ALIASES': [],
+    'MAX_LAG': 5,
+    'LAG_CHECK_INTERVAL': 2,
+    'STICKY_SECONDS': 10,
+}
+
+PIN_COOKIE = 'primary_pin'
+
+# The replica this request reads from, or None for the primary
+_reads = contextvars.ContextVar('replica_reads', default=None)
+
+# alias -> (measured at, lag in seconds or None when unreachable)
+_lag = {}
+_lag_lock = threading.Lock()
+
+POSTGRES_LAG = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+"""
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'DATABASE_REPLICAS', {})}
+
+
+def measure_lag(alias):
+    """Seconds the replica is behind the primary."""
+    connection = connections[alias]
+    if connection.vendor != 'postgresql':
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(POSTGRES_LAG)
+        return float(cursor.fetchone()[0] or 0)
+
+
+def lag_window():
+    """How far behind the primary a replica in use can be, in seconds."""
+    config = get_config()
+    return config['MAX_LAG'] + config['LAG_CHECK_INTERVAL']
+
+
+def replica_lag(alias):
+    """Lag of ``alias`` as last measured; None when it could not be reached."""
+    config = get_config()
+    now = time.monotonic()
+    measured = _lag.get(alias)
+    if measured is None or now - measured[0] >= config['LAG_CHECK_INTERVAL']:
+        try:
+            lag = measure_lag(alias)
+        except DatabaseError:
+            lag = None
+        measured = (now, lag)
+        with _lag_lock:
+            _lag[alias] = measured
+    return measured[1]
+
+
+def choose_replica():
+    """A replica within ``MAX_LAG`` of the primary, or None."""
+    max_lag = get_config()['MAX_LAG']
+    healthy = []
+    for alias in get_config()['ALIASES']:
+        lag = replica_lag(alias)
+        if lag is not None and lag <= max_lag:
+            healthy.append(alias)
+    return random.choice(healthy) if healthy else None
+
+
+@contextlib.contextmanager
+def replica_reads(alias):
+    token = _reads.set(alias)
+    try:
+        yield alias
+    finally:
+        _reads.reset(token)
+
+
+@contextlib.contextmanager
+def primary_reads():
+    with replica_reads(None):
+        yield
+
+
+def pin_key(user_id):
+    return 'replica:pin:%s' % user_id
+
+
+def is_pinned(request):
+    if request.COOKIES.get(PIN_COOKIE):
+        return True
+    user = getattr(request, 'user', None)
+    return bool(user is not None and user.is_authenticated and cache.get(pin_key(user.pk)))
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        alias = _reads.get()
+        # Inside a transaction the primary may hold writes the replica
+        # cannot have yet
+        if alias is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        # Explicit, so saving an instance read from a replica does not
+        # write back to it
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in get_config()['ALIASES']:
+            return False
+        return None
+
+
+class PrimaryPinMiddleware(MiddlewareMixin):
+    """Pins a client to the primary for ``STICKY_SECONDS`` after a write."""
+
+    def process_response(self, request, response):
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            sticky = get_config()['STICKY_SECONDS']
+            # The cookie covers anonymous clients; the cache entry covers
+            # the user's other clients
+            response.set_cookie(PIN_COOKIE, '1', max_age=sticky, httponly=True, samesite='Lax')
+            user = getattr(request, 'user', None)
+            if user is not None and user.is_authenticated:
+                cache.set(pin_key(user.pk), 1, sticky)
+        return response
+
+
+class ReplicaReadMixin:
+    """Serves ``replica_actions`` from a replica unless the client is pinned."""
+    replica_actions = ('list', 'retrieve')
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS and self.action in self.replica_actions and not is_pinned(request):
+            _reads.set(choose_replica())
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        # Sync workers reuse their thread, and its context, for the next request
+        _reads.set(None)
+        return super().finalize_response(request, response, *args, **kwargs)
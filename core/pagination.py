@@ -0,0 +1,212 @@
+# core/pagination.py
+"""
+Keyset pagination for list endpoints.
+
+Pages are found by seeking past the last row of the previous page on a
+unique ordering, e.g. ``('-created_at', '-id')``, so every page costs one
+indexed range scan no matter how deep the client goes and no COUNT query
+is ever run. Cursors are opaque base64 tokens holding the boundary row's
+ordering values.
+
+Views pick their ordering with a ``pagination_ordering`` attribute or a
+``get_pagination_ordering()`` method. The last field must be unique.
+"""
+import base64
+import datetime
+import decimal
+import json
+import uuid
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def keyset_filter(ordering, values, reverse=False):
+    """Rows strictly after ``values`` in ``ordering`` (before, if ``reverse``)."""
+    condition = Q()
+    equal = {}
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        descending = field.startswith('-') != reverse
+        condition |= Q(**equal, **{'%s__%s' % (name, 'lt' if descending else 'gt'): value})
+        equal[name] = value
+    return condition
+
+
+def cursor_value(value):
+    # Full precision: DjangoJSONEncoder would cut datetimes to milliseconds,
+    # and the cursor must compare equal to the stored value
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (decimal.Decimal, uuid.UUID)):
+        return str(value)
+    raise TypeError('Cannot use %r in a cursor' % type(value))
+
+
+def invert(ordering):
+    return [field[1:] if field.startswith('-') else '-' + field for field in ordering]
+
+
+class KeysetPagination(BasePagination):
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    cursor_query_param = 'cursor'
+    ordering = ('-id',)
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_ordering(self, view):
+        if hasattr(view, 'get_pagination_ordering'):
+            return list(view.get_pagination_ordering())
+        return list(getattr(view, 'pagination_ordering', self.ordering))
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def encode_cursor(self, values, reverse):
+        payload = json.dumps({'v': values, 'r': reverse}, default=cursor_value, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+            values, reverse = list(payload['v']), bool(payload['r'])
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return values, reverse
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.set_page(list(self.page_queryset(queryset, request, view)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        return self.set_page([row async for row in self.page_queryset(queryset, request, view)])
+
+    def page_queryset(self, queryset, request, view):
+        """The rows of the requested page plus one, to tell if there is more."""
+        self.request = request
+        self.ordering = self.get_ordering(view)
+        self.size = self.get_page_size(request)
+        self.values, self.reverse = self.decode_cursor(request)
+
+        queryset = queryset.order_by(*(invert(self.ordering) if self.reverse else self.ordering))
+        if self.values is not None:
+            # A cursor that decodes can still hold values the fields reject
+            try:
+                values = self.cursor_values(queryset)
+                queryset = queryset.filter(keyset_filter(self.ordering, values, self.reverse))
+            except (ValidationError, TypeError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+        return queryset[:self.size + 1]
+
+    def cursor_values(self, queryset):
+        """The cursor's values converted by their ordering fields, or annotations."""
+        return [
+            queryset.query.resolve_ref(field.lstrip('-')).output_field.to_python(value)
+            for field, value in zip(self.ordering, self.values)
+        ]
+
+    def set_page(self, rows):
+        size, values, reverse = self.size, self.values, self.reverse
+        has_more = len(rows) > size
+        rows = rows[:size]
+        if reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, values is not None
+
+        self.page = rows
+        return rows
+
+    def boundary(self, row):
+        return [getattr(row, field.lstrip('-')) for field in self.ordering]
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        cursor = self.encode_cursor(self.boundary(self.page[-1]), reverse=False)
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        url = self.request.build_absolute_uri()
+        if not self.page:
+            return remove_query_param(url, self.cursor_query_param)
+        cursor = self.encode_cursor(self.boundary(self.page[0]), reverse=True)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class StreamingListMixin:
+    """
+    Lets staff export a whole list endpoint with ``?stream=1``.
+
+    Rows are read in chunks through a server-side cursor and serialized
+    chunk by chunk into a streamed JSON array, so memory stays flat
+    however large the table is.
+    """
+    stream_query_param = 'stream'
+    stream_chunk_size = 500
+
+    def wants_stream(self, request):
+        return bool(request.query_params.get(self.stream_query_param)) and request.user.is_staff
+
+    def list(self, request, *args, **kwargs):
+        if self.wants_stream(request):
+            queryset = self.filter_queryset(self.get_queryset())
+            if self.paginator is not None:
+                queryset = queryset.order_by(*self.paginator.get_ordering(self))
+            return StreamingHttpResponse(self.stream_rows(queryset), content_type='application/json')
+        return super().list(request, *args, **kwargs)
+
+    def stream_rows(self, queryset):
+        encoder = JSONEncoder()
+        chunk = []
+        yield '['
+        first = True
+        for row in queryset.iterator(chunk_size=self.stream_chunk_size):
+            chunk.append(row)
+            if len(chunk) == self.stream_chunk_size:
+                yield from self.stream_chunk(encoder, chunk, first)
+                chunk, first = [], False
+        if chunk:
+            yield from self.stream_chunk(encoder, chunk, first)
+        yield ']'
+
+    def stream_chunk(self, encoder, rows, first):
+        for index, item in enumerate(self.get_serializer(rows, many=True).data):
+            yield ('' if first and index == 0 else ',') + encoder.encode(item)
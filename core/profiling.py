@@ -0,0 +1,314 @@
+# core/profiling.py
+"""
+Per-request query and latency profiling.
+
+ProfilingMiddleware records, for a sample of requests:
+
+- the number of queries and the time spent in them, on every database;
+- the shape of each query, its SQL with literals replaced by ``%s`` and
+  IN and VALUES lists collapsed, so an N+1 shows up as one shape run N
+  times;
+- the time serializers built on DynamicFieldsMixin spent rendering;
+- the size of the response body.
+
+Each profiled request is logged as one JSON object on the ``profiling``
+logger, with the shapes that ran more than once. Staff users, and
+everyone while DEBUG, also get the timings in a ``Server-Timing``
+header, which browser dev tools show with the request. Shapes are added
+up per route in the cache, where ``/api/debug/queries/`` lists the
+slowest across all workers. The totals are approximate: requests
+finishing at the same time can overwrite each other's updates.
+
+Settings, in ``PROFILING``:
+
+    PROFILING = {
+        # Fraction of requests profiled
+        'SAMPLE_RATE': 1.0,
+        # Shapes kept per route for the debug endpoint
+        'SHAPES_PER_ROUTE': 20,
+        # Seconds a route's shapes are kept after its last profiled request
+        'RETENTION': 86400,
+    }
+"""
+import hashlib
+import json
+import logging
+import random
+import re
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.backends.signals import connection_created
+from rest_framework import permissions
+from rest_framework.response import Response
+from rest_framework.serializers import ListSerializer
+from rest_framework.views import APIView
+
+logger = logging.getLogger('profiling')
+
+DEFAULTS = {
+    'SAMPLE_RATE': 1.0,
+    'SHAPES_PER_ROUTE': 20,
+    'RETENTION': 24 * 60 * 60,
+}
+
+CACHE_PREFIX = 'profiling:'
+ROUTES_KEY = CACHE_PREFIX + 'routes'
+# Duplicated shapes written to each log line
+LOGGED_DUPLICATES = 10
+# Characters of a shape's SQL logged and stored
+LOGGED_SQL = 300
+STORED_SQL = 2000
+
+LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+LIST_RE = re.compile(r'\(\s*%s(?:\s*,\s*%s)*\s*\)')
+ROWS_RE = re.compile(r'\(%s, \.\.\.\)(?:\s*,\s*\(%s, \.\.\.\))+')
+# Named groups of regex routes, e.g. DRF's (?P<slug>[^/.]+)
+GROUP_RE = re.compile(r'\(\?P<(\w+)>[^)]*\)')
+
+_profile = ContextVar('profile', default=None)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'PROFILING', {})}
+
+
+def fingerprint(sql):
+    """(id, shape) of ``sql``."""
+    shape = LITERAL_RE.sub('%s', sql)
+    shape = ROWS_RE.sub('(%s, ...)', LIST_RE.sub('(%s, ...)', shape))
+    return hashlib.sha1(shape.encode()).hexdigest()[:12], shape
+
+
+class Profile:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.duration = None
+        self.queries = 0
+        self.sql_time = 0.0
+        self.serialize_time = 0.0
+        self.size = None
+        # SQL -> [count, total seconds, slowest seconds]; most repeats run
+        # the same SQL with new parameters, so it is only fingerprinted once
+        self.statements = {}
+
+    def record(self, sql, seconds):
+        self.queries += 1
+        self.sql_time += seconds
+        entry = self.statements.get(sql)
+        if entry is None:
+            self.statements[sql] = [1, seconds, seconds]
+        else:
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+
+    def shapes(self):
+        """{fingerprint: [shape, count, total seconds, slowest seconds]}"""
+        shapes = {}
+        for sql, (count, total, slowest) in self.statements.items():
+            key, shape = fingerprint(sql)
+            entry = shapes.setdefault(key, [shape, 0, 0.0, 0.0])
+            entry[1] += count
+            entry[2] += total
+            entry[3] = max(entry[3], slowest)
+        return shapes
+
+
+def record_query(execute, sql, params, many, context):
+    profile = _profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.record(sql, time.perf_counter() - start)
+
+
+def install(connection, **kwargs):
+    # First, so connection.execute_wrapper() blocks still pop their own
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
+
+
+connection_created.connect(install)
+
+
+class SerializerTimingMixin:
+    """Adds the time a top-level serializer takes to render to the request's profile."""
+
+    def to_representation(self, instance):
+        profile = _profile.get()
+        parent = self.parent
+        # Nested serializers are part of their parent's time; the items of
+        # a top-level list are timed one by one
+        top_level = parent is None or (isinstance(parent, ListSerializer) and parent.parent is None)
+        if profile is None or not top_level:
+            return super().to_representation(instance)
+        start = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            profile.serialize_time += time.perf_counter() - start
+
+
+def route_of(request):
+    match = request.resolver_match
+    if match is None:
+        return None
+    return '%s /%s' % (request.method, GROUP_RE.sub(r'<\1>', match.route.replace('^', '').replace('$', '')))
+
+
+def server_timing(profile):
+    return ', '.join([
+        'total;dur=%.1f' % (profile.duration * 1000),
+        'sql;dur=%.1f;desc="%d queries"' % (profile.sql_time * 1000, profile.queries),
+        'serialize;dur=%.1f' % (profile.serialize_time * 1000),
+    ])
+
+
+def store_shapes(route, shapes):
+    """Add a request's query shapes to the totals of ``route``."""
+    config = get_config()
+    key = CACHE_PREFIX + hashlib.sha1(route.encode()).hexdigest()[:16]
+    stored = cache.get_many([ROUTES_KEY, key])
+    routes = stored.get(ROUTES_KEY, {})
+    totals = stored.get(key, {})
+    for digest, (shape, count, total, slowest) in shapes.items():
+        entry = totals.setdefault(digest, [shape[:STORED_SQL], 0, 0.0, 0.0])
+        entry[1] += count
+        entry[2] += total
+        entry[3] = max(entry[3], slowest)
+    kept = sorted(totals.items(), key=lambda item: item[1][2], reverse=True)[:config['SHAPES_PER_ROUTE']]
+    routes[route] = key
+    cache.set_many({ROUTES_KEY: routes, key: dict(kept)}, config['RETENTION'])
+
+
+def slowest_shapes(route=None):
+    """Each route's stored query shapes, slowest in total first, routes by their SQL time."""
+    routes = cache.get(ROUTES_KEY, {})
+    if route is not None:
+        routes = {route: routes[route]} if route in routes else {}
+    stored = cache.get_many(list(routes.values()))
+    result = []
+    for name, key in routes.items():
+        shapes = [
+            {
+                'fingerprint': digest, 'sql': shape, 'count': count,
+                'total_ms': round(total * 1000, 2), 'mean_ms': round(total * 1000 / count, 2),
+                'max_ms': round(slowest * 1000, 2),
+            }
+            for digest, (shape, count, total, slowest) in stored.get(key, {}).items()
+        ]
+        if shapes:
+            shapes.sort(key=lambda shape: shape['total_ms'], reverse=True)
+            result.append({'route': name, 'shapes': shapes})
+    result.sort(key=lambda entry: sum(shape['total_ms'] for shape in entry['shapes']), reverse=True)
+    return result
+
+
+class ProfilingMiddleware:
+    """Profiles ``PROFILING['SAMPLE_RATE']`` of requests; see the module docstring."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        profile = self.sample()
+        if profile is None:
+            return self.get_response(request)
+        token = _profile.set(profile)
+        try:
+            response = self.get_response(request)
+        finally:
+            _profile.reset(token)
+        return self.finish(request, response, profile)
+
+    async def __acall__(self, request):
+        profile = self.sample()
+        if profile is None:
+            return await self.get_response(request)
+        token = _profile.set(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _profile.reset(token)
+        return self.finish(request, response, profile)
+
+    def sample(self):
+        if random.random() >= get_config()['SAMPLE_RATE']:
+            return None
+        # Connections made before this module was imported
+        for connection in connections.all():
+            install(connection)
+        return Profile()
+
+    def finish(self, request, response, profile):
+        if not response.streaming:
+            profile.size = len(response.content)
+        elif not response.is_async:
+            # Streamed bodies are read after this returns; report once sent
+            response.streaming_content = self.stream(request, response, response.streaming_content, profile)
+            return response
+        profile.duration = time.perf_counter() - profile.start
+        user = getattr(request, 'user', None)
+        if settings.DEBUG or (user is not None and user.is_staff):
+            response['Server-Timing'] = server_timing(profile)
+        self.report(request, response, profile)
+        return response
+
+    def stream(self, request, response, content, profile):
+        content = iter(content)
+        profile.size = 0
+        while True:
+            # Queries run while the body is generated count too
+            token = _profile.set(profile)
+            try:
+                chunk = next(content, None)
+            finally:
+                _profile.reset(token)
+            if chunk is None:
+                break
+            profile.size += len(chunk)
+            yield chunk
+        profile.duration = time.perf_counter() - profile.start
+        self.report(request, response, profile)
+
+    def report(self, request, response, profile):
+        route = route_of(request)
+        shapes = profile.shapes()
+        duplicates = sorted(
+            ((key, shape, count) for key, (shape, count, _, _) in shapes.items() if count > 1),
+            key=lambda duplicate: duplicate[2], reverse=True,
+        )
+        logger.info(json.dumps({
+            'method': request.method, 'path': request.path, 'route': route, 'status': response.status_code,
+            'duration_ms': round(profile.duration * 1000, 2), 'queries': profile.queries,
+            'sql_ms': round(profile.sql_time * 1000, 2), 'serialize_ms': round(profile.serialize_time * 1000, 2),
+            'bytes': profile.size,
+            'duplicates': [
+                {'fingerprint': key, 'count': count, 'sql': shape[:LOGGED_SQL]}
+                for key, shape, count in duplicates[:LOGGED_DUPLICATES]
+            ],
+        }))
+        if route is not None and shapes:
+            store_shapes(route, shapes)
+
+
+class QueryShapesView(APIView):
+    """The slowest query shapes of each profiled route, or of ``?route=`` alone."""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(slowest_shapes(request.query_params.get('route')))
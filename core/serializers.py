@@ -0,0 +1,102 @@
+# core/serializers.py
+"""
+Sparse fieldsets and expandable relations.
+
+``?fields=`` lists the fields to return; dotted names reach into nested
+serializers, so ``?fields=id,items.product.name`` returns each order's id
+and the names of the products on it. A nested field named without a dot
+is returned whole.
+
+Relations listed in ``Meta.expandable_fields`` are left out of
+collection responses (``many=True``) unless named in ``?expand=`` or in
+``?fields=``; single objects always include them.
+
+Only GET requests are affected. Views use ``requested(view, path)`` to
+join and prefetch only what the serializer will render.
+"""
+from rest_framework import serializers
+
+from .profiling import SerializerTimingMixin
+
+
+def parse_paths(value):
+    """``'a,b.c,b.d'`` -> ``{'a': {}, 'b': {'c': {}, 'd': {}}}``"""
+    tree = {}
+    for path in filter(None, (part.strip() for part in value.split(','))):
+        node = tree
+        for name in path.split('.'):
+            node = node.setdefault(name, {})
+    return tree
+
+
+def subtree(tree, path):
+    """The part of ``tree`` below ``path``; None where it is not restricted."""
+    for name in path:
+        if not tree:
+            return None
+        tree = tree.get(name)
+    return tree or None
+
+
+class DynamicFieldsMixin(SerializerTimingMixin):
+    @staticmethod
+    def options(request):
+        """(selected, expanded) path trees for ``request``; None when not restricted."""
+        if request is None or request.method != 'GET':
+            return None, None
+        return (
+            parse_paths(request.query_params.get('fields', '')) or None,
+            parse_paths(request.query_params.get('expand', '')) or None,
+        )
+
+    @staticmethod
+    def keep(name, selected, expanded, expandable, collection):
+        if selected is not None and name not in selected:
+            return False
+        if collection and name in expandable:
+            return name in (expanded or {}) or selected is not None
+        return True
+
+    def field_path(self):
+        path = []
+        node = self
+        while node.parent is not None:
+            # A ListSerializer's child is bound without a name
+            if node.field_name:
+                path.append(node.field_name)
+            node = node.parent
+        return path[::-1]
+
+    def get_fields(self):
+        fields = super().get_fields()
+        selected, expanded = self.options(self.context.get('request'))
+        path = self.field_path()
+        selected, expanded = subtree(selected, path), subtree(expanded, path)
+        expandable = getattr(self.Meta, 'expandable_fields', ())
+        collection = isinstance(self.root, serializers.ListSerializer)
+        return {
+            name: field for name, field in fields.items()
+            if self.keep(name, selected, expanded, expandable, collection)
+        }
+
+    @classmethod
+    def includes(cls, request, path, many=False):
+        """Whether the field at dotted ``path`` will be rendered."""
+        selected, expanded = cls.options(request)
+        serializer_class = cls
+        for name in path.split('.'):
+            expandable = getattr(serializer_class.Meta, 'expandable_fields', ())
+            if not cls.keep(name, selected, expanded, expandable, many):
+                return False
+            selected, expanded = subtree(selected, [name]), subtree(expanded, [name])
+            field = serializer_class._declared_fields.get(name)
+            serializer_class = type(getattr(field, 'child', field))
+            if not hasattr(serializer_class, 'Meta'):
+                break
+        return True
+
+
+def requested(view, path):
+    """Whether ``view``'s serializer will render the field at ``path``."""
+    collection = view.action in getattr(view, 'collection_actions', ('list',))
+    return view.get_serializer_class().includes(view.request, path, many=collection)
@@ -0,0 +1,185 @@
+import threading
+import time
+from unittest import mock, skipUnless
+
+from django.db import OperationalError, connection
+from django.test import SimpleTestCase
+from psycopg2 import extensions
+
+from core.db.postgresql_pool.base import DatabaseWrapper as PooledDatabaseWrapper
+from core.db.postgresql_pool.pool import ConnectionPool, PoolTimeout
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+        self.alive = True
+        # An Event the next query waits on, as if the server stopped answering
+        self.hang = None
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+
+    def get_transaction_status(self):
+        return self.status
+
+    def cursor(self):
+        if self.hang is not None:
+            self.hang.wait()
+            self.alive = False
+        if not self.alive:
+            raise OperationalError('server closed the connection unexpectedly')
+        return mock.MagicMock()
+
+    def rollback(self):
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    def make_pool(self, **options):
+        self.opened = []
+
+        def connect():
+            self.opened.append(FakeConnection())
+            return self.opened[-1]
+        return ConnectionPool(connect, options)
+
+    def test_returned_connections_are_reused(self):
+        pool = self.make_pool()
+        first = pool.getconn()
+        pool.putconn(first)
+        self.assertIs(pool.getconn(), first)
+        self.assertEqual(len(self.opened), 1)
+
+    def test_waits_for_a_connection_when_full(self):
+        pool = self.make_pool(MAX_SIZE=1, TIMEOUT=5)
+        held = pool.getconn()
+        timer = threading.Timer(0.1, pool.putconn, [held])
+        timer.start()
+        self.assertIs(pool.getconn(), held)
+        timer.join()
+
+        pool = self.make_pool(MAX_SIZE=1, TIMEOUT=0.05)
+        pool.getconn()
+        with self.assertRaises(PoolTimeout):
+            pool.getconn()
+
+    def test_open_transactions_are_rolled_back(self):
+        pool = self.make_pool()
+        connection = pool.getconn()
+        connection.status = extensions.TRANSACTION_STATUS_INERROR
+        pool.putconn(connection)
+        self.assertIs(pool.getconn(), connection)
+        self.assertEqual(connection.status, extensions.TRANSACTION_STATUS_IDLE)
+
+    def test_broken_connections_are_replaced(self):
+        pool = self.make_pool(MAX_SIZE=1, CHECK_AFTER=0)
+        connection = pool.getconn()
+        pool.putconn(connection)
+        connection.alive = False
+        replacement = pool.getconn()
+        self.assertIsNot(replacement, connection)
+        self.assertTrue(connection.closed)
+
+        pool.putconn(replacement, discard=True)
+        self.assertTrue(replacement.closed)
+        self.assertEqual(pool.size, 0)
+
+    def test_health_check_does_not_block_other_threads(self):
+        pool = self.make_pool(MAX_SIZE=2, CHECK_AFTER=0)
+        healthy, hung = pool.getconn(), pool.getconn()
+        pool.putconn(healthy)
+        pool.putconn(hung)
+        hung.hang = threading.Event()
+        checking = threading.Thread(target=lambda: self.opened.append(pool.getconn()))
+        checking.start()
+        while not pool.idle or pool.idle[-1][0] is not healthy:
+            time.sleep(0.001)
+
+        # Taken while the other thread still waits on the hung server
+        release = threading.Timer(2, hung.hang.set)
+        release.start()
+        started = time.monotonic()
+        self.assertIs(pool.getconn(), healthy)
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertTrue(checking.is_alive())
+        release.cancel()
+        hung.hang.set()
+        checking.join()
+        self.assertTrue(hung.closed)
+        self.assertEqual(pool.size, 2)
+
+    def test_expired_idle_connections_are_closed_outside_the_lock(self):
+        pool = self.make_pool()
+        stale = pool.getconn()
+        pool.putconn(stale)
+        stale, opened_at, returned_at = pool.idle.pop()
+        pool.idle.append((stale, opened_at, returned_at - pool.options['MAX_IDLE']))
+
+        locked = []
+
+        def probe():
+            if pool.condition.acquire(blocking=False):
+                pool.condition.release()
+                locked.append(False)
+            else:
+                locked.append(True)
+
+        def close():
+            thread = threading.Thread(target=probe)
+            thread.start()
+            thread.join()
+            stale.closed = True
+        stale.close = close
+
+        self.assertIsNot(pool.getconn(), stale)
+        self.assertTrue(stale.closed)
+        self.assertEqual(locked, [False])
+        self.assertEqual(pool.size, 1)
+
+    def test_old_connections_are_closed(self):
+        pool = self.make_pool(MAX_LIFETIME=0)
+        connection = pool.getconn()
+        pool.putconn(connection)
+        self.assertTrue(connection.closed)
+        self.assertEqual((pool.size, pool.idle), (0, []))
+
+
+@skipUnless(connection.vendor == 'postgresql', 'requires PostgreSQL')
+class PooledBackendTests(SimpleTestCase):
+    # contrib.postgres looks up type OIDs through connections[alias]
+    databases = {'default'}
+
+    def make_wrapper(self, **options):
+        settings_dict = {
+            **connection.settings_dict,
+            'ENGINE': 'core.db.postgresql_pool',
+            'OPTIONS': {'pool': {'MAX_SIZE': 2, 'CHECK_AFTER': 0}, **options},
+        }
+        return PooledDatabaseWrapper(settings_dict, alias=connection.alias)
+
+    def backend_pid(self, wrapper):
+        with wrapper.cursor() as cursor:
+            cursor.execute('SELECT pg_backend_pid()')
+            return cursor.fetchone()[0]
+
+    def test_close_returns_the_connection(self):
+        wrapper = self.make_wrapper(options='-c statement_timeout=1500')
+        pid = self.backend_pid(wrapper)
+        self.addCleanup(wrapper.pool.close_idle)
+        wrapper.close()
+        self.assertEqual(self.backend_pid(wrapper), pid)
+        with wrapper.cursor() as cursor:
+            cursor.execute('SHOW statement_timeout')
+            self.assertEqual(cursor.fetchone()[0], '1500ms')
+        wrapper.close()
+
+        # A connection the server dropped is swapped for a new one
+        other = self.make_wrapper()
+        with other.cursor() as cursor:
+            cursor.execute('SELECT pg_terminate_backend(%s)', [pid])
+        other.close()
+        self.addCleanup(other.pool.close_idle)
+        self.assertNotEqual(self.backend_pid(wrapper), pid)
+        wrapper.close()
@@ -0,0 +1,116 @@
+import json
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from apps.accounts.models import User
+from apps.products.category_tree import get_category_tree
+from apps.products.models import Category, Product, ProductImage, ProductVariant
+from core.profiling import Profile, fingerprint
+
+
+class ProfilingTests(TestCase):
+    url = '/api/products/products/'
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Shoes')
+        for index in range(3):
+            product = Product.objects.create(
+                name=f'Product {index}', category=category, description='Description',
+                price=Decimal('20.00'), stock_quantity=10, weight=Decimal('0.50')
+            )
+            ProductImage.objects.create(product=product, image=f'products/{index}.jpg', is_primary=True)
+            ProductVariant.objects.create(
+                product=product, name='Size', value='M', price_adjustment=Decimal('0'), stock_quantity=5
+            )
+        cls.staff = User.objects.create_user(
+            email='staff@example.com', username='staff', password='secret', is_staff=True
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+        get_category_tree()
+
+    def get(self, url, **kwargs):
+        with self.assertLogs('profiling', 'INFO') as logs:
+            response = self.client.get(url, **kwargs)
+            body = b''.join(response.streaming_content) if response.streaming else response.content
+        self.assertEqual(len(logs.records), 1)
+        return response, body, json.loads(logs.records[0].getMessage())
+
+    def test_request_is_logged_with_timings_header(self):
+        response, body, line = self.get(self.url)
+        self.assertEqual(line['route'], 'GET /api/products/products/')
+        self.assertEqual(line['status'], 200)
+        # products + categories, images, variants
+        self.assertEqual(line['queries'], 3)
+        self.assertEqual(line['duplicates'], [])
+        self.assertEqual(line['bytes'], len(body))
+        self.assertGreater(line['serialize_ms'], 0)
+        self.assertRegex(response['Server-Timing'], r'^total;dur=[\d.]+, sql;dur=[\d.]+;desc="3 queries", serialize;dur=')
+
+    def test_streamed_responses_are_logged_once_sent(self):
+        response, body, line = self.get(self.url, data={'stream': 1})
+        self.assertEqual(line['bytes'], len(body))
+        self.assertEqual(len(json.loads(body)), 3)
+        self.assertGreaterEqual(line['queries'], 1)
+
+    async def test_async_views_are_profiled(self):
+        with self.assertLogs('profiling', 'INFO') as logs:
+            response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual(line['queries'], 3)
+        self.assertGreater(line['serialize_ms'], 0)
+
+    def test_timings_header_is_for_staff(self):
+        self.client.force_authenticate(None)
+        response, _, _ = self.get(self.url)
+        self.assertNotIn('Server-Timing', response)
+
+    @override_settings(PROFILING={'SAMPLE_RATE': 0})
+    def test_sampling(self):
+        with self.assertNoLogs('profiling'):
+            response = self.client.get(self.url)
+        self.assertNotIn('Server-Timing', response)
+
+    def test_query_shapes(self):
+        self.assertEqual(
+            fingerprint('SELECT * FROM t WHERE id IN (%s, %s, %s) AND name = \'x\' LIMIT 21')[1],
+            'SELECT * FROM t WHERE id IN (%s, ...) AND name = %s LIMIT %s',
+        )
+        self.assertEqual(
+            fingerprint('INSERT INTO t (a, b) VALUES (%s, %s), (%s, %s), (%s, %s)')[1],
+            'INSERT INTO t (a, b) VALUES (%s, ...)',
+        )
+        # An N+1 is one shape run many times, whatever the list lengths
+        profile = Profile()
+        for ids in ['%s', '%s, %s', '%s']:
+            profile.record('SELECT * FROM t WHERE id IN (%s)' % ids, 0.001)
+        profile.record('SELECT 1', 0.002)
+        shapes = sorted(profile.shapes().values(), key=lambda shape: shape[1])
+        self.assertEqual([(shape[0], shape[1]) for shape in shapes], [
+            ('SELECT %s', 1), ('SELECT * FROM t WHERE id IN (%s, ...)', 3),
+        ])
+
+    def test_debug_endpoint_lists_slowest_shapes_per_route(self):
+        self.get(self.url)
+        self.get(self.url)
+        self.get('/api/products/categories/')
+        response = self.client.get('/api/debug/queries/', {'route': 'GET /api/products/products/'})
+        self.assertEqual(response.status_code, 200)
+        [route] = response.data
+        self.assertEqual(route['route'], 'GET /api/products/products/')
+        self.assertEqual(len(route['shapes']), 3)
+        self.assertEqual({shape['count'] for shape in route['shapes']}, {2})
+        totals = [shape['total_ms'] for shape in route['shapes']]
+        self.assertEqual(totals, sorted(totals, reverse=True))
+
+        self.assertEqual(len(self.client.get('/api/debug/queries/').data), 2)
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get('/api/debug/queries/').status_code, 401)
@@ -0,0 +1,126 @@
+import time
+from decimal import Decimal
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import OperationalError, connections, transaction
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from apps.accounts.models import Address, User
+from apps.products.models import Category, Product
+from core import versioning
+from core.db import replicas
+
+
+REPLICAS = {'ALIASES': ['replica'], 'MAX_LAG': 5, 'LAG_CHECK_INTERVAL': 0, 'STICKY_SECONDS': 10}
+
+
+@override_settings(DATABASE_REPLICAS=REPLICAS)
+class ReplicaRoutingTests(TransactionTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # A second connection to the test database stands in for a replica.
+        # Added after the test databases are set up, which leaves it out of
+        # their creation and flushing.
+        connections.settings['replica'] = dict(connections['default'].settings_dict)
+
+    @classmethod
+    def tearDownClass(cls):
+        connections['replica'].close()
+        del connections['replica']
+        del connections.settings['replica']
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        replicas._lag.clear()
+        self.user = User.objects.create_user(
+            email='buyer@example.com', username='buyer', password='secret'
+        )
+        self.address = Address.objects.create(
+            user=self.user, street_address='1 Marina', city='Lagos',
+            state='LA', phone_number='08000000000'
+        )
+        self.product = Product.objects.create(
+            name='Lamp', category=Category.objects.create(name='Lighting'), description='Bright',
+            price=Decimal('20.00'), stock_quantity=10, weight=Decimal('1.00')
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def read_from(self, path, table):
+        """Which database the queries on ``table`` went to."""
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica']) as replica:
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        used = {
+            alias for alias, ctx in (('default', primary), ('replica', replica))
+            if any(table in query['sql'] for query in ctx.captured_queries)
+        }
+        self.assertEqual(len(used), 1, used)
+        return used.pop()
+
+    def checkout(self):
+        response = self.client.post('/api/orders/orders/', {
+            'shipping_address_id': self.address.pk,
+            'items': [{'product_id': self.product.pk, 'quantity': 1}],
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response
+
+    def test_order_history_reads_from_the_replica(self):
+        self.assertEqual(self.read_from('/api/orders/orders/', 'orders_order'), 'replica')
+        self.assertEqual(self.read_from('/api/orders/orders/pending/', 'orders_order'), 'replica')
+
+    def test_client_that_wrote_reads_from_the_primary(self):
+        self.checkout()
+        self.assertIn(replicas.PIN_COOKIE, self.client.cookies)
+        self.assertEqual(self.read_from('/api/orders/orders/', 'orders_order'), 'default')
+
+        # The user's other clients are pinned too, until the pin expires
+        self.client.cookies.clear()
+        self.assertEqual(self.read_from('/api/orders/orders/', 'orders_order'), 'default')
+        cache.delete(replicas.pin_key(self.user.pk))
+        self.assertEqual(self.read_from('/api/orders/orders/', 'orders_order'), 'replica')
+
+    def test_lagging_or_unreachable_replica_is_skipped(self):
+        with mock.patch('core.db.replicas.measure_lag', return_value=30):
+            self.assertEqual(self.read_from('/api/orders/orders/', 'orders_order'), 'default')
+        with mock.patch('core.db.replicas.measure_lag', side_effect=OperationalError):
+            self.assertEqual(self.read_from('/api/orders/orders/', 'orders_order'), 'default')
+
+    def test_catalog_reads_from_the_replica(self):
+        # Written just now, so a replica could still be missing it
+        self.assertEqual(self.read_from('/api/products/products/', 'products_product'), 'default')
+
+        cache.clear()
+        with override_settings(DATABASE_REPLICAS={**REPLICAS, 'MAX_LAG': 0}):
+            self.assertEqual(self.read_from('/api/products/products/', 'products_product'), 'replica')
+            path = '/api/products/products/%s/' % self.product.slug
+            self.assertEqual(self.read_from(path, 'products_product'), 'replica')
+
+    def test_writes_and_transactions_use_the_primary(self):
+        with replicas.replica_reads('replica'):
+            product = Product.objects.get(pk=self.product.pk)
+            self.assertEqual(product._state.db, 'replica')
+            with CaptureQueriesContext(connections['default']) as primary:
+                product.save()
+            self.assertTrue(any('UPDATE' in query['sql'] for query in primary.captured_queries))
+
+            with transaction.atomic():
+                self.assertEqual(Product.objects.get(pk=self.product.pk)._state.db, 'default')
+
+    def test_replicas_are_not_migrated(self):
+        router = replicas.ReplicaRouter()
+        self.assertFalse(router.allow_migrate('replica', 'orders'))
+        self.assertIsNone(router.allow_migrate('default', 'orders'))
+
+    def test_changed_within(self):
+        self.assertTrue(versioning.changed_within([versioning._new_token()], 5))
+        self.assertFalse(versioning.changed_within(['%d.x' % ((time.time() - 60) * 1000)], 5))
+        # Tokens from before they carried a timestamp
+        self.assertFalse(versioning.changed_within(['0123abcd'], 5))
@@ -0,0 +1,91 @@
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from apps.accounts.models import User
+from core import throttling
+
+
+def throttle_rates(**rates):
+    return override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': rates})
+
+
+class ThrottlingTests(TestCase):
+    url = '/api/products/products/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user(
+            email='staff@example.com', username='staff', password='secret', is_staff=True
+        )
+
+    def setUp(self):
+        cache.clear()
+        throttling.get_limiter.cache_clear()
+
+    @throttle_rates(catalog='3/min')
+    def test_anonymous_catalog_reads_are_limited_per_client(self):
+        client = APIClient()
+        for _ in range(3):
+            self.assertEqual(client.get(self.url).status_code, 200)
+        response = client.get('/api/products/categories/root/')
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+
+        # Another address has its own bucket, and signed-in users are not limited
+        self.assertEqual(client.get(self.url, REMOTE_ADDR='10.0.0.2').status_code, 200)
+        client.force_authenticate(self.staff)
+        self.assertEqual(client.get(self.url).status_code, 200)
+
+    def test_sliding_window(self):
+        with mock.patch('core.throttling.time.monotonic') as clock:
+            clock.return_value = 1000.0
+            limiter = throttling.LocalLimiter()
+            self.assertEqual([limiter.hit('key', 2, 10) for _ in range(2)], [0, 0])
+            # Refused requests count too
+            self.assertAlmostEqual(limiter.hit('key', 2, 10), 16 + 2 / 3)
+            self.assertEqual(limiter.hit('other', 2, 10), 0)
+            # The previous window's three requests still count for 30%
+            clock.return_value = 1017.0
+            self.assertEqual(limiter.hit('key', 2, 10), 0)
+            self.assertAlmostEqual(limiter.hit('key', 2, 10), 8)
+
+            # Finished windows are swept
+            clock.return_value = 1100.0
+            limiter.hit('key', 2, 10)
+            self.assertEqual(set(limiter.counters), {('key', 10, 110.0)})
+
+    def test_concurrent_requests_are_each_counted(self):
+        limiter = throttling.LocalLimiter()
+        with ThreadPoolExecutor(8) as pool:
+            allowed = sum(1 for wait in pool.map(lambda _: limiter.hit('key', 500, 60), range(800)) if not wait)
+        self.assertEqual(allowed, 500)
+
+    def test_falls_back_to_local_counts_when_redis_is_down(self):
+        # Nothing listens on port 1
+        limiter = throttling.Limiter('redis://127.0.0.1:1/0', timeout=0.05, fallback_seconds=30)
+        with self.assertLogs('core.throttling', 'WARNING'):
+            self.assertEqual(limiter.hit('key', 1, 60), 0)
+        with mock.patch.object(limiter.redis, 'hit') as redis_hit:
+            self.assertGreater(limiter.hit('key', 1, 60), 0)
+        redis_hit.assert_not_called()
+
+    @skipUnless(os.getenv('REDIS_URL'), 'requires REDIS_URL')
+    def test_redis_token_bucket(self):
+        limiter = throttling.RedisLimiter(os.getenv('REDIS_URL'), timeout=1)
+        key = 'throttle_test_%s' % uuid.uuid4().hex
+        try:
+            self.assertEqual([limiter.hit(key, 3, 0.3) for _ in range(3)], [0, 0, 0])
+            self.assertAlmostEqual(limiter.hit(key, 3, 0.3), 0.1, delta=0.02)
+            # Tokens come back at the rate, here one every 100 ms
+            time.sleep(0.11)
+            self.assertEqual(limiter.hit(key, 3, 0.3), 0)
+        finally:
+            limiter.client.delete(key)
@@ -0,0 +1,36 @@
+from unittest import skipUnless
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+requires_query_plans = skipUnless(
+    connection.vendor in ('postgresql', 'sqlite'), 'plans are read from EXPLAIN output'
+)
+
+
+def explain(sql):
+    prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+    with connection.cursor() as cursor:
+        cursor.execute(prefix + sql)
+        return '\n'.join(' '.join(map(str, row)) for row in cursor.fetchall())
+
+
+def analyze():
+    """Refresh the planner's statistics after a bulk load."""
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+
+class QueryPlanMixin:
+    """For tests that the hot queries use the indexes meant for them."""
+
+    def plan_of(self, path, table):
+        """Plan of the query an endpoint runs on ``table``."""
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        sql = next(
+            query['sql'] for query in ctx.captured_queries
+            if query['sql'].startswith('SELECT') and 'FROM "%s"' % table in query['sql']
+        )
+        return explain(sql)
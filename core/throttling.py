@@ -0,0 +1,224 @@
+# core/throttling.py
+"""
+Request throttling for DRF views, shared by every worker through Redis.
+
+Each scope's rate comes from DRF's ``DEFAULT_THROTTLE_RATES``, e.g.
+``'login': '10/min'``, and is enforced as a token bucket. A client can
+burst up to the whole rate at once, and then gets one request every
+``duration / rate`` seconds. The bucket lives in Redis and one Lua
+script updates it, so a check is one round trip. Concurrent requests
+from any number of workers cannot both take the last token. The script
+reads Redis' clock, so the workers' clocks do not need to agree.
+
+Without ``THROTTLING['REDIS_URL']``, or for ``FALLBACK_SECONDS`` after
+Redis failed to answer, each process limits on its own with a sliding
+window. Requests are counted per fixed window with ``itertools.count``,
+whose ``next()`` is atomic, so threads never wait on a lock. The window
+before counts in proportion to how much of it still overlaps the last
+``duration`` seconds. Refused requests count too. In this mode the rate
+applies to each process rather than across all of them.
+
+    THROTTLING = {
+        'REDIS_URL': 'redis://localhost:6379/1',
+        # Seconds to wait for Redis before falling back
+        'TIMEOUT': 0.05,
+        # Seconds the in-process limiter is used after Redis failed
+        'FALLBACK_SECONDS': 30,
+    }
+"""
+import itertools
+import logging
+import time
+from functools import lru_cache
+
+import redis
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from rest_framework.settings import api_settings
+from rest_framework.throttling import SimpleRateThrottle
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'REDIS_URL': None,
+    'TIMEOUT': 0.05,
+    'FALLBACK_SECONDS': 30,
+}
+
+# Seconds between sweeps of the in-process limiter's finished windows
+PRUNE_INTERVAL = 60
+
+# KEYS[1]: the bucket; ARGV: capacity, seconds per token.
+# Returns the seconds until a token is free, "0" when one was taken.
+TOKEN_BUCKET = """
+redis.replicate_commands()
+local capacity = tonumber(ARGV[1])
+local interval = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'at')
+local tokens = tonumber(bucket[1]) or capacity
+local at = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - at) / interval)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) * interval
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'at', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity * interval * 1000))
+return tostring(wait)
+"""
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'THROTTLING', {})}
+
+
+class RedisLimiter:
+    """Token buckets in Redis, shared by every process."""
+
+    def __init__(self, url, timeout):
+        self.client = redis.Redis.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout)
+        # EVALSHA, loading the script on the first call to each server
+        self.script = self.client.register_script(TOKEN_BUCKET)
+
+    def hit(self, key, limit, duration):
+        return float(self.script(keys=[key], args=[limit, duration / limit]))
+
+
+class LocalLimiter:
+    """Sliding windows in this process, see the module docstring."""
+
+    def __init__(self):
+        # (key, duration, window) -> itertools.count of its requests
+        self.counters = {}
+        # (key, duration, window) -> the count its last request got
+        self.counts = {}
+        self.next_prune = time.monotonic() + PRUNE_INTERVAL
+
+    def hit(self, key, limit, duration):
+        now = time.monotonic()
+        window, elapsed = divmod(now, duration)
+        name = (key, duration, window)
+        counter = self.counters.get(name)
+        if counter is None:
+            counter = self.counters.setdefault(name, itertools.count(1))
+        count = self.counts[name] = next(counter)
+        previous = self.counts.get((key, duration, window - 1), 0)
+        if now >= self.next_prune:
+            self.prune(now)
+        overlap = 1 - elapsed / duration
+        if previous * overlap + count <= limit:
+            return 0.0
+        # Seconds until one more request would fit
+        if count < limit:
+            # Once enough of the previous window has slid out
+            return duration * (1 - (limit - count - 1) / previous) - elapsed
+        # Once enough of this window has slid out, in the next one
+        return duration - elapsed + duration * (1 - (limit - 1) / count)
+
+    def prune(self, now):
+        self.next_prune = now + PRUNE_INTERVAL
+        for name in list(self.counters):
+            _, duration, window = name
+            if window < now // duration - 1:
+                self.counters.pop(name, None)
+                self.counts.pop(name, None)
+
+
+class Limiter:
+    """Redis when configured and answering, this process' own counters otherwise."""
+
+    def __init__(self, redis_url=None, timeout=0.05, fallback_seconds=30):
+        self.redis = RedisLimiter(redis_url, timeout) if redis_url else None
+        self.local = LocalLimiter()
+        self.fallback_seconds = fallback_seconds
+        self.fallback_until = 0.0
+
+    def hit(self, key, limit, duration):
+        """Count a request against ``limit`` per ``duration`` seconds; returns the seconds to wait, 0 if allowed."""
+        if self.redis is not None and time.monotonic() >= self.fallback_until:
+            try:
+                return self.redis.hit(key, limit, duration)
+            except redis.RedisError:
+                logger.warning('Throttling in-process for %ds: Redis is unavailable', self.fallback_seconds,
+                               exc_info=True)
+                self.fallback_until = time.monotonic() + self.fallback_seconds
+        return self.local.hit(key, limit, duration)
+
+
+@lru_cache(maxsize=None)
+def get_limiter():
+    config = get_config()
+    return Limiter(config['REDIS_URL'], config['TIMEOUT'], config['FALLBACK_SECONDS'])
+
+
+@receiver(setting_changed)
+def reset_limiter(setting, **kwargs):
+    if setting in ('THROTTLING', 'REST_FRAMEWORK'):
+        get_limiter.cache_clear()
+
+
+class TokenBucketThrottle(SimpleRateThrottle):
+    """
+    SimpleRateThrottle checked against the shared limiter rather than a
+    list of request times in the cache, which every request rewrote.
+    """
+
+    def get_rate(self):
+        # Read on each use rather than once at import, so rates can be
+        # changed with override_settings
+        return api_settings.DEFAULT_THROTTLE_RATES.get(self.scope)
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+        self.delay = get_limiter().hit(self.key, self.num_requests, self.duration)
+        return self.delay == 0
+
+    def wait(self):
+        return self.delay
+
+
+class CatalogRateThrottle(TokenBucketThrottle):
+    """Anonymous catalog reads, per client IP; signed-in users are not limited."""
+    scope = 'catalog'
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return None
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_ident(request)}
+
+
+class LoginRateThrottle(TokenBucketThrottle):
+    """Sign-up and sign-in attempts, per client IP."""
+    scope = 'login'
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_ident(request)}
+
+
+class QuoteRateThrottle(TokenBucketThrottle):
+    """Shipping quotes, per client IP."""
+    scope = 'quote'
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_ident(request)}
+
+
+class CheckoutRateThrottle(TokenBucketThrottle):
+    """Orders placed, per user."""
+    scope = 'checkout'
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            ident = request.user.pk
+        else:
+            ident = self.get_ident(request)
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
@@ -0,0 +1,58 @@
+# core/versioning.py
+"""
+Version tokens for in-process and response caches.
+
+A token lives in the shared Django cache and is replaced on every write
+to the data it covers. Each process remembers the token it built its
+copy from and rebuilds when the current token differs. Tokens start with
+the time they were issued, so readers can tell how recent a write is.
+"""
+import time
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+def _key(name):
+    return 'version:%s' % name
+
+
+def _new_token():
+    return '%d.%s' % (time.time() * 1000, uuid.uuid4().hex)
+
+
+def changed_within(tokens, seconds):
+    """Whether any of ``tokens`` was issued in the last ``seconds``."""
+    cutoff = (time.time() - seconds) * 1000
+    for token in tokens:
+        # Tokens issued before they carried a time are old by now
+        issued, _, _ = str(token).partition('.')
+        if issued.isdigit() and int(issued) >= cutoff:
+            return True
+    return False
+
+
+def get_version(name):
+    version = cache.get(_key(name))
+    if version is None:
+        cache.add(_key(name), _new_token(), None)
+        version = cache.get(_key(name))
+    return version
+
+
+def get_versions(names):
+    """Current tokens for several names with a single cache round trip."""
+    found = cache.get_many([_key(name) for name in names])
+    return {name: found.get(_key(name)) or get_version(name) for name in names}
+
+
+def bump_version(name):
+    cache.set(_key(name), _new_token(), None)
+
+
+def bump_version_on_commit(name):
+    # Bump now so this process sees its own write, and again after commit
+    # so no other worker keeps a copy it built before the commit
+    bump_version(name)
+    transaction.on_commit(lambda: bump_version(name))